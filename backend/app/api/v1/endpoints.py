@@ -8,17 +8,23 @@ from app.services.tree_builder_service import TreeBuilderService
 from fastapi import APIRouter, UploadFile, File, BackgroundTasks, Form, HTTPException
 import uuid
 import os
+import re
+import asyncio
 from typing import Optional, List
 
 # 导入我们设计的任务管理器、后台任务、Pydantic模型和服务
 from ...tasks import task_manager
 from ...tasks.background_tasks import run_url_processing_task, run_file_processing_task
-from ...models.schemas import TaskStatusResponse, QueryRequest, GenerateMaterialRequest, DocumentTreeNode
-from ...services.tree_builder_service import TreeBuilderService
+from ...models.schemas import TaskStatusResponse, QueryRequest, BatchQueryRequest, BatchQueryResponse, GenerateMaterialRequest, DocumentTreeNode
+from ...services.tree_builder_service import TreeBuilderService, TREE_CACHE_DIR
+from ...services.build_orchestrator import build_orchestrator
+from ...raptor.cache import get_query_embedding_cache
 
 router = APIRouter()
 UPLOAD_DIR = "./uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+# doc_id 会拼进缓存与上传文件路径，只允许服务端生成的 UUID 所用的字符
+DOC_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
 
 @router.post("/query/precise")
 async def query_precise(request: QueryRequest):
@@ -32,29 +38,47 @@ async def process_document_source(
     background_tasks: BackgroundTasks,
     source_type: str = Form(...),
     url: Optional[str] = Form(None),
-    file: Optional[UploadFile] = File(None)
+    file: Optional[UploadFile] = File(None),
+    doc_id: Optional[str] = Form(None)
 ):
+    # 传入已有文档的doc_id时，新内容增量加入该文档的树 (如课程每周新增的录播)，而不是重建
+    append = doc_id is not None
+    if append and (
+        not DOC_ID_PATTERN.fullmatch(doc_id)
+        or not os.path.exists(os.path.join(TREE_CACHE_DIR, f"{doc_id}.pkl"))
+    ):
+        raise HTTPException(status_code=400, detail="doc_id must refer to an existing, fully built document")
     task_id = str(uuid.uuid4())
-    doc_id = str(uuid.uuid4())
+    doc_id = doc_id or str(uuid.uuid4())
     
     task_manager.create_task(task_id, doc_id)
 
     if source_type == 'url':
         if not url: raise HTTPException(status_code=400, detail="URL is required")
-        background_tasks.add_task(run_url_processing_task, task_id, doc_id, url)
+        background_tasks.add_task(run_url_processing_task, task_id, doc_id, url, append)
         return {"task_id": task_id, "doc_id": doc_id}
     
     elif source_type == 'file':
         if not file: raise HTTPException(status_code=400, detail="File is required")
-        filepath = os.path.join(UPLOAD_DIR, f"{doc_id}_{file.filename}")
+        filepath = os.path.join(UPLOAD_DIR, f"{doc_id}_{os.path.basename(file.filename)}")
         with open(filepath, "wb") as buffer:
             buffer.write(await file.read())
-        background_tasks.add_task(run_file_processing_task, task_id, doc_id, filepath, file.filename)
+        background_tasks.add_task(run_file_processing_task, task_id, doc_id, filepath, file.filename, append)
         return {"task_id": task_id, "doc_id": doc_id}
 
     raise HTTPException(status_code=400, detail="Invalid source_type.")
 
 
+@router.get("/builds/stats", summary="获取构建编排器状态 (并发构建、共享工作池的在途/排队请求与吞吐)")
+async def get_build_stats():
+    return build_orchestrator.stats()
+
+
+@router.get("/cache/query-embeddings/stats", summary="获取查询向量缓存的命中率 (内存/磁盘命中、未命中、淘汰数)")
+async def get_query_embedding_cache_stats():
+    return get_query_embedding_cache().stats()
+
+
 @router.get("/tasks/{task_id}/status", response_model=TaskStatusResponse, summary="获取后台任务状态")
 async def get_task_status(task_id: str):
     status = task_manager.get_task_status(task_id)
@@ -82,6 +106,17 @@ async def query_precise(request: QueryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/query/precise/batch", response_model=BatchQueryResponse, summary="批量精确问答 (TreeRetriever)")
+async def query_precise_batch(request: BatchQueryRequest):
+    # 整批问题共用一个服务实例: 树与模型只加载/创建一次，问题一次批量嵌入与打分
+    try:
+        service = TreeBuilderService(doc_id=request.doc_id)
+        results = await asyncio.to_thread(service.answer_precise_questions, request.questions)
+        return {"results": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/generate/materials", summary="生成学习材料 (FaissRetriever)")
 async def generate_materials(request: GenerateMaterialRequest):
     try:
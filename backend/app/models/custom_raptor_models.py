@@ -3,6 +3,7 @@
 import os
 import logging
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 # 导入所有必要的库
 from openai import OpenAI
@@ -12,7 +13,7 @@ from tenacity import retry, stop_after_attempt, wait_random_exponential
 # 导入RAPTOR的基类
 from ..raptor.QAModels import BaseQAModel
 from ..raptor.SummarizationModels import BaseSummarizationModel
-from ..raptor.EmbeddingModels import BaseEmbeddingModel
+from ..raptor.EmbeddingModels import BaseEmbeddingModel, iter_batches
 
 # 导入我们项目的配置
 from ..core.config import settings
@@ -70,6 +71,9 @@ class SparkSummarizationModel(BaseSummarizationModel):
     【最终版】
     基础摘要模型，可用于调用星火X1等兼容OpenAI SDK的API。
     """
+    prompt_template = "请将以下内容精炼地总结成一段摘要，尽可能多地包含关键细节，摘要应客观、准确、不包含个人观点：\n\n---\n\n{context}"
+    failure_prefix = "摘要生成失败"
+
     def __init__(self, model_name: str = "x1"):
         self.model = model_name
         # X1模型使用AK:SK组合作为api_key
@@ -84,7 +88,7 @@ class SparkSummarizationModel(BaseSummarizationModel):
 
     @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
     def summarize(self, context, max_tokens=500):
-        prompt = f"请将以下内容精炼地总结成一段摘要，尽可能多地包含关键细节，摘要应客观、准确、不包含个人观点：\n\n---\n\n{context}"
+        prompt = self.prompt_template.format(context=context)
         try:
             response = self.client.chat.completions.create(
                 model=self.model,
@@ -98,7 +102,11 @@ class SparkSummarizationModel(BaseSummarizationModel):
             return response.choices[0].message.content.strip()
         except Exception as e:
             logging.error(f"调用星火摘要 API (Model: {self.model}) 失败: {e}", exc_info=True)
-            return f"摘要生成失败: {e}"
+            return f"{self.failure_prefix}: {e}"
+
+    def is_valid_summary(self, summary) -> bool:
+        # 失败时返回的是错误信息字符串: TreeBuilder 据此抛出 InvalidSummaryError，该层中止，失败信息不会写入摘要缓存、检查点或树
+        return isinstance(summary, str) and not summary.startswith(self.failure_prefix)
 
 
 # ==============================================================================
@@ -112,14 +120,23 @@ class SparkEmbeddingModel(BaseEmbeddingModel):
     注意：这个API的鉴权方式与其他Web API不同，需要手动构造请求头。
     (这部分代码我们之前已完成，现在整合进来)
     """
-    def __init__(self, **kwargs):
+    def __init__(self, domain: str = "para", max_concurrency: int = 8, max_batch_chars: int = 20000, **kwargs):
         self.api_url = settings.SPARK_EMBEDDING_URL
+        # para: 文档段落向量; query: 用户问题向量 (两者属于不同的向量空间，缓存需分开)
+        self.domain = domain
+        # 星火Embedding接口每次请求只接受一段文本：批量接口按字符数分批，批内并发请求
+        self.max_concurrency = max_concurrency
+        self.max_batch_chars = max_batch_chars
         self.appid = settings.SPARK_APP_ID
         self.api_key = settings.SPARK_API_KEY
         self.api_secret = settings.SPARK_API_SECRET
         if not all([self.appid, self.api_key, self.api_secret]):
             raise EnvironmentError("讯飞Embedding API凭证 (APPID, APIKey, APISecret) 未完全设置!")
     
+    @property
+    def identifier(self) -> str:
+        return f"spark:{self.domain}"
+
     # ... (这里应该包含我们之前实现的、完整的、带鉴权的create_embedding方法)
     # ... 为了简洁，暂时省略，请确保你的代码是完整的 ...
     @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
@@ -128,6 +145,14 @@ class SparkEmbeddingModel(BaseEmbeddingModel):
         # 它应该包含构造请求头、请求体，发送httpx请求，并解析返回的向量
         raise NotImplementedError("请在此处填入完整的星火Embedding API调用逻辑")
 
+    def create_embeddings(self, texts):
+        """批量生成嵌入：按字符数分批，每批以 max_concurrency 个线程并发调用 create_embedding，结果保持输入顺序。"""
+        embeddings = []
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for batch in iter_batches(texts, self.max_concurrency, self.max_batch_chars):
+                embeddings.extend(executor.map(self.create_embedding, batch))
+        return embeddings
+
 # class SBertEmbeddingModel(BaseEmbeddingModel):
 #     """本地SBERT模型，用于开发和调试，或作为备选方案。"""
 #     def __init__(self, model_name="sentence-transformers/multi-qa-mpnet-base-cos-v1"):
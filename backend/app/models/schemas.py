@@ -49,6 +49,23 @@ class TaskResult(BaseModel):
     # 前端应在任务完成后，通过另一个API来获取树。
 
 
+class BuildPlanEstimate(BaseModel):
+    """
+    构建开始前由 BuildPlanner 按文档规模生成的构建计划与成本预估。
+    """
+    total_tokens: int = Field(..., description="文档的token总数")
+    max_tokens: int = Field(..., description="叶子文本块的最大token数")
+    num_layers: int = Field(..., description="计划构建的摘要层数上限")
+    clustering_backend: str = Field(..., description="聚类后端")
+    reduction_dimension: int = Field(..., description="聚类前的降维维度")
+    summarization_length: int = Field(..., description="摘要的最大token数")
+    estimated_chunks: int = Field(..., description="预估的叶子文本块数")
+    estimated_layer_sizes: List[int] = Field([], description="预估的每层节点数 (第0层为叶子)")
+    estimated_embedding_calls: int = Field(..., description="预估的嵌入API调用次数")
+    estimated_summary_calls: int = Field(..., description="预估的摘要API调用次数")
+    estimated_seconds: float = Field(..., description="预估的构建耗时 (秒)")
+
+
 class TaskStatusResponse(BaseModel):
     """
     对应后端 GET /tasks/{task_id}/status 接口的响应体。
@@ -59,6 +76,8 @@ class TaskStatusResponse(BaseModel):
     step: Optional[str] = Field(None, description="当前处理步骤的文本描述")
     result: Optional[TaskResult] = Field(None, description="仅当status为'COMPLETED'时存在")
     error: Optional[str] = Field(None, description="仅当status为'FAILED'时存在")
+    build_plan: Optional[BuildPlanEstimate] = Field(None, description="构建计划与调用数/耗时预估，构建开始前即可获取")
+    layers_ready: List[int] = Field([], description="文档树中已可查询的层 (0为叶子层)；非空时即可提问，摘要层在后台陆续加入")
 
 
 # ==============================================================================
@@ -81,6 +100,21 @@ class QueryResponse(BaseModel):
     source_ids: List[str] = Field([], description="答案引用的叶子节点ID列表，用于前端溯源高亮")
 
 
+class BatchQueryRequest(BaseModel):
+    """
+    对应后端 POST /query/precise/batch 接口的请求体。
+    """
+    doc_id: str
+    questions: List[str] = Field(..., min_length=1, max_length=500, description="同一文档的多个问题，一次加载树、一次批量嵌入")
+
+
+class BatchQueryResponse(BaseModel):
+    """
+    对应后端 POST /query/precise/batch 接口的响应体。
+    """
+    results: List[QueryResponse] = Field(..., description="与请求中的问题一一对应、顺序一致的回答")
+
+
 class GenerateMaterialRequest(BaseModel):
     """
     对应后端 POST /generate/materials 接口的请求体。
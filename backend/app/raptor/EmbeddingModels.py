@@ -1,23 +1,67 @@
 import logging
 from abc import ABC, abstractmethod
+from typing import Iterator, List
 
+import numpy as np
 from openai import OpenAI
 from sentence_transformers import SentenceTransformer
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
+from .cache import SQLiteCache, content_key, normalize_text
+
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
 
+def iter_batches(texts: List[str], max_batch_size: int, max_batch_chars: int) -> Iterator[List[str]]:
+    """
+    Groups texts, in order, into batches of at most max_batch_size texts and (unless a
+    single text is longer on its own) at most max_batch_chars characters.
+    """
+    batch, batch_chars = [], 0
+    for text in texts:
+        if batch and (len(batch) >= max_batch_size or batch_chars + len(text) > max_batch_chars):
+            yield batch
+            batch, batch_chars = [], 0
+        batch.append(text)
+        batch_chars += len(text)
+    if batch:
+        yield batch
+
+
 class BaseEmbeddingModel(ABC):
     @abstractmethod
     def create_embedding(self, text):
         pass
 
+    @property
+    def identifier(self) -> str:
+        """Names the model (and settings) that produced an embedding; used as the cache namespace."""
+        return type(self).__name__
+
+    def create_embeddings(self, texts: List[str]) -> List:
+        """
+        Embeds a list of texts, returning one embedding per text in the same order.
+        Models whose backend accepts several inputs per request override this; the
+        default embeds the texts one at a time.
+        """
+        return [self.create_embedding(text) for text in texts]
+
 
 class OpenAIEmbeddingModel(BaseEmbeddingModel):
-    def __init__(self, model="text-embedding-ada-002"):
+    def __init__(
+        self,
+        model="text-embedding-ada-002",
+        max_batch_size: int = 512,
+        max_batch_chars: int = 200_000,
+    ):
         self.client = OpenAI()
         self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_batch_chars = max_batch_chars
+
+    @property
+    def identifier(self) -> str:
+        return f"openai:{self.model}"
 
     @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
     def create_embedding(self, text):
@@ -28,10 +72,79 @@ class OpenAIEmbeddingModel(BaseEmbeddingModel):
             .embedding
         )
 
+    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(input=batch, model=self.model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def create_embeddings(self, texts: List[str]) -> List[List[float]]:
+        texts = [text.replace("\n", " ") for text in texts]
+        embeddings = []
+        for batch in iter_batches(texts, self.max_batch_size, self.max_batch_chars):
+            embeddings.extend(self._embed_batch(batch))
+        return embeddings
+
 
 class SBertEmbeddingModel(BaseEmbeddingModel):
-    def __init__(self, model_name="sentence-transformers/multi-qa-mpnet-base-cos-v1"):
+    def __init__(
+        self,
+        model_name="sentence-transformers/multi-qa-mpnet-base-cos-v1",
+        batch_size: int = 64,
+    ):
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
+        self.batch_size = batch_size
+
+    @property
+    def identifier(self) -> str:
+        return f"sbert:{self.model_name}"
 
     def create_embedding(self, text):
         return self.model.encode(text)
+
+    def create_embeddings(self, texts: List[str]) -> List:
+        # encode sorts by length internally, so each forward pass pads to similar sizes
+        return list(self.model.encode(texts, batch_size=self.batch_size))
+
+
+class CachedEmbeddingModel(BaseEmbeddingModel):
+    """
+    Wraps any BaseEmbeddingModel with a persistent SQLiteCache keyed by
+    (model identifier, sha256 of the normalized text). Embeddings are stored as float32.
+    Batched lookups only send the missing (and deduplicated) texts to the wrapped model.
+    """
+
+    def __init__(self, model: BaseEmbeddingModel, cache: SQLiteCache) -> None:
+        if not isinstance(model, BaseEmbeddingModel):
+            raise ValueError("model must be an instance of BaseEmbeddingModel")
+        self.model = model
+        self.cache = cache
+
+    @property
+    def identifier(self) -> str:
+        return self.model.identifier
+
+    def _key(self, text: str) -> str:
+        return content_key(self.identifier, normalize_text(text))
+
+    def create_embedding(self, text):
+        return self.create_embeddings([text])[0]
+
+    def create_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        keys = [self._key(text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.model.create_embeddings(list(missing.values()))
+            computed = {
+                key: np.asarray(vector, dtype=np.float32).tobytes()
+                for key, vector in zip(missing, vectors)
+            }
+            self.cache.put_many(computed)
+            found.update(computed)
+
+        return [np.frombuffer(found[key], dtype=np.float32) for key in keys]
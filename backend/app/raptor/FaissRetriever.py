@@ -1,14 +1,14 @@
 import random
-from concurrent.futures import ProcessPoolExecutor
 
-import faiss
 import numpy as np
 import tiktoken
-from tqdm import tqdm
 
+from .cache import QueryEmbeddingCache, cache_enabled, get_query_embedding_cache
 from .EmbeddingModels import BaseEmbeddingModel, OpenAIEmbeddingModel
 from .Retrievers import BaseRetriever
-from .utils import split_text
+from .utils import (embeddings_to_matrix, get_embeddings, get_token_counts,
+                    split_text)
+from .vector_index import FAISS_INDEXES, FaissIndex, get_faiss_index
 
 
 class FaissRetrieverConfig:
@@ -22,6 +22,8 @@ class FaissRetrieverConfig:
         top_k=5,
         tokenizer=tiktoken.get_encoding("cl100k_base"),
         embedding_model_string=None,
+        query_embedding_cache=None,
+        index_type="flat",
     ):
         if max_tokens < 1:
             raise ValueError("max_tokens must be at least 1")
@@ -46,6 +48,11 @@ class FaissRetrieverConfig:
                 "question_embedding_model must be an instance of BaseEmbeddingModel or None"
             )
 
+        if isinstance(index_type, str) and index_type not in FAISS_INDEXES:
+            raise ValueError(
+                f"index_type must be one of {list(FAISS_INDEXES.keys())}, a FaissIndex subclass or an instance of one"
+            )
+
         self.top_k = top_k
         self.max_tokens = max_tokens
         self.max_context_tokens = max_context_tokens
@@ -54,6 +61,19 @@ class FaissRetrieverConfig:
         self.question_embedding_model = question_embedding_model or self.embedding_model
         self.tokenizer = tokenizer
         self.embedding_model_string = embedding_model_string or "OpenAI"
+        self.index_type = index_type
+
+        # None uses the process-wide cache (unless RAPTOR_QUERY_CACHE=0), False disables caching
+        if query_embedding_cache is None and cache_enabled("RAPTOR_QUERY_CACHE"):
+            query_embedding_cache = get_query_embedding_cache()
+        if query_embedding_cache is not None and query_embedding_cache is not False:
+            if not isinstance(query_embedding_cache, QueryEmbeddingCache):
+                raise ValueError(
+                    "query_embedding_cache must be a QueryEmbeddingCache, None or False"
+                )
+        self.query_embedding_cache = (
+            query_embedding_cache if query_embedding_cache is not False else None
+        )
 
     def log_config(self):
         config_summary = """
@@ -66,6 +86,7 @@ class FaissRetrieverConfig:
 			Top K: {top_k}
 			Tokenizer: {tokenizer}
 			Embedding Model String: {embedding_model_string}
+			Index Type: {index_type}
 		""".format(
             max_tokens=self.max_tokens,
             max_context_tokens=self.max_context_tokens,
@@ -75,6 +96,7 @@ class FaissRetrieverConfig:
             top_k=self.top_k,
             tokenizer=self.tokenizer,
             embedding_model_string=self.embedding_model_string,
+            index_type=self.index_type,
         )
         return config_summary
 
@@ -90,13 +112,17 @@ class FaissRetriever(BaseRetriever):
         self.embedding_model = config.embedding_model
         self.question_embedding_model = config.question_embedding_model
         self.index = None
+        self.embeddings = None
         self.context_chunks = None
+        self.context_token_counts = None
         self.max_tokens = config.max_tokens
         self.max_context_tokens = config.max_context_tokens
         self.use_top_k = config.use_top_k
         self.tokenizer = config.tokenizer
         self.top_k = config.top_k
         self.embedding_model_string = config.embedding_model_string
+        self.index_type = config.index_type
+        self.query_embedding_cache = config.query_embedding_cache
 
     def build_from_text(self, doc_text):
         """
@@ -109,21 +135,16 @@ class FaissRetriever(BaseRetriever):
         self.context_chunks = np.array(
             split_text(doc_text, self.tokenizer, self.max_tokens)
         )
+        self.context_token_counts = np.array(
+            [len(self.tokenizer.encode(context_chunk)) for context_chunk in self.context_chunks],
+            dtype=np.int64,
+        )
 
-        with ProcessPoolExecutor() as executor:
-            futures = [
-                executor.submit(self.embedding_model.create_embedding, context_chunk)
-                for context_chunk in self.context_chunks
-            ]
-
-        self.embeddings = []
-        for future in tqdm(futures, total=len(futures), desc="Building embeddings"):
-            self.embeddings.append(future.result())
-
-        self.embeddings = np.array(self.embeddings, dtype=np.float32)
+        self.embeddings = embeddings_to_matrix(
+            self.embedding_model.create_embeddings(self.context_chunks.tolist())
+        )
 
-        self.index = faiss.IndexFlatIP(self.embeddings.shape[1])
-        self.index.add(self.embeddings)
+        self.index = get_faiss_index(self.index_type).build(self.embeddings)
 
     def build_from_leaf_nodes(self, leaf_nodes):
         """
@@ -135,14 +156,45 @@ class FaissRetriever(BaseRetriever):
         """
 
         self.context_chunks = [node.text for node in leaf_nodes]
+        self.context_token_counts = get_token_counts(leaf_nodes, self.tokenizer)
 
-        self.embeddings = np.array(
-            [node.embeddings[self.embedding_model_string] for node in leaf_nodes],
-            dtype=np.float32,
+        self.embeddings = embeddings_to_matrix(
+            get_embeddings(leaf_nodes, self.embedding_model_string)
         )
 
-        self.index = faiss.IndexFlatIP(self.embeddings.shape[1])
-        self.index.add(self.embeddings)
+        self.index = get_faiss_index(self.index_type).build(self.embeddings)
+
+    def save_index(self, path: str) -> None:
+        """
+        Writes the index to path with faiss.write_index, so that later processes can
+        load_index it instead of rebuilding it.
+
+        :param path: The file to write the index to.
+        """
+        if self.index is None:
+            raise ValueError("The index has not been built yet")
+        self.index.save(path)
+
+    def load_index(self, path: str, leaf_nodes, mmap: bool = True) -> None:
+        """
+        Loads an index written by save_index for the given leaf nodes, memory-mapped by
+        default. The leaf nodes must be in the order the index was built from; their
+        embeddings are not loaded, the vectors stay in the index file.
+
+        :param path: The index file.
+        :param leaf_nodes: The leaf nodes the index was built from, in build order.
+        :param mmap: Whether to memory-map the index instead of reading it into memory.
+        """
+        index = FaissIndex.load(path, mmap=mmap)
+        if len(index) != len(leaf_nodes):
+            raise ValueError(
+                f"The index at {path} holds {len(index)} vectors, expected {len(leaf_nodes)}"
+            )
+
+        self.index = index
+        self.embeddings = None
+        self.context_chunks = [node.text for node in leaf_nodes]
+        self.context_token_counts = get_token_counts(leaf_nodes, self.tokenizer)
 
     def sanity_check(self, num_samples=4):
         """
@@ -150,6 +202,8 @@ class FaissRetriever(BaseRetriever):
 
         :param num_samples: The number of samples to test.
         """
+        if self.embeddings is None:
+            raise ValueError("The embeddings are not in memory for an index loaded from disk")
         indices = random.sample(range(len(self.context_chunks)), num_samples)
 
         for i in indices:
@@ -163,39 +217,75 @@ class FaissRetriever(BaseRetriever):
 
         print(f"Sanity check passed for {num_samples} random samples.")
 
-    def retrieve(self, query: str) -> str:
-        """
-        Retrieves the k most similar context chunks for a given query.
+    def embed_query(self, query: str):
+        """Embeds a query with the question model, through the query embedding cache if enabled."""
+        if self.query_embedding_cache is None:
+            return self.question_embedding_model.create_embedding(query)
+        return self.query_embedding_cache.get_or_compute(
+            self.question_embedding_model.identifier,
+            query,
+            self.question_embedding_model.create_embedding,
+        )
 
-        :param query: A string containing the query.
-        :param k: An integer representing the number of similar context chunks to retrieve.
-        :return: A string containing the retrieved context chunks.
-        """
-        query_embedding = np.array(
-            [
-                np.array(
-                    self.question_embedding_model.create_embedding(query),
-                    dtype=np.float32,
-                ).squeeze()
-            ]
+    def embed_queries(self, queries):
+        """Embeds queries with one batched call to the question model (cache misses only)."""
+        if self.query_embedding_cache is None:
+            return self.question_embedding_model.create_embeddings(queries)
+        return self.query_embedding_cache.get_or_compute_many(
+            self.question_embedding_model.identifier,
+            queries,
+            self.question_embedding_model.create_embeddings,
         )
 
+    def _search(self, query_embeddings):
+        """Searches the index for every query row; returns the neighbour indices per query."""
+        k = self.top_k if self.use_top_k else int(self.max_context_tokens / self.max_tokens)
+        _, indices = self.index.search(query_embeddings, k)
+        return indices
+
+    def _build_context(self, indices) -> str:
         context = ""
+        # faiss pads with -1 when it finds fewer than k neighbours (small or approximate indexes)
+        indices = indices[indices >= 0]
 
         if self.use_top_k:
-            _, indices = self.index.search(query_embedding, self.top_k)
-            for i in range(self.top_k):
-                context += self.context_chunks[indices[0][i]]
+            for i in range(min(self.top_k, len(indices))):
+                context += self.context_chunks[indices[i]]
 
         else:
-            range_ = int(self.max_context_tokens / self.max_tokens)
-            _, indices = self.index.search(query_embedding, range_)
+            range_ = min(int(self.max_context_tokens / self.max_tokens), len(indices))
             total_tokens = 0
             for i in range(range_):
-                tokens = len(self.tokenizer.encode(self.context_chunks[indices[0][i]]))
-                context += self.context_chunks[indices[0][i]]
+                tokens = int(self.context_token_counts[indices[i]])
+                context += self.context_chunks[indices[i]]
                 if total_tokens + tokens > self.max_context_tokens:
                     break
                 total_tokens += tokens
 
         return context
+
+    def retrieve(self, query: str) -> str:
+        """
+        Retrieves the k most similar context chunks for a given query.
+
+        :param query: A string containing the query.
+        :param k: An integer representing the number of similar context chunks to retrieve.
+        :return: A string containing the retrieved context chunks.
+        """
+        query_embedding = embeddings_to_matrix(self.embed_query(query))
+
+        return self._build_context(self._search(query_embedding)[0])
+
+    def retrieve_batch(self, queries):
+        """
+        Retrieves the context for many queries: one batched embedding call and one index
+        search for all of them, with the token budget applied per query.
+
+        :param queries: A list of query strings.
+        :return: A list with the context string of each query, in order.
+        """
+        if not queries:
+            return []
+        query_embeddings = embeddings_to_matrix(self.embed_queries(list(queries)))
+
+        return [self._build_context(indices) for indices in self._search(query_embeddings)]
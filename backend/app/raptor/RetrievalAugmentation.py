@@ -1,5 +1,6 @@
 import logging
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 
 from .cluster_tree_builder import ClusterTreeBuilder, ClusterTreeConfig
 from .EmbeddingModels import BaseEmbeddingModel
@@ -34,6 +35,7 @@ class RetrievalAugmentationConfig:
         tr_embedding_model=None,
         tr_num_layers=None,
         tr_start_layer=None,
+        tr_index_type=None,
         # TreeBuilderConfig arguments
         tb_tokenizer=None,
         tb_max_tokens=100,
@@ -45,6 +47,13 @@ class RetrievalAugmentationConfig:
         tb_summarization_model=None,
         tb_embedding_models=None,
         tb_cluster_embedding_model="OpenAI",
+        # ClusterTreeConfig arguments (only forwarded when set)
+        tb_reduction_dimension=None,
+        tb_clustering_algorithm=None,
+        tb_clustering_params=None,
+        tb_summarization_concurrency=None,
+        tb_summarization_rate_limit=None,
+        tb_progress_callback=None,
     ):
         # Validate tree_builder_type
         if tree_builder_type not in supported_tree_builders:
@@ -91,6 +100,18 @@ class RetrievalAugmentationConfig:
             tree_builder_type
         ]
         if tree_builder_config is None:
+            cluster_kwargs = {
+                name: value
+                for name, value in (
+                    ("reduction_dimension", tb_reduction_dimension),
+                    ("clustering_algorithm", tb_clustering_algorithm),
+                    ("clustering_params", tb_clustering_params),
+                    ("summarization_concurrency", tb_summarization_concurrency),
+                    ("summarization_rate_limit", tb_summarization_rate_limit),
+                    ("progress_callback", tb_progress_callback),
+                )
+                if value is not None
+            }
             tree_builder_config = tree_builder_config_class(
                 tokenizer=tb_tokenizer,
                 max_tokens=tb_max_tokens,
@@ -102,6 +123,7 @@ class RetrievalAugmentationConfig:
                 summarization_model=tb_summarization_model,
                 embedding_models=tb_embedding_models,
                 cluster_embedding_model=tb_cluster_embedding_model,
+                **cluster_kwargs,
             )
 
         elif not isinstance(tree_builder_config, tree_builder_config_class):
@@ -120,6 +142,7 @@ class RetrievalAugmentationConfig:
                 embedding_model=tr_embedding_model,
                 num_layers=tr_num_layers,
                 start_layer=tr_start_layer,
+                index_type=tr_index_type,
             )
         elif not isinstance(tree_retriever_config, TreeRetrieverConfig):
             raise ValueError(
@@ -201,23 +224,53 @@ class RetrievalAugmentation:
             f"Successfully initialized RetrievalAugmentation with Config {config.log_config()}"
         )
 
-    def add_documents(self, docs):
+    def add_documents(self, docs, overwrite: bool = False):
         """
         Adds documents to the tree and creates a TreeRetriever instance.
 
+        When a tree already exists the documents are added to it incrementally (see
+        add_to_existing) unless overwrite is True, in which case the tree is rebuilt
+        from docs alone.
+
         Args:
             docs (str): The input text to add to the tree.
+            overwrite (bool): Whether to replace an existing tree. Defaults to False.
+
+        Returns:
+            Optional[IncrementalUpdateReport]: The update report when the documents were
+                added incrementally, otherwise None.
         """
-        if self.tree is not None:
-            user_input = input(
-                "Warning: Overwriting existing tree. Did you mean to call 'add_to_existing' instead? (y/n): "
-            )
-            if user_input.lower() == "y":
-                # self.add_to_existing(docs)
-                return
+        if self.tree is not None and not overwrite:
+            return self.add_to_existing(docs)
 
         self.tree = self.tree_builder.build_from_text(text=docs)
         self.retriever = TreeRetriever(self.tree_retriever_config, self.tree)
+        return None
+
+    def add_to_existing(self, docs, min_similarity: float = 0.3):
+        """
+        Adds documents to the existing tree without rebuilding it: only the new chunks
+        are embedded, and only their ancestors (or new parents) are summarized.
+
+        Args:
+            docs (str): The input text to add to the tree.
+            min_similarity (float): Minimum cosine similarity for a new node to join an
+                existing parent instead of a new one. Defaults to 0.3.
+
+        Returns:
+            IncrementalUpdateReport: What the update did and how many LLM calls it saved.
+
+        Raises:
+            ValueError: If there is no tree to add to.
+        """
+        if self.tree is None:
+            raise ValueError("There is no tree to add to. Call 'add_documents' first.")
+
+        self.tree, report = self.tree_builder.add_to_existing(
+            self.tree, docs, min_similarity=min_similarity
+        )
+        self.retriever = TreeRetriever(self.tree_retriever_config, self.tree)
+        return report
 
     def retrieve(
         self,
@@ -298,6 +351,94 @@ class RetrievalAugmentation:
 
         return answer
 
+    def retrieve_batch(
+        self,
+        questions,
+        start_layer: int = None,
+        num_layers: int = None,
+        top_k: int = 10,
+        max_tokens: int = 3500,
+        collapse_tree: bool = True,
+        return_layer_information: bool = True,
+    ):
+        """
+        Retrieves the context of many questions with one batched embedding call and one
+        scoring pass over the tree (see TreeRetriever.retrieve_batch).
+
+        Args:
+            questions (List[str]): The questions.
+            Other arguments: As in retrieve, applied to every question.
+
+        Returns:
+            list: One result per question, in order, each as retrieve would return it.
+
+        Raises:
+            ValueError: If the TreeRetriever instance has not been initialized.
+        """
+        if self.retriever is None:
+            raise ValueError(
+                "The TreeRetriever instance has not been initialized. Call 'add_documents' first."
+            )
+
+        return self.retriever.retrieve_batch(
+            questions,
+            start_layer,
+            num_layers,
+            top_k,
+            max_tokens,
+            collapse_tree,
+            return_layer_information,
+        )
+
+    def answer_questions(
+        self,
+        questions,
+        top_k: int = 10,
+        start_layer: int = None,
+        num_layers: int = None,
+        max_tokens: int = 3500,
+        collapse_tree: bool = True,
+        return_layer_information: bool = False,
+        qa_concurrency: int = 4,
+    ):
+        """
+        Answers many questions: retrieval runs once for the whole batch, then the QA model
+        answers the questions with up to qa_concurrency calls in flight.
+
+        Args:
+            questions (List[str]): The questions to answer.
+            qa_concurrency (int): Maximum number of concurrent QA model calls. Defaults to 4.
+            Other arguments: As in answer_question, applied to every question.
+
+        Returns:
+            list: One answer per question, in order, or (answer, layer_information)
+                tuples if return_layer_information is True.
+        """
+        if not isinstance(qa_concurrency, int) or qa_concurrency < 1:
+            raise ValueError("qa_concurrency must be an integer and at least 1")
+
+        retrieved = self.retrieve_batch(
+            questions, start_layer, num_layers, top_k, max_tokens, collapse_tree, True
+        )
+        if not retrieved:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(qa_concurrency, len(questions))) as executor:
+            answers = list(
+                executor.map(
+                    lambda item: self.qa_model.answer_question(item[0][0], item[1]),
+                    zip(retrieved, questions),
+                )
+            )
+
+        if return_layer_information:
+            return [
+                (answer, layer_information)
+                for answer, (_, layer_information) in zip(answers, retrieved)
+            ]
+
+        return answers
+
     def save(self, path):
         if self.tree is None:
             raise ValueError("There is no tree to save.")
@@ -8,13 +8,36 @@ from tenacity import retry, stop_after_attempt, wait_random_exponential
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
 
+# The user prompt of the OpenAI summarization models; {context} is the text to summarize
+DEFAULT_SUMMARY_PROMPT = "Write a summary of the following, including as many key details as possible: {context}:"
+
+
+class InvalidSummaryError(RuntimeError):
+    """Raised when a summarization model reports a failure instead of a summary."""
+
+
 class BaseSummarizationModel(ABC):
+    # Prompt the model fills with the context; part of the summary cache key
+    prompt_template = ""
+
     @abstractmethod
     def summarize(self, context, max_tokens=150):
         pass
 
+    @property
+    def identifier(self) -> str:
+        """Names the model that produced a summary; part of the summary cache key."""
+        model = getattr(self, "model", None)
+        return f"{type(self).__name__}:{model}" if isinstance(model, str) else type(self).__name__
+
+    def is_valid_summary(self, summary) -> bool:
+        """Whether summary is a real result (and may be cached) rather than a reported failure."""
+        return isinstance(summary, str)
+
 
 class GPT3TurboSummarizationModel(BaseSummarizationModel):
+    prompt_template = DEFAULT_SUMMARY_PROMPT
+
     def __init__(self, model="gpt-3.5-turbo"):
 
         self.model = model
@@ -31,7 +54,7 @@ class GPT3TurboSummarizationModel(BaseSummarizationModel):
                     {"role": "system", "content": "You are a helpful assistant."},
                     {
                         "role": "user",
-                        "content": f"Write a summary of the following, including as many key details as possible: {context}:",
+                        "content": self.prompt_template.format(context=context),
                     },
                 ],
                 max_tokens=max_tokens,
@@ -45,6 +68,8 @@ class GPT3TurboSummarizationModel(BaseSummarizationModel):
 
 
 class GPT3SummarizationModel(BaseSummarizationModel):
+    prompt_template = DEFAULT_SUMMARY_PROMPT
+
     def __init__(self, model="text-davinci-003"):
 
         self.model = model
@@ -61,7 +86,7 @@ class GPT3SummarizationModel(BaseSummarizationModel):
                     {"role": "system", "content": "You are a helpful assistant."},
                     {
                         "role": "user",
-                        "content": f"Write a summary of the following, including as many key details as possible: {context}:",
+                        "content": self.prompt_template.format(context=context),
                     },
                 ],
                 max_tokens=max_tokens,
@@ -0,0 +1,181 @@
+import logging
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import tiktoken
+
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+# (upper bound on document tokens, leaf chunk size in tokens), smallest documents first
+CHUNK_SIZE_TIERS: Tuple[Tuple[float, int], ...] = (
+    (20_000, 100),
+    (100_000, 150),
+    (400_000, 200),
+    (math.inf, 300),
+)
+
+# Above this many nodes in a layer, UMAP + GMM clustering gets slow; switch to k-means
+RAPTOR_CLUSTERING_MAX_NODES = 3000
+
+
+class BuildPlan:
+    """The build parameters chosen for one document, and the cost they are expected to have."""
+
+    def __init__(
+        self,
+        total_tokens: int,
+        max_tokens: int,
+        num_layers: int,
+        clustering_backend: str,
+        reduction_dimension: int,
+        summarization_length: int,
+        layer_sizes: List[int],
+        embedding_calls: int,
+        summary_calls: int,
+        estimated_seconds: float,
+    ) -> None:
+        self.total_tokens = total_tokens
+        self.max_tokens = max_tokens
+        self.num_layers = num_layers
+        self.clustering_backend = clustering_backend
+        self.reduction_dimension = reduction_dimension
+        self.summarization_length = summarization_length
+        self.layer_sizes = layer_sizes
+        self.embedding_calls = embedding_calls
+        self.summary_calls = summary_calls
+        self.estimated_seconds = estimated_seconds
+
+    @property
+    def estimated_chunks(self) -> int:
+        return self.layer_sizes[0]
+
+    def as_dict(self) -> Dict:
+        return {
+            "total_tokens": self.total_tokens,
+            "max_tokens": self.max_tokens,
+            "num_layers": self.num_layers,
+            "clustering_backend": self.clustering_backend,
+            "reduction_dimension": self.reduction_dimension,
+            "summarization_length": self.summarization_length,
+            "estimated_chunks": self.estimated_chunks,
+            "estimated_layer_sizes": list(self.layer_sizes),
+            "estimated_embedding_calls": self.embedding_calls,
+            "estimated_summary_calls": self.summary_calls,
+            "estimated_seconds": round(self.estimated_seconds, 1),
+        }
+
+
+class BuildPlanner:
+    """
+    Chooses chunk size, layer count, clustering backend, reduction dimension and summary
+    length from a document's token count, and estimates the API calls and wall-clock
+    time of the resulting build.
+
+    The layer estimate follows the clustering rules: each layer groups about
+    target_cluster_size nodes per cluster, or more clusters if needed to keep each one
+    under max_length_in_cluster tokens, and construction stops once a layer has at most
+    reduction_dimension + 1 nodes. Time is estimated from the per-call latencies and
+    concurrencies given here, plus clustering time per node; calibrate them against
+    measured builds.
+    """
+
+    def __init__(
+        self,
+        tokenizer=None,
+        max_num_layers: int = 6,
+        target_cluster_size: int = 8,
+        max_length_in_cluster: int = 3500,
+        embedding_latency: float = 0.3,
+        embedding_concurrency: int = 8,
+        summary_latency: float = 4.0,
+        summary_concurrency: int = 4,
+        clustering_seconds_per_node: Optional[Dict[str, float]] = None,
+        chunk_size_tiers: Sequence[Tuple[float, int]] = CHUNK_SIZE_TIERS,
+    ) -> None:
+        if not isinstance(max_num_layers, int) or max_num_layers < 1:
+            raise ValueError("max_num_layers must be an integer and at least 1")
+        if target_cluster_size < 2:
+            raise ValueError("target_cluster_size must be at least 2")
+        if embedding_concurrency < 1 or summary_concurrency < 1:
+            raise ValueError("concurrencies must be at least 1")
+        self.tokenizer = tokenizer or tiktoken.get_encoding("cl100k_base")
+        self.max_num_layers = max_num_layers
+        self.target_cluster_size = target_cluster_size
+        self.max_length_in_cluster = max_length_in_cluster
+        self.embedding_latency = embedding_latency
+        self.embedding_concurrency = embedding_concurrency
+        self.summary_latency = summary_latency
+        self.summary_concurrency = summary_concurrency
+        self.clustering_seconds_per_node = clustering_seconds_per_node or {
+            "raptor": 0.01,
+            "spherical_kmeans": 0.0005,
+        }
+        self.chunk_size_tiers = tuple(chunk_size_tiers)
+
+    def choose_chunk_size(self, total_tokens: int) -> int:
+        for max_document_tokens, chunk_size in self.chunk_size_tiers:
+            if total_tokens <= max_document_tokens:
+                return chunk_size
+        return self.chunk_size_tiers[-1][1]
+
+    def plan(self, text: str) -> BuildPlan:
+        return self.plan_for_tokens(len(self.tokenizer.encode(text)))
+
+    def plan_for_tokens(self, total_tokens: int) -> BuildPlan:
+        max_tokens = self.choose_chunk_size(total_tokens)
+        n_chunks = max(1, math.ceil(total_tokens / max_tokens))
+
+        # Small documents would stop after one layer with the default of 10 dimensions
+        reduction_dimension = int(min(10, max(2, n_chunks // 8)))
+        clustering_backend = (
+            "raptor" if n_chunks <= RAPTOR_CLUSTERING_MAX_NODES else "spherical_kmeans"
+        )
+        # Parents summarize about target_cluster_size children; keep them comparable to leaves
+        summarization_length = max_tokens
+
+        layer_sizes = [n_chunks]
+        layer_tokens = max_tokens
+        while (
+            len(layer_sizes) <= self.max_num_layers
+            and layer_sizes[-1] > reduction_dimension + 1
+        ):
+            nodes = layer_sizes[-1]
+            by_size = math.ceil(nodes / self.target_cluster_size)
+            by_budget = math.ceil(nodes * layer_tokens / self.max_length_in_cluster)
+            layer_sizes.append(max(1, min(nodes - 1, max(by_size, by_budget))))
+            layer_tokens = summarization_length
+        # One layer of headroom: construction stops on its own once a layer is small enough,
+        # while a cap that is too low would leave many roots if clusters come out smaller
+        num_layers = min(self.max_num_layers, len(layer_sizes))
+
+        summary_calls = sum(layer_sizes[1:])
+        # Spark embeds one text per request: every leaf and every summary is one call
+        embedding_calls = n_chunks + summary_calls
+        clustering_seconds = self.clustering_seconds_per_node.get(clustering_backend, 0.0) * sum(
+            layer_sizes[:-1]
+        )
+        estimated_seconds = (
+            n_chunks * self.embedding_latency / self.embedding_concurrency
+            # Layers are sequential; within a layer summaries run summary_concurrency at a time
+            + sum(
+                math.ceil(size / self.summary_concurrency) * self.summary_latency
+                for size in layer_sizes[1:]
+            )
+            + summary_calls * self.embedding_latency / self.embedding_concurrency
+            + clustering_seconds
+        )
+
+        plan = BuildPlan(
+            total_tokens=total_tokens,
+            max_tokens=max_tokens,
+            num_layers=num_layers,
+            clustering_backend=clustering_backend,
+            reduction_dimension=reduction_dimension,
+            summarization_length=summarization_length,
+            layer_sizes=layer_sizes,
+            embedding_calls=embedding_calls,
+            summary_calls=summary_calls,
+            estimated_seconds=estimated_seconds,
+        )
+        logging.info(f"Build plan: {plan.as_dict()}")
+        return plan
@@ -0,0 +1,426 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+# Directory of the persistent caches; RAPTOR_CACHE_DIR overrides it
+DEFAULT_CACHE_DIR = os.getenv("RAPTOR_CACHE_DIR", os.path.join(".", "raptor_cache"))
+
+# SQLite limits the number of host parameters per statement
+_MAX_PARAMS = 500
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC with runs of whitespace collapsed, so trivially different copies share a key."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def content_key(*parts: str) -> str:
+    """sha256 over the parts, separated so that ("ab", "c") and ("a", "bc") differ."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class SQLiteCache:
+    """
+    A persistent key -> bytes store in a single SQLite file with LRU eviction and an
+    optional TTL. Eviction keeps at most max_entries entries and max_bytes of values,
+    dropping the least recently read first. Safe to share between threads; several
+    processes may open the same file (WAL mode).
+
+    Entry and byte totals are kept as running counters, so a write costs O(batch), not
+    O(table). Expired entries are swept every sweep_interval writes; the sweep also
+    recounts the totals, which picks up writes by other processes.
+
+    Hit and miss counters cover this instance's lookups since it was opened.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: Optional[int] = 1_000_000,
+        max_bytes: Optional[int] = 2 * 1024**3,
+        ttl: Optional[float] = None,
+        sweep_interval: int = 1000,
+    ) -> None:
+        if sweep_interval < 1:
+            raise ValueError("sweep_interval must be at least 1")
+        if max_entries is not None and max_entries < 1:
+            raise ValueError("max_entries must be at least 1 or None")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1 or None")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive or None")
+
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_created ON entries (created)"
+            )
+            self._recount()
+        self._writes_since_sweep = 0
+
+    def _recount(self) -> None:
+        self._entries, self._total_bytes = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+
+    def _deleted(self, sizes: List[int]) -> None:
+        self._entries -= len(sizes)
+        self._total_bytes -= sum(sizes)
+        self.evictions += len(sizes)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """Returns the found, unexpired entries among keys and marks them as recently used."""
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        found = {}
+        with self._lock, self._connection:
+            for start in range(0, len(keys), _MAX_PARAMS):
+                chunk = keys[start:start + _MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT key, value, size, created FROM entries WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                expired = []
+                for key, value, size, created in rows:
+                    if self.ttl is not None and now - created > self.ttl:
+                        expired.append((key, size))
+                    else:
+                        found[key] = value
+                if expired:
+                    self._connection.executemany(
+                        "DELETE FROM entries WHERE key = ?", [(key,) for key, _ in expired]
+                    )
+                    self._deleted([size for _, size in expired])
+                if found:
+                    self._connection.executemany(
+                        "UPDATE entries SET accessed = ? WHERE key = ?",
+                        [(now, key) for key in chunk if key in found],
+                    )
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key: str, value: bytes) -> None:
+        self.put_many({key: value})
+
+    def put_many(self, items: Dict[str, bytes]) -> None:
+        if not items:
+            return
+        now = time.time()
+        keys = list(items)
+        with self._lock, self._connection:
+            # Sizes of the entries being replaced, to keep the running totals exact
+            replaced = []
+            for start in range(0, len(keys), _MAX_PARAMS):
+                chunk = keys[start:start + _MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                replaced.extend(
+                    size for (size,) in self._connection.execute(
+                        f"SELECT size FROM entries WHERE key IN ({placeholders})", chunk
+                    )
+                )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(key, value, len(value), now, now) for key, value in items.items()],
+            )
+            self._entries += len(items) - len(replaced)
+            self._total_bytes += sum(len(value) for value in items.values()) - sum(replaced)
+
+            self._writes_since_sweep += len(items)
+            if self._writes_since_sweep >= self.sweep_interval:
+                self._sweep()
+            self._evict()
+
+    def _sweep(self) -> None:
+        """Deletes expired entries (through the created index) and recounts the totals."""
+        self._writes_since_sweep = 0
+        if self.ttl is not None:
+            self.evictions += self._connection.execute(
+                "DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,)
+            ).rowcount
+        self._recount()
+
+    def _evict(self) -> None:
+        over_entries = self._entries - self.max_entries if self.max_entries is not None else 0
+        over_bytes = self._total_bytes - self.max_bytes if self.max_bytes is not None else 0
+        if over_entries <= 0 and over_bytes <= 0:
+            return
+
+        # Walk from the least recently used entry until both limits hold
+        victims, freed = [], 0
+        for key, size in self._connection.execute(
+            "SELECT key, size FROM entries ORDER BY accessed"
+        ):
+            if len(victims) >= over_entries and freed >= over_bytes:
+                break
+            victims.append((key, size))
+            freed += size
+        self._connection.executemany(
+            "DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims]
+        )
+        self._deleted([size for _, size in victims])
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entries")
+            self._entries, self._total_bytes = 0, 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._entries
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "entries": len(self),
+        }
+
+
+_shared_caches: Dict[str, SQLiteCache] = {}
+_shared_caches_lock = threading.Lock()
+
+
+def get_shared_cache(path: str, **kwargs) -> SQLiteCache:
+    """
+    Returns the process-wide SQLiteCache for path, opening it on first use, so that
+    every builder in the process shares one connection and one set of counters.
+    """
+    path = os.path.abspath(path)
+    with _shared_caches_lock:
+        if path not in _shared_caches:
+            _shared_caches[path] = SQLiteCache(path, **kwargs)
+        return _shared_caches[path]
+
+
+def cache_enabled(env_var: str, default: bool = True) -> bool:
+    """Caches are on unless their environment variable is set to 0/false/off (or unset, for default=False)."""
+    return os.getenv(env_var, "1" if default else "0").strip().lower() not in ("0", "false", "off", "")
+
+
+class QueryEmbeddingCache:
+    """
+    Process-wide cache of query embeddings keyed by (model identifier, normalized query),
+    so a repeated question skips the embedding API round trip.
+
+    Entries live in an in-memory LRU of at most max_entries that expire ttl seconds after
+    they were computed. With a disk_cache (a SQLiteCache), memory misses fall through to
+    it and computed embeddings are written to it, so they survive restarts. Concurrent
+    lookups of the same missing key wait for one computation instead of each calling the
+    model. Returned embeddings are read-only float32 arrays.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        ttl: Optional[float] = 24 * 3600,
+        disk_cache: Optional[SQLiteCache] = None,
+    ) -> None:
+        if not isinstance(max_entries, int) or max_entries < 1:
+            raise ValueError("max_entries must be an integer and at least 1")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive or None")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_cache = disk_cache
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (embedding, time computed), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_identifier: str, query: str) -> str:
+        return content_key(model_identifier, normalize_text(query))
+
+    def get_or_compute(
+        self, model_identifier: str, query: str, compute: Callable[[str], object]
+    ) -> np.ndarray:
+        """Returns the cached embedding of query, calling compute(query) on a miss."""
+        return self.get_or_compute_many(
+            model_identifier, [query], lambda missing: [compute(missing[0])]
+        )[0]
+
+    def get_or_compute_many(
+        self,
+        model_identifier: str,
+        queries: List[str],
+        compute_many: Callable[[List[str]], List[object]],
+    ) -> List[np.ndarray]:
+        """
+        Returns the embeddings of queries in order. The queries missing from memory and
+        disk are deduplicated and embedded with a single compute_many(missing) call, which
+        returns one embedding per query.
+        """
+        keys = [self.key(model_identifier, query) for query in queries]
+        found: Dict[str, np.ndarray] = {}
+        owned: Dict[str, tuple] = {}  # key -> (query, future) computed by this call
+        waiting: Dict[str, Future] = {}  # key -> future of another caller's computation
+        now = time.time()
+        with self._lock:
+            for key, query in zip(keys, queries):
+                if key in found or key in owned or key in waiting:
+                    continue
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if self.ttl is None or now - entry[1] <= self.ttl:
+                        self._entries.move_to_end(key)
+                        self.memory_hits += 1
+                        found[key] = entry[0]
+                        continue
+                    del self._entries[key]
+                    self.evictions += 1
+                if key in self._in_flight:
+                    waiting[key] = self._in_flight[key]
+                else:
+                    future = self._in_flight[key] = Future()
+                    owned[key] = (query, future)
+
+        if owned:
+            found.update(self._compute(owned, compute_many))
+        for key, future in waiting.items():
+            found[key] = future.result()
+        if waiting:
+            with self._lock:
+                self.memory_hits += len(waiting)
+        return [found[key] for key in keys]
+
+    def _compute(
+        self, owned: Dict[str, tuple], compute_many: Callable[[List[str]], List[object]]
+    ) -> Dict[str, np.ndarray]:
+        try:
+            stored = self.disk_cache.get_many(owned) if self.disk_cache is not None else {}
+            from_disk = {key: np.frombuffer(value, dtype=np.float32) for key, value in stored.items()}
+            missing = [key for key in owned if key not in from_disk]
+            computed = {}
+            if missing:
+                vectors = compute_many([owned[key][0] for key in missing])
+                for key, vector in zip(missing, vectors):
+                    embedding = np.array(vector, dtype=np.float32).reshape(-1)
+                    embedding.flags.writeable = False
+                    computed[key] = embedding
+                if self.disk_cache is not None:
+                    self.disk_cache.put_many({key: embedding.tobytes() for key, embedding in computed.items()})
+        except BaseException as e:
+            with self._lock:
+                for key in owned:
+                    del self._in_flight[key]
+            for _, future in owned.values():
+                future.set_exception(e)
+            raise
+
+        results = {**from_disk, **computed}
+        with self._lock:
+            self.disk_hits += len(from_disk)
+            self.misses += len(computed)
+            now = time.time()
+            for key, embedding in results.items():
+                self._entries[key] = (embedding, now)
+                self._entries.move_to_end(key)
+                del self._in_flight[key]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        for key, (_, future) in owned.items():
+            future.set_result(results[key])
+        return results
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "entries": len(self),
+        }
+
+
+_query_embedding_cache: Optional[QueryEmbeddingCache] = None
+
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """
+    Returns the process-wide QueryEmbeddingCache, created on first use from the
+    environment: RAPTOR_QUERY_CACHE_SIZE (entries, default 10000), RAPTOR_QUERY_CACHE_TTL
+    (seconds, default one day) and RAPTOR_QUERY_CACHE_DISK=1 to persist it under
+    RAPTOR_CACHE_DIR.
+    """
+    global _query_embedding_cache
+    with _shared_caches_lock:
+        if _query_embedding_cache is None:
+            ttl = float(os.getenv("RAPTOR_QUERY_CACHE_TTL", str(24 * 3600)))
+            disk_cache = None
+            if cache_enabled("RAPTOR_QUERY_CACHE_DISK", default=False):
+                path = os.path.abspath(os.path.join(DEFAULT_CACHE_DIR, "query_embeddings.sqlite"))
+                disk_cache = _shared_caches.get(path) or SQLiteCache(path, max_entries=200_000, ttl=ttl)
+                _shared_caches[path] = disk_cache
+            _query_embedding_cache = QueryEmbeddingCache(
+                max_entries=int(os.getenv("RAPTOR_QUERY_CACHE_SIZE", "10000")),
+                ttl=ttl,
+                disk_cache=disk_cache,
+            )
+        return _query_embedding_cache
@@ -0,0 +1,149 @@
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .cache import content_key
+from .tree_structures import Node
+
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+# Bump when the pickled checkpoint layout changes; older checkpoints are then ignored
+CHECKPOINT_VERSION = 1
+
+
+def build_fingerprint(chunks: List[str], *settings: str) -> str:
+    """Identifies a build by its leaf chunks and the settings (models, prompt, ...) that shape it."""
+    return content_key(*settings, str(len(chunks)), *chunks)
+
+
+class TreeBuildCheckpoint:
+    """
+    Durable progress of one tree build: the leaf nodes, every completed layer, and the
+    clusters plus finished summaries of the layer in progress.
+
+    Every save writes the whole state to a temporary file in the same directory and
+    renames it over path, so a crash leaves either the previous or the new checkpoint,
+    never a torn one. Summaries finished inside a layer are saved at most every
+    save_interval seconds (and always when the layer completes).
+
+    A checkpoint only resumes a build with the same fingerprint; see build_fingerprint.
+    """
+
+    def __init__(self, path: str, fingerprint: str, save_interval: float = 5.0) -> None:
+        if save_interval < 0:
+            raise ValueError("save_interval must not be negative")
+        self.path = path
+        self.fingerprint = fingerprint
+        self.save_interval = save_interval
+        self.leaf_nodes: Optional[Dict[int, Node]] = None
+        self.layers: Dict[int, List[Node]] = {}
+        # Layer in progress: its clusters as child index lists and the finished
+        # (summary, embeddings) per cluster position
+        self.pending_layer: Optional[int] = None
+        self.pending_clusters: List[List[int]] = []
+        self.pending_results: Dict[int, Tuple[str, Dict]] = {}
+        self.metadata: Dict = {}
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    @classmethod
+    def load_or_create(
+        cls, path: str, fingerprint: str, save_interval: float = 5.0
+    ) -> "TreeBuildCheckpoint":
+        """
+        Returns the checkpoint stored at path if it belongs to the same build, otherwise
+        a fresh one (an unreadable or mismatched file is discarded).
+        """
+        checkpoint = cls(path, fingerprint, save_interval)
+        if not os.path.exists(path):
+            return checkpoint
+        try:
+            with open(path, "rb") as file:
+                state = pickle.load(file)
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+            return checkpoint
+        if state.get("version") != CHECKPOINT_VERSION or state.get("fingerprint") != fingerprint:
+            logging.info(f"Ignoring checkpoint {path} from a different build")
+            return checkpoint
+
+        checkpoint.leaf_nodes = state["leaf_nodes"]
+        checkpoint.layers = state["layers"]
+        checkpoint.pending_layer = state["pending_layer"]
+        checkpoint.pending_clusters = state["pending_clusters"]
+        checkpoint.pending_results = state["pending_results"]
+        checkpoint.metadata = state["metadata"]
+        logging.info(
+            f"Resuming from checkpoint {path}: {len(checkpoint.leaf_nodes or {})} leaves, "
+            f"{len(checkpoint.layers)} completed layers, "
+            f"{len(checkpoint.pending_results)}/{len(checkpoint.pending_clusters)} clusters of the layer in progress"
+        )
+        return checkpoint
+
+    @property
+    def has_leaves(self) -> bool:
+        return self.leaf_nodes is not None
+
+    def save(self) -> None:
+        """Atomically writes the current state to path."""
+        with self._lock:
+            state = {
+                "version": CHECKPOINT_VERSION,
+                "fingerprint": self.fingerprint,
+                "leaf_nodes": self.leaf_nodes,
+                "layers": self.layers,
+                "pending_layer": self.pending_layer,
+                "pending_clusters": self.pending_clusters,
+                "pending_results": dict(self.pending_results),
+                "metadata": self.metadata,
+            }
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(descriptor, "wb") as file:
+                    pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temporary_path, self.path)
+            except BaseException:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+                raise
+            self._saved_at = time.monotonic()
+
+    def save_leaves(self, leaf_nodes: Dict[int, Node], **metadata) -> None:
+        self.leaf_nodes = leaf_nodes
+        self.metadata.update(metadata)
+        self.save()
+
+    def start_layer(self, layer: int, clusters: List[List[Node]]) -> None:
+        """Records the clusters of a new layer, so a resumed build summarizes the same clusters."""
+        self.pending_layer = layer
+        self.pending_clusters = [[node.index for node in cluster] for cluster in clusters]
+        self.pending_results = {}
+        self.save()
+
+    def record_summary(self, position: int, summary: str, embeddings: Dict) -> None:
+        """Records one finished cluster of the layer in progress; saves if save_interval has passed."""
+        with self._lock:
+            self.pending_results[position] = (summary, embeddings)
+            due = time.monotonic() - self._saved_at >= self.save_interval
+        if due:
+            self.save()
+
+    def complete_layer(self, layer: int, nodes: List[Node]) -> None:
+        self.layers[layer] = nodes
+        self.pending_layer = None
+        self.pending_clusters = []
+        self.pending_results = {}
+        self.save()
+
+    def delete(self) -> None:
+        """Removes the checkpoint file once the finished tree has been stored."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
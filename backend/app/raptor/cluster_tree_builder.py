@@ -1,14 +1,16 @@
 import logging
 import pickle
-from concurrent.futures import ThreadPoolExecutor
-from threading import Lock
-from typing import Dict, List, Set
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
-from .cluster_utils import ClusteringAlgorithm, RAPTOR_Clustering
+from .checkpoint import TreeBuildCheckpoint
+from .cluster_utils import (ClusteringAlgorithm, RAPTOR_Clustering,
+                            get_clustering_algorithm)
+from .incremental import IncrementalUpdateReport, update_tree
+from .scheduling import SummarizationScheduler, SummarizeEmbedPipeline
 from .tree_builder import TreeBuilder, TreeBuilderConfig
 from .tree_structures import Node, Tree
 from .utils import (distances_from_embeddings, get_children, get_embeddings,
-                    get_node_list, get_text,
+                    get_node_list, get_text, get_token_counts,
                     indices_of_nearest_neighbors_from_distances, split_text)
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
@@ -18,22 +20,58 @@ class ClusterTreeConfig(TreeBuilderConfig):
     def __init__(
         self,
         reduction_dimension=10,
-        clustering_algorithm=RAPTOR_Clustering,  # Default to RAPTOR clustering
+        clustering_algorithm=RAPTOR_Clustering,  # Backend name, ClusteringAlgorithm subclass or instance
         clustering_params={},  # Pass additional params as a dict
+        summarization_concurrency=4,  # Summaries in flight at once when multithreading
+        summarization_rate_limit=None,  # Summarization requests started per second, None for no limit
+        progress_callback=None,  # Called as progress_callback(layer, completed, total)
+        embedding_batch_size=32,  # Most summaries per embedding request in the layer pipeline
+        embedding_max_wait=0.05,  # Seconds the embedding stage waits to fill a batch
+        embedding_concurrency=1,  # Embedding requests in flight in the layer pipeline
         *args,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
         self.reduction_dimension = reduction_dimension
-        self.clustering_algorithm = clustering_algorithm
+        self.clustering_algorithm = get_clustering_algorithm(clustering_algorithm)
         self.clustering_params = clustering_params
 
+        if not isinstance(summarization_concurrency, int) or summarization_concurrency < 1:
+            raise ValueError("summarization_concurrency must be an integer and at least 1")
+        self.summarization_concurrency = summarization_concurrency
+
+        if summarization_rate_limit is not None and (
+            not isinstance(summarization_rate_limit, (int, float)) or summarization_rate_limit <= 0
+        ):
+            raise ValueError("summarization_rate_limit must be a positive number or None")
+        self.summarization_rate_limit = summarization_rate_limit
+
+        if progress_callback is not None and not callable(progress_callback):
+            raise ValueError("progress_callback must be callable or None")
+        self.progress_callback = progress_callback
+
+        if not isinstance(embedding_batch_size, int) or embedding_batch_size < 1:
+            raise ValueError("embedding_batch_size must be an integer and at least 1")
+        self.embedding_batch_size = embedding_batch_size
+
+        if not isinstance(embedding_max_wait, (int, float)) or embedding_max_wait < 0:
+            raise ValueError("embedding_max_wait must be a non-negative number")
+        self.embedding_max_wait = embedding_max_wait
+
+        if not isinstance(embedding_concurrency, int) or embedding_concurrency < 1:
+            raise ValueError("embedding_concurrency must be an integer and at least 1")
+        self.embedding_concurrency = embedding_concurrency
+
     def log_config(self):
         base_summary = super().log_config()
         cluster_tree_summary = f"""
         Reduction Dimension: {self.reduction_dimension}
-        Clustering Algorithm: {self.clustering_algorithm.__name__}
+        Clustering Algorithm: {type(self.clustering_algorithm).__name__}
         Clustering Parameters: {self.clustering_params}
+        Summarization Concurrency: {self.summarization_concurrency}
+        Summarization Rate Limit: {self.summarization_rate_limit}
+        Embedding Batch Size: {self.embedding_batch_size}
+        Embedding Concurrency: {self.embedding_concurrency}
         """
         return base_summary + cluster_tree_summary
 
@@ -47,46 +85,108 @@ class ClusterTreeBuilder(TreeBuilder):
         self.reduction_dimension = config.reduction_dimension
         self.clustering_algorithm = config.clustering_algorithm
         self.clustering_params = config.clustering_params
+        self.summarization_concurrency = config.summarization_concurrency
+        self.summarization_rate_limit = config.summarization_rate_limit
+        self.progress_callback = config.progress_callback
+        self.embedding_batch_size = config.embedding_batch_size
+        self.embedding_max_wait = config.embedding_max_wait
+        self.embedding_concurrency = config.embedding_concurrency
+        # Stage timings of the summarize/embed pipeline, per constructed layer
+        self.layer_timings: Dict[int, Dict[str, float]] = {}
 
         logging.info(
             f"Successfully initialized ClusterTreeBuilder with Config {config.log_config()}"
         )
 
+    def _layer_progress(self, layer: int):
+        def report(completed: int, total: int) -> None:
+            if completed == total or completed % 10 == 0:
+                logging.info(f"Layer {layer + 1}: summarized {completed}/{total} clusters")
+            if self.progress_callback is not None:
+                self.progress_callback(layer + 1, completed, total)
+
+        return report
+
+    def make_pipeline(self, use_multithreading: bool = True) -> SummarizeEmbedPipeline:
+        """Bounded, rate-limited summarization feeding the micro-batched embedding stage."""
+        return SummarizeEmbedPipeline(
+            SummarizationScheduler(
+                max_concurrency=self.summarization_concurrency if use_multithreading else 1,
+                rate_limit=self.summarization_rate_limit,
+            ),
+            embed_batch_size=self.embedding_batch_size,
+            embed_max_wait=self.embedding_max_wait,
+            embed_concurrency=self.embedding_concurrency,
+        )
+
+    def add_to_existing(
+        self,
+        tree: Tree,
+        text: str,
+        min_similarity: float = 0.3,
+        use_multithreading: bool = True,
+    ) -> Tuple[Tree, IncrementalUpdateReport]:
+        """
+        Splits text into chunks and adds them to tree incrementally: only the new chunks
+        are embedded and only their ancestors are re-summarized. See update_tree.
+
+        Returns:
+            Tuple[Tree, IncrementalUpdateReport]: The updated tree and what the update did.
+        """
+        chunks = split_text(text, self.tokenizer, self.max_tokens)
+        return self.add_chunks_to_existing(tree, chunks, min_similarity, use_multithreading)
+
+    def add_chunks_to_existing(
+        self,
+        tree: Tree,
+        chunks: List[str],
+        min_similarity: float = 0.3,
+        use_multithreading: bool = True,
+    ) -> Tuple[Tree, IncrementalUpdateReport]:
+        """Same as add_to_existing for text that is already chunked."""
+        return update_tree(
+            self,
+            tree,
+            chunks,
+            min_similarity=min_similarity,
+            use_multithreading=use_multithreading,
+        )
+
     def construct_tree(
         self,
         current_level_nodes: Dict[int, Node],
         all_tree_nodes: Dict[int, Node],
         layer_to_nodes: Dict[int, List[Node]],
-        use_multithreading: bool = False,
+        use_multithreading: bool = True,
+        checkpoint: Optional[TreeBuildCheckpoint] = None,
+        layer_callback: Optional[Callable[[int, Dict[int, List[Node]]], None]] = None,
     ) -> Dict[int, Node]:
+        """
+        Builds the layers above current_level_nodes. Construction starts above the highest
+        layer already in layer_to_nodes, so a build restored from a checkpoint continues
+        where it stopped.
+
+        Args:
+            use_multithreading (bool): Summarize up to summarization_concurrency clusters
+                of a layer at a time; False summarizes them one at a time.
+            checkpoint (Optional[TreeBuildCheckpoint]): If given, the clusters and finished
+                summaries of each layer are recorded as they complete, and a layer that was
+                in progress when the checkpoint was saved is finished instead of re-clustered.
+            layer_callback (Optional[Callable]): Called as layer_callback(layer, layer_to_nodes)
+                after each layer is complete, e.g. to publish the partial tree.
+        """
         logging.info("Using Cluster TreeBuilder")
 
         next_node_index = len(all_tree_nodes)
+        start_layer = max(layer_to_nodes)
 
-        def process_cluster(
-            cluster, new_level_nodes, next_node_index, summarization_length, lock
-        ):
-            node_texts = get_text(cluster)
-
-            summarized_text = self.summarize(
-                context=node_texts,
+        def summarize_cluster(cluster, summarization_length):
+            return self.summarize(
+                context=get_text(cluster),
                 max_tokens=summarization_length,
             )
 
-            logging.info(
-                f"Node Texts Length: {len(self.tokenizer.encode(node_texts))}, Summarized Text Length: {len(self.tokenizer.encode(summarized_text))}"
-            )
-
-            __, new_parent_node = self.create_node(
-                next_node_index, summarized_text, {node.index for node in cluster}
-            )
-
-            with lock:
-                new_level_nodes[next_node_index] = new_parent_node
-
-        for layer in range(self.num_layers):
-
-            new_level_nodes = {}
+        for layer in range(start_layer, self.num_layers):
 
             logging.info(f"Constructing Layer {layer}")
 
@@ -99,53 +199,72 @@ class ClusterTreeBuilder(TreeBuilder):
                 )
                 break
 
-            clusters = self.clustering_algorithm.perform_clustering(
-                node_list_current_layer,
-                self.cluster_embedding_model,
-                reduction_dimension=self.reduction_dimension,
-                **self.clustering_params,
-            )
-
-            lock = Lock()
+            finished = {}
+            if checkpoint is not None and checkpoint.pending_layer == layer + 1:
+                clusters = [
+                    [all_tree_nodes[index] for index in cluster]
+                    for cluster in checkpoint.pending_clusters
+                ]
+                finished = dict(checkpoint.pending_results)
+                logging.info(
+                    f"Layer {layer + 1}: resuming with {len(finished)}/{len(clusters)} clusters already summarized"
+                )
+            else:
+                clusters = self.clustering_algorithm.perform_clustering(
+                    node_list_current_layer,
+                    self.cluster_embedding_model,
+                    reduction_dimension=self.reduction_dimension,
+                    **self.clustering_params,
+                )
+                if checkpoint is not None:
+                    checkpoint.start_layer(layer + 1, clusters)
 
             summarization_length = self.summarization_length
             logging.info(f"Summarization Length: {summarization_length}")
 
-            if use_multithreading:
-                with ThreadPoolExecutor() as executor:
-                    for cluster in clusters:
-                        executor.submit(
-                            process_cluster,
-                            cluster,
-                            new_level_nodes,
-                            next_node_index,
-                            summarization_length,
-                            lock,
-                        )
-                        next_node_index += 1
-                    executor.shutdown(wait=True)
+            pending = [position for position in range(len(clusters)) if position not in finished]
+            on_item = None
+            if checkpoint is not None:
+                on_item = lambda offset, summary, embedding: checkpoint.record_summary(
+                    pending[offset], summary, embedding
+                )
 
-            else:
-                for cluster in clusters:
-                    process_cluster(
-                        cluster,
-                        new_level_nodes,
-                        next_node_index,
-                        summarization_length,
-                        lock,
-                    )
-                    next_node_index += 1
+            # A failing cluster aborts the layer; finished summaries are
+            # micro-batched into the embedding stage right away.
+            pending_summaries, pending_embeddings, stats = self.make_pipeline(use_multithreading).run(
+                lambda position: summarize_cluster(clusters[position], summarization_length),
+                self.embed_texts,
+                pending,
+                progress_callback=self._layer_progress(layer),
+                on_item=on_item,
+            )
+            self.layer_timings[layer + 1] = stats.as_dict()
+            logging.info(f"Layer {layer + 1} pipeline timings: {self.layer_timings[layer + 1]}")
+
+            finished.update(zip(pending, zip(pending_summaries, pending_embeddings)))
+            summaries = [finished[position][0] for position in range(len(clusters))]
+            embeddings = [finished[position][1] for position in range(len(clusters))]
+
+            new_level_nodes = self.create_nodes(
+                summaries,
+                next_node_index,
+                [{node.index for node in cluster} for cluster in clusters],
+                embeddings,
+            )
+            next_node_index += len(clusters)
+
+            for cluster, new_parent_node in zip(clusters, new_level_nodes.values()):
+                # Stored token counts stand in for re-encoding; the joined text adds only separators
+                logging.info(
+                    f"Node Texts Length: {int(get_token_counts(cluster, self.tokenizer).sum())}, Summarized Text Length: {new_parent_node.token_count}"
+                )
 
             layer_to_nodes[layer + 1] = list(new_level_nodes.values())
             current_level_nodes = new_level_nodes
             all_tree_nodes.update(new_level_nodes)
-
-            tree = Tree(
-                all_tree_nodes,
-                layer_to_nodes[layer + 1],
-                layer_to_nodes[0],
-                layer + 1,
-                layer_to_nodes,
-            )
+            if checkpoint is not None:
+                checkpoint.complete_layer(layer + 1, layer_to_nodes[layer + 1])
+            if layer_callback is not None:
+                layer_callback(layer + 1, layer_to_nodes)
 
         return current_level_nodes
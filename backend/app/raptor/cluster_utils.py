@@ -1,19 +1,26 @@
 import logging
+import multiprocessing
+import os
 import random
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 import tiktoken
 import umap
+from joblib import Parallel, delayed
+from sklearn.cluster import AgglomerativeClustering, MiniBatchKMeans
+from sklearn.decomposition import PCA
 from sklearn.mixture import GaussianMixture
+from sklearn.random_projection import GaussianRandomProjection
 
 # Initialize logging
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
 from .tree_structures import Node
 # Import necessary methods from other modules
-from .utils import get_embeddings
+from .utils import get_embeddings, get_token_counts, normalize_embeddings
 
 # Set a random seed for reproducibility
 RANDOM_SEED = 224
@@ -43,143 +50,811 @@ def local_cluster_embeddings(
     return reduced_embeddings
 
 
+class DimensionalityReducer(ABC):
+    """
+    Projects embeddings to a low dimension before GMM clustering.
+
+    perform_clustering calls reduce() once for the global pass and, for each local pass,
+    reuse_global() before falling back to reduce(..., local=True). Subclasses set
+    reusable_for_subsets when the global projection can simply be sliced for a subset
+    (data-independent projections), and stage_independent when a local fit on the full
+    row set would repeat the global fit.
+    """
+
+    reusable_for_subsets = False
+    stage_independent = False
+
+    def resolve(self, n_nodes: int) -> "DimensionalityReducer":
+        """Returns the concrete reducer to use for n_nodes rows."""
+        return self
+
+    @abstractmethod
+    def reduce(self, embeddings: np.ndarray, dim: int, local: bool = False) -> np.ndarray:
+        pass
+
+    def reuse_global(
+        self,
+        rows: np.ndarray,
+        n_total: int,
+        dim: int,
+        global_reduced: np.ndarray,
+    ) -> Optional[np.ndarray]:
+        """
+        Returns the local-pass reduction of rows taken from the global projection
+        (global_reduced, fitted on all n_total rows), or None if it has to be refitted.
+        """
+        if global_reduced.shape[1] != dim:
+            return None
+        if self.reusable_for_subsets:
+            return global_reduced[rows]
+        if self.stage_independent and len(rows) == n_total:
+            return global_reduced
+        return None
+
+
+class UMAPReducer(DimensionalityReducer):
+    """The original RAPTOR reduction: UMAP with sqrt(n) neighbours globally and 10 locally."""
+
+    def __init__(self, metric: str = "cosine", local_n_neighbors: int = 10) -> None:
+        self.metric = metric
+        self.local_n_neighbors = local_n_neighbors
+
+    def reduce(self, embeddings: np.ndarray, dim: int, local: bool = False) -> np.ndarray:
+        if local:
+            return local_cluster_embeddings(embeddings, dim, self.local_n_neighbors, self.metric)
+        return global_cluster_embeddings(embeddings, dim, metric=self.metric)
+
+
+class PCAReducer(DimensionalityReducer):
+    """PCA on L2-normalized embeddings; refitted per local pass, which is cheap."""
+
+    stage_independent = True
+
+    def __init__(self, random_state: int = RANDOM_SEED) -> None:
+        self.random_state = random_state
+
+    def reduce(self, embeddings: np.ndarray, dim: int, local: bool = False) -> np.ndarray:
+        return PCA(n_components=dim, random_state=self.random_state).fit_transform(
+            normalize_embeddings(embeddings)
+        )
+
+
+class RandomProjectionReducer(DimensionalityReducer):
+    """
+    Gaussian random projection of L2-normalized embeddings. The projection does not
+    depend on the data, so local passes slice the global result instead of refitting.
+    """
+
+    reusable_for_subsets = True
+    stage_independent = True
+
+    def __init__(self, random_state: int = RANDOM_SEED) -> None:
+        self.random_state = random_state
+
+    def reduce(self, embeddings: np.ndarray, dim: int, local: bool = False) -> np.ndarray:
+        return GaussianRandomProjection(
+            n_components=dim, random_state=self.random_state
+        ).fit_transform(normalize_embeddings(embeddings))
+
+
+class AutoReducer(DimensionalityReducer):
+    """
+    Picks a reducer by node count: UMAP up to umap_max_nodes, PCA up to pca_max_nodes,
+    Gaussian random projection beyond that. Local passes are resolved by their own size.
+    """
+
+    def __init__(self, umap_max_nodes: int = 5000, pca_max_nodes: int = 50000) -> None:
+        self.umap_max_nodes = umap_max_nodes
+        self.pca_max_nodes = pca_max_nodes
+        self.umap = UMAPReducer()
+        self.pca = PCAReducer()
+        self.random_projection = RandomProjectionReducer()
+
+    def resolve(self, n_nodes: int) -> DimensionalityReducer:
+        if n_nodes <= self.umap_max_nodes:
+            return self.umap
+        if n_nodes <= self.pca_max_nodes:
+            return self.pca
+        return self.random_projection
+
+    def reduce(self, embeddings: np.ndarray, dim: int, local: bool = False) -> np.ndarray:
+        return self.resolve(len(embeddings)).reduce(embeddings, dim, local)
+
+
+# Reducers selectable by name (perform_clustering(..., reducer="pca"))
+REDUCERS = {
+    "auto": AutoReducer,
+    "umap": UMAPReducer,
+    "pca": PCAReducer,
+    "random_projection": RandomProjectionReducer,
+}
+
+
+def get_reducer(reducer) -> DimensionalityReducer:
+    """Resolves a reducer name, a DimensionalityReducer subclass or an instance to an instance."""
+    if isinstance(reducer, str):
+        if reducer not in REDUCERS:
+            raise ValueError(
+                f"Unsupported reducer '{reducer}'. Supported reducers are: {list(REDUCERS.keys())}"
+            )
+        reducer = REDUCERS[reducer]
+    if isinstance(reducer, type) and issubclass(reducer, DimensionalityReducer):
+        reducer = reducer()
+    if not isinstance(reducer, DimensionalityReducer):
+        raise ValueError(
+            "reducer must be a reducer name, a DimensionalityReducer subclass or an instance of one"
+        )
+    return reducer
+
+
+def _fit_gmm(
+    embeddings: np.ndarray,
+    n_components: int,
+    random_state: int,
+    means_init: Optional[np.ndarray] = None,
+) -> Tuple[float, GaussianMixture]:
+    gm = GaussianMixture(
+        n_components=n_components, random_state=random_state, means_init=means_init
+    )
+    gm.fit(embeddings)
+    return gm.bic(embeddings), gm
+
+
+class BICEvaluator:
+    """
+    Fits GaussianMixture models for candidate cluster counts and memoizes (BIC, model).
+
+    Candidates are evaluated in batches that can run in parallel. A fit can be
+    warm-started from one named, already-fitted smaller model: its means plus the
+    worst-explained points as the extra components. The caller picks that model, never
+    the batching, so results depend only on the seed and not on n_jobs.
+    """
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        random_state: int = RANDOM_SEED,
+        n_jobs: Optional[int] = None,
+        warm_start: bool = True,
+    ) -> None:
+        # UMAP output is float32; GMM covariances of small clusters are ill-conditioned in float32
+        self.embeddings = np.asarray(embeddings, dtype=np.float64)
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.warm_start = warm_start
+        self.fitted: Dict[int, Tuple[float, GaussianMixture]] = {}
+
+    def _means_init(self, n_components: int, warm_start_from: Optional[int]) -> Optional[np.ndarray]:
+        if not self.warm_start or warm_start_from is None or warm_start_from >= n_components:
+            return None
+        base = self.fitted[warm_start_from][1]
+        missing = n_components - base.n_components
+        worst_explained = np.argsort(base.score_samples(self.embeddings), kind="stable")
+        return np.vstack([base.means_, self.embeddings[worst_explained[:missing]]])
+
+    def evaluate(self, candidates: List[int], warm_start_from: Optional[int] = None) -> List[float]:
+        """
+        Returns the BIC of each candidate cluster count, fitting the ones not seen yet.
+        New fits with more components than the fitted model warm_start_from are
+        warm-started from it; all others are fitted cold.
+        """
+        pending = [k for k in dict.fromkeys(candidates) if k not in self.fitted]
+        jobs = [
+            (self.embeddings, k, self.random_state, self._means_init(k, warm_start_from))
+            for k in pending
+        ]
+
+        if self.n_jobs is not None and self.n_jobs != 1 and len(jobs) > 1:
+            results = Parallel(n_jobs=self.n_jobs)(delayed(_fit_gmm)(*job) for job in jobs)
+        else:
+            results = [_fit_gmm(*job) for job in jobs]
+
+        self.fitted.update(zip(pending, results))
+        return [self.fitted[k][0] for k in candidates]
+
+    def best(self, candidates: List[int]) -> int:
+        """The candidate with the lowest BIC (ties go to fewer clusters)."""
+        return min(candidates, key=lambda k: (self.fitted[k][0], k))
+
+
+def exhaustive_search(evaluator: BICEvaluator, candidates: List[int], patience: int) -> int:
+    """Fits every candidate (the original behaviour)."""
+    evaluator.evaluate(candidates)
+    return evaluator.best(candidates)
+
+
+def coarse_to_fine_search(
+    evaluator: BICEvaluator, candidates: List[int], patience: int
+) -> int:
+    """
+    Scans a coarse grid (step ~ sqrt(len(candidates))) in ascending order, stopping once
+    `patience` consecutive grid points fail to improve the best BIC, then fits every
+    candidate within one step of the best grid point. Grid points are fitted cold and
+    the fine window is warm-started from the best grid model only, so neither depends
+    on how the grid was batched.
+    """
+    step = max(1, int(np.sqrt(len(candidates))))
+    grid = candidates[::step]
+    batch_size = len(grid) if evaluator.n_jobs == -1 else max(1, evaluator.n_jobs or 1)
+
+    scanned, misses = [], 0
+    for start in range(0, len(grid), batch_size):
+        batch = grid[start:start + batch_size]
+        # Consume results in order so the stopping point does not depend on batch_size
+        for k, bic in zip(batch, evaluator.evaluate(batch)):
+            improved = not scanned or bic < min(evaluator.fitted[j][0] for j in scanned)
+            scanned.append(k)
+            misses = 0 if improved else misses + 1
+            if misses >= patience:
+                break
+        if misses >= patience:
+            break
+
+    position = candidates.index(evaluator.best(scanned))
+    window = candidates[max(0, position - step + 1):position + step]
+    evaluator.evaluate(window, warm_start_from=candidates[position])
+    return evaluator.best(scanned + window)
+
+
+def bisection_search(evaluator: BICEvaluator, candidates: List[int], patience: int) -> int:
+    """
+    Assumes BIC is roughly unimodal in the cluster count and bisects on its slope,
+    comparing BIC(k) with BIC(k + 1). Needs about 2 * log2(len(candidates)) fits.
+    """
+    low, high = 0, len(candidates) - 1
+    while low < high:
+        middle = (low + high) // 2
+        bic_middle, bic_next = evaluator.evaluate([candidates[middle], candidates[middle + 1]])
+        if bic_next < bic_middle:
+            low = middle + 1
+        else:
+            high = middle
+    evaluator.evaluate([candidates[low]])
+    return candidates[low]
+
+
+# Cluster-count search strategies; register a callable(evaluator, candidates, patience) -> k to add one
+CLUSTER_COUNT_STRATEGIES: Dict[str, Callable[[BICEvaluator, List[int], int], int]] = {
+    "exhaustive": exhaustive_search,
+    "coarse_to_fine": coarse_to_fine_search,
+    "bisection": bisection_search,
+}
+
+
+def select_gmm(
+    embeddings: np.ndarray,
+    max_clusters: int = 50,
+    random_state: int = RANDOM_SEED,
+    strategy: str = "coarse_to_fine",
+    n_jobs: Optional[int] = None,
+    patience: int = 3,
+    warm_start: bool = True,
+) -> Tuple[int, GaussianMixture]:
+    """
+    Chooses the number of mixture components by BIC and returns it with the fitted model,
+    so callers do not need to refit the winner.
+
+    Args:
+        embeddings (np.ndarray): The (reduced) embeddings to cluster.
+        max_clusters (int): Candidates are 1 .. min(max_clusters, n) - 1.
+        random_state (int): Seed for every GaussianMixture fit; labels are deterministic for a given seed.
+        strategy (str): A key of CLUSTER_COUNT_STRATEGIES.
+        n_jobs (Optional[int]): Parallel fits via joblib; None or 1 fits serially.
+        patience (int): Early-stopping patience for strategies that support it.
+        warm_start (bool): Warm-start the coarse_to_fine window from the best grid model.
+
+    Returns:
+        Tuple[int, GaussianMixture]: The selected number of clusters and its fitted model.
+    """
+    if strategy not in CLUSTER_COUNT_STRATEGIES:
+        raise ValueError(
+            f"Unsupported cluster count strategy '{strategy}'. Supported strategies are: {list(CLUSTER_COUNT_STRATEGIES.keys())}"
+        )
+
+    candidates = list(range(1, max(2, min(max_clusters, len(embeddings)))))
+    evaluator = BICEvaluator(embeddings, random_state, n_jobs, warm_start)
+    n_clusters = CLUSTER_COUNT_STRATEGIES[strategy](evaluator, candidates, patience)
+    return n_clusters, evaluator.fitted[n_clusters][1]
+
+
 def get_optimal_clusters(
-    embeddings: np.ndarray, max_clusters: int = 50, random_state: int = RANDOM_SEED
+    embeddings: np.ndarray,
+    max_clusters: int = 50,
+    random_state: int = RANDOM_SEED,
+    strategy: str = "exhaustive",
+    n_jobs: Optional[int] = None,
 ) -> int:
-    max_clusters = min(max_clusters, len(embeddings))
-    n_clusters = np.arange(1, max_clusters)
-    bics = []
-    for n in n_clusters:
-        gm = GaussianMixture(n_components=n, random_state=random_state)
-        gm.fit(embeddings)
-        bics.append(gm.bic(embeddings))
-    optimal_clusters = n_clusters[np.argmin(bics)]
+    optimal_clusters, _ = select_gmm(
+        embeddings, max_clusters, random_state, strategy, n_jobs, warm_start=False
+    )
     return optimal_clusters
 
 
-def GMM_cluster(embeddings: np.ndarray, threshold: float, random_state: int = 0):
-    n_clusters = get_optimal_clusters(embeddings)
-    gm = GaussianMixture(n_components=n_clusters, random_state=random_state)
-    gm.fit(embeddings)
+def GMM_cluster(
+    embeddings: np.ndarray,
+    threshold: float,
+    random_state: int = 0,
+    strategy: str = "coarse_to_fine",
+    n_jobs: Optional[int] = None,
+):
+    n_clusters, gm = select_gmm(
+        embeddings, random_state=random_state, strategy=strategy, n_jobs=n_jobs
+    )
     probs = gm.predict_proba(embeddings)
     labels = [np.where(prob > threshold)[0] for prob in probs]
     return labels, n_clusters
 
 
+def labels_to_clusters(labels: List[np.ndarray], n_clusters: int) -> List[np.ndarray]:
+    """
+    Inverts per-row soft cluster labels into per-cluster member index arrays.
+
+    Args:
+        labels (List[np.ndarray]): labels[i] holds the clusters row i belongs to.
+        n_clusters (int): The number of clusters.
+
+    Returns:
+        List[np.ndarray]: For each cluster, the sorted row indices of its members.
+    """
+    counts = np.fromiter((len(label) for label in labels), dtype=np.int64, count=len(labels))
+    rows = np.repeat(np.arange(len(labels)), counts)
+    flat_labels = (
+        np.concatenate(labels).astype(np.int64) if len(rows) else np.empty(0, dtype=np.int64)
+    )
+
+    order = np.argsort(flat_labels, kind="stable")
+    sizes = np.bincount(flat_labels, minlength=n_clusters)
+    return np.split(rows[order], np.cumsum(sizes)[:-1])
+
+
+def _local_pass(
+    embeddings: np.ndarray,
+    reducer: Optional[DimensionalityReducer],
+    dim: int,
+    threshold: float,
+    cluster_count_strategy: str,
+    n_jobs: Optional[int],
+) -> List[np.ndarray]:
+    """
+    Local clustering of one global cluster. embeddings are already reduced when reducer is
+    None. Returns the non-empty local clusters as row positions into embeddings.
+    """
+    if reducer is not None:
+        embeddings = reducer.reduce(embeddings, dim, local=True)
+    local_clusters, n_local_clusters = GMM_cluster(
+        embeddings, threshold, strategy=cluster_count_strategy, n_jobs=n_jobs
+    )
+    return [
+        local_members
+        for local_members in labels_to_clusters(local_clusters, n_local_clusters)
+        if len(local_members)
+    ]
+
+
 def perform_clustering(
-    embeddings: np.ndarray, dim: int, threshold: float, verbose: bool = False
+    embeddings: np.ndarray,
+    dim: int,
+    threshold: float,
+    verbose: bool = False,
+    cluster_count_strategy: str = "coarse_to_fine",
+    n_jobs: Optional[int] = None,
+    reducer="auto",
+    local_workers: Optional[int] = None,
+    parallel_min_rows: int = 2000,
 ) -> List[np.ndarray]:
-    reduced_embeddings_global = global_cluster_embeddings(embeddings, min(dim, len(embeddings) -2))
+    """
+    Two-stage (global, then local) soft clustering of the embedding rows.
+    cluster_count_strategy and n_jobs are passed to select_gmm; reducer is a name from
+    REDUCERS or a DimensionalityReducer.
+
+    The local passes are independent and run on a process pool of local_workers processes
+    (-1 for one per CPU) when there are at least parallel_min_rows rows and two local
+    passes; otherwise they run serially. Results are merged in global-cluster order either way.
+    Workers are spawned rather than forked: the caller is typically a build thread in a
+    multithreaded server, and a forked child can deadlock on locks held by other threads.
+
+    Returns:
+        List[np.ndarray]: One array of row indices into embeddings per cluster, ordered by
+            global cluster and then local cluster. A row may appear in several clusters.
+    """
+    reducer = get_reducer(reducer)
+    global_reducer = reducer.resolve(len(embeddings))
+    reduced_embeddings_global = global_reducer.reduce(embeddings, min(dim, len(embeddings) - 2))
     global_clusters, n_global_clusters = GMM_cluster(
-        reduced_embeddings_global, threshold
+        reduced_embeddings_global, threshold, strategy=cluster_count_strategy, n_jobs=n_jobs
     )
 
     if verbose:
-        logging.info(f"Global Clusters: {n_global_clusters}")
+        logging.info(f"Reducer: {type(global_reducer).__name__}, Global Clusters: {n_global_clusters}")
 
-    all_local_clusters = [np.array([]) for _ in range(len(embeddings))]
-    total_clusters = 0
+    # One entry per non-empty global cluster: its members and either a finished
+    # clustering (small clusters stay whole) or the arguments of its local pass
+    passes = []
+    for global_members in labels_to_clusters(global_clusters, n_global_clusters):
+        if len(global_members) == 0:
+            continue
+        if len(global_members) <= dim + 1:
+            passes.append((global_members, [np.arange(len(global_members))], None))
+            continue
+        local_reducer = reducer.resolve(len(global_members))
+        reused = None
+        if local_reducer is global_reducer:
+            reused = global_reducer.reuse_global(
+                global_members, len(embeddings), dim, reduced_embeddings_global
+            )
+        if reused is not None:
+            local_args = (reused, None)
+        else:
+            local_args = (embeddings[global_members], local_reducer)
+        passes.append((global_members, None, local_args))
+
+    pending = [i for i, (_, done, _) in enumerate(passes) if done is None]
+    workers = os.cpu_count() if local_workers == -1 else local_workers
+    parallel = (
+        workers is not None
+        and workers > 1
+        and len(pending) > 1
+        and len(embeddings) >= parallel_min_rows
+    )
 
-    for i in range(n_global_clusters):
-        global_cluster_embeddings_ = embeddings[
-            np.array([i in gc for gc in global_clusters])
+    if parallel:
+        workers = min(workers, len(pending))
+        if verbose:
+            logging.info(f"Running {len(pending)} local passes on {workers} processes")
+        # Each process handles one pass; nested GMM parallelism would oversubscribe the CPUs
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _local_pass, *passes[i][2], dim, threshold, cluster_count_strategy, 1
+                )
+                for i in pending
+            ]
+            results = [future.result() for future in futures]
+    else:
+        results = [
+            _local_pass(*passes[i][2], dim, threshold, cluster_count_strategy, n_jobs)
+            for i in pending
         ]
+    for i, local_clusters in zip(pending, results):
+        passes[i] = (passes[i][0], local_clusters, None)
+
+    clusters = []
+    for i, (global_members, local_clusters, _) in enumerate(passes):
         if verbose:
             logging.info(
-                f"Nodes in Global Cluster {i}: {len(global_cluster_embeddings_)}"
-            )
-        if len(global_cluster_embeddings_) == 0:
-            continue
-        if len(global_cluster_embeddings_) <= dim + 1:
-            local_clusters = [np.array([0]) for _ in global_cluster_embeddings_]
-            n_local_clusters = 1
-        else:
-            reduced_embeddings_local = local_cluster_embeddings(
-                global_cluster_embeddings_, dim
-            )
-            local_clusters, n_local_clusters = GMM_cluster(
-                reduced_embeddings_local, threshold
+                f"Nodes in Global Cluster {i}: {len(global_members)}, Local Clusters: {len(local_clusters)}"
             )
+        # Local member positions index into global_members, which index into embeddings
+        clusters.extend(global_members[local_members] for local_members in local_clusters)
 
-        if verbose:
-            logging.info(f"Local Clusters in Global Cluster {i}: {n_local_clusters}")
+    if verbose:
+        logging.info(f"Total Clusters: {len(clusters)}")
+    return clusters
 
-        for j in range(n_local_clusters):
-            local_cluster_embeddings_ = global_cluster_embeddings_[
-                np.array([j in lc for lc in local_clusters])
-            ]
-            indices = np.where(
-                (embeddings == local_cluster_embeddings_[:, None]).all(-1)
-            )[1]
-            for idx in indices:
-                all_local_clusters[idx] = np.append(
-                    all_local_clusters[idx], j + total_clusters
-                )
 
-        total_clusters += n_local_clusters
+def choose_n_clusters(
+    n_nodes: int, total_tokens: int, max_length_in_cluster: int, target_cluster_size: int
+) -> int:
+    """Enough clusters for both the target cluster size and the token budget, capped at n_nodes."""
+    by_size = int(np.ceil(n_nodes / target_cluster_size))
+    by_budget = int(np.ceil(total_tokens / max_length_in_cluster))
+    return int(np.clip(max(by_size, by_budget), 1, n_nodes))
 
-    if verbose:
-        logging.info(f"Total Clusters: {total_clusters}")
-    return all_local_clusters
+
+def spherical_kmeans(
+    embeddings: np.ndarray, n_clusters: int, random_state: int = RANDOM_SEED, max_iter: int = 50
+) -> np.ndarray:
+    """
+    k-means on the unit sphere: rows are L2-normalized, assigned by maximum cosine
+    similarity, and centroids are renormalized means. Seeded with k-means++.
+
+    Returns:
+        np.ndarray: One label per row.
+    """
+    unit = normalize_embeddings(embeddings)
+    rng = np.random.default_rng(random_state)
+
+    centroids = [unit[rng.integers(len(unit))]]
+    closest = 1.0 - unit @ centroids[0]
+    for _ in range(1, n_clusters):
+        weights = np.maximum(closest, 0.0) ** 2
+        total = weights.sum()
+        choice = rng.choice(len(unit), p=weights / total) if total > 0 else rng.integers(len(unit))
+        centroids.append(unit[choice])
+        closest = np.minimum(closest, 1.0 - unit @ unit[choice])
+    centroids = np.array(centroids)
+
+    labels = np.full(len(unit), -1)
+    for _ in range(max_iter):
+        new_labels = np.argmax(unit @ centroids.T, axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for k in range(n_clusters):
+            members = unit[labels == k]
+            if len(members):
+                centroids[k] = members.sum(axis=0)
+        centroids = normalize_embeddings(centroids)
+    return labels
+
+
+def enforce_token_budget(
+    clusters: List[np.ndarray],
+    embeddings: np.ndarray,
+    lengths: np.ndarray,
+    max_length_in_cluster: int,
+    random_state: int = RANDOM_SEED,
+) -> List[np.ndarray]:
+    """
+    Splits every multi-node cluster whose token total exceeds max_length_in_cluster with
+    spherical 2-means until all clusters fit (or are single nodes).
+    """
+    result = []
+    stack = list(reversed(clusters))
+    while stack:
+        rows = stack.pop()
+        if len(rows) <= 1 or lengths[rows].sum() <= max_length_in_cluster:
+            result.append(rows)
+            continue
+        labels = spherical_kmeans(embeddings[rows], 2, random_state)
+        halves = [rows[labels == 0], rows[labels == 1]]
+        if not len(halves[0]) or not len(halves[1]):
+            halves = [rows[: len(rows) // 2], rows[len(rows) // 2:]]
+        stack.extend(reversed(halves))
+    return result
 
 
 class ClusteringAlgorithm(ABC):
+    """
+    A clustering backend for ClusterTreeBuilder: groups the nodes of one layer into
+    clusters, each of which is summarized into a parent node.
+    """
+
     @abstractmethod
-    def perform_clustering(self, embeddings: np.ndarray, **kwargs) -> List[List[int]]:
+    def perform_clustering(
+        self, nodes: List[Node], embedding_model_name: str, **kwargs
+    ) -> List[List[Node]]:
         pass
 
 
 class RAPTOR_Clustering(ClusteringAlgorithm):
+    """UMAP reduction followed by global and local Gaussian mixture clustering."""
+
     def perform_clustering(
+        self,
         nodes: List[Node],
         embedding_model_name: str,
         max_length_in_cluster: int = 3500,
-        tokenizer=tiktoken.get_encoding("cl100k_base"),
+        tokenizer=None,
         reduction_dimension: int = 10,
         threshold: float = 0.1,
         verbose: bool = False,
+        cluster_count_strategy: str = "coarse_to_fine",
+        n_jobs: Optional[int] = None,
+        reducer="auto",
+        local_workers: Optional[int] = None,
     ) -> List[List[Node]]:
-        # Get the embeddings from the nodes
-        embeddings = np.array([node.embeddings[embedding_model_name] for node in nodes])
+        if tokenizer is None:
+            tokenizer = tiktoken.get_encoding("cl100k_base")
+
+        # Get the embeddings and (stored) token counts of the nodes once, for every recursion level
+        embeddings = get_embeddings(nodes, embedding_model_name)
+        lengths = get_token_counts(nodes, tokenizer)
+
+        def cluster_rows(rows: np.ndarray) -> List[np.ndarray]:
+            # Cluster a subset of rows; returned clusters are row indices into nodes
+            clusters = perform_clustering(
+                embeddings[rows],
+                dim=reduction_dimension,
+                threshold=threshold,
+                cluster_count_strategy=cluster_count_strategy,
+                n_jobs=n_jobs,
+                reducer=reducer,
+                local_workers=local_workers,
+            )
+            row_clusters = []
+
+            for members in clusters:
+                cluster_rows_ = rows[members]
+
+                # Base case: if the cluster only has one node, do not attempt to recluster it
+                if len(cluster_rows_) == 1:
+                    row_clusters.append(cluster_rows_)
+                    continue
+
+                # Calculate the total length of the text in the nodes
+                total_length = int(lengths[cluster_rows_].sum())
+
+                # If the total length exceeds the maximum allowed length, recluster this cluster
+                # (unless clustering could not split it any further)
+                if total_length > max_length_in_cluster and len(cluster_rows_) < len(rows):
+                    if verbose:
+                        logging.info(
+                            f"reclustering cluster with {len(cluster_rows_)} nodes"
+                        )
+                    row_clusters.extend(cluster_rows(cluster_rows_))
+                else:
+                    row_clusters.append(cluster_rows_)
+
+            return row_clusters
+
+        return [
+            [nodes[row] for row in rows]
+            for rows in cluster_rows(np.arange(len(nodes)))
+        ]
 
-        # Perform the clustering
-        clusters = perform_clustering(
-            embeddings, dim=reduction_dimension, threshold=threshold
+
+class MiniBatchKMeansClustering(ClusteringAlgorithm):
+    """
+    Hard MiniBatchKMeans clustering on the raw embeddings. The cluster count follows from
+    target_cluster_size and the token budget; oversized clusters are split afterwards.
+    """
+
+    def perform_clustering(
+        self,
+        nodes: List[Node],
+        embedding_model_name: str,
+        max_length_in_cluster: int = 3500,
+        tokenizer=None,
+        reduction_dimension: int = 10,
+        target_cluster_size: int = 8,
+        batch_size: int = 1024,
+        random_state: int = RANDOM_SEED,
+        verbose: bool = False,
+    ) -> List[List[Node]]:
+        # reduction_dimension is accepted for interface compatibility; no reduction is done
+        if tokenizer is None:
+            tokenizer = tiktoken.get_encoding("cl100k_base")
+
+        embeddings = get_embeddings(nodes, embedding_model_name)
+        lengths = get_token_counts(nodes, tokenizer)
+        n_clusters = choose_n_clusters(
+            len(nodes), int(lengths.sum()), max_length_in_cluster, target_cluster_size
         )
 
-        # Initialize an empty list to store the clusters of nodes
-        node_clusters = []
+        labels = MiniBatchKMeans(
+            n_clusters=n_clusters,
+            batch_size=batch_size,
+            random_state=random_state,
+            n_init=3,
+        ).fit_predict(embeddings)
 
-        # Iterate over each unique label in the clusters
-        for label in np.unique(np.concatenate(clusters)):
-            # Get the indices of the nodes that belong to this cluster
-            indices = [i for i, cluster in enumerate(clusters) if label in cluster]
+        clusters = [rows for rows in labels_to_clusters(labels[:, None], n_clusters) if len(rows)]
+        clusters = enforce_token_budget(
+            clusters, embeddings, lengths, max_length_in_cluster, random_state
+        )
+        if verbose:
+            logging.info(f"MiniBatchKMeans: {len(nodes)} nodes -> {len(clusters)} clusters")
+        return [[nodes[row] for row in rows] for rows in clusters]
 
-            # Add the corresponding nodes to the node_clusters list
-            cluster_nodes = [nodes[i] for i in indices]
 
-            # Base case: if the cluster only has one node, do not attempt to recluster it
-            if len(cluster_nodes) == 1:
-                node_clusters.append(cluster_nodes)
-                continue
+class SphericalKMeansClustering(ClusteringAlgorithm):
+    """
+    Spherical k-means (cosine k-means) on L2-normalized embeddings, which matches the
+    cosine geometry used at retrieval time. Oversized clusters are split afterwards.
+    """
 
-            # Calculate the total length of the text in the nodes
-            total_length = sum(
-                [len(tokenizer.encode(node.text)) for node in cluster_nodes]
-            )
+    def perform_clustering(
+        self,
+        nodes: List[Node],
+        embedding_model_name: str,
+        max_length_in_cluster: int = 3500,
+        tokenizer=None,
+        reduction_dimension: int = 10,
+        target_cluster_size: int = 8,
+        random_state: int = RANDOM_SEED,
+        verbose: bool = False,
+    ) -> List[List[Node]]:
+        # reduction_dimension is accepted for interface compatibility; no reduction is done
+        if tokenizer is None:
+            tokenizer = tiktoken.get_encoding("cl100k_base")
+
+        embeddings = get_embeddings(nodes, embedding_model_name, normalized=True)
+        lengths = get_token_counts(nodes, tokenizer)
+        n_clusters = choose_n_clusters(
+            len(nodes), int(lengths.sum()), max_length_in_cluster, target_cluster_size
+        )
 
-            # If the total length exceeds the maximum allowed length, recluster this cluster
-            if total_length > max_length_in_cluster:
-                if verbose:
-                    logging.info(
-                        f"reclustering cluster with {len(cluster_nodes)} nodes"
-                    )
-                node_clusters.extend(
-                    RAPTOR_Clustering.perform_clustering(
-                        cluster_nodes, embedding_model_name, max_length_in_cluster
-                    )
-                )
+        labels = spherical_kmeans(embeddings, n_clusters, random_state)
+
+        clusters = [rows for rows in labels_to_clusters(labels[:, None], n_clusters) if len(rows)]
+        clusters = enforce_token_budget(
+            clusters, embeddings, lengths, max_length_in_cluster, random_state
+        )
+        if verbose:
+            logging.info(f"Spherical k-means: {len(nodes)} nodes -> {len(clusters)} clusters")
+        return [[nodes[row] for row in rows] for rows in clusters]
+
+
+class AgglomerativeBudgetClustering(ClusteringAlgorithm):
+    """
+    Average-linkage agglomerative clustering under cosine distance, cut top-down: a
+    subtree of the dendrogram becomes a cluster as soon as its token total fits
+    max_length_in_cluster and it has at most target_cluster_size nodes.
+    Needs O(n^2) memory for the distance matrix, so it suits layers up to a few thousand nodes.
+    """
+
+    def perform_clustering(
+        self,
+        nodes: List[Node],
+        embedding_model_name: str,
+        max_length_in_cluster: int = 3500,
+        tokenizer=None,
+        reduction_dimension: int = 10,
+        target_cluster_size: int = 8,
+        verbose: bool = False,
+    ) -> List[List[Node]]:
+        # reduction_dimension is accepted for interface compatibility; no reduction is done
+        if tokenizer is None:
+            tokenizer = tiktoken.get_encoding("cl100k_base")
+
+        n_nodes = len(nodes)
+        if n_nodes < 2:
+            return [list(nodes)]
+
+        embeddings = get_embeddings(nodes, embedding_model_name, normalized=True)
+        lengths = get_token_counts(nodes, tokenizer)
+
+        merges = AgglomerativeClustering(
+            n_clusters=1, metric="cosine", linkage="average", compute_full_tree=True
+        ).fit(embeddings).children_
+
+        # Leaves 0..n-1 are nodes; merge i creates dendrogram node n + i
+        sizes = np.concatenate([np.ones(n_nodes, dtype=np.int64), np.zeros(len(merges), dtype=np.int64)])
+        tokens = np.concatenate([lengths, np.zeros(len(merges), dtype=np.int64)])
+        for i, (left, right) in enumerate(merges):
+            sizes[n_nodes + i] = sizes[left] + sizes[right]
+            tokens[n_nodes + i] = tokens[left] + tokens[right]
+
+        def members(dendrogram_node: int) -> List[int]:
+            rows, stack = [], [dendrogram_node]
+            while stack:
+                current = stack.pop()
+                if current < n_nodes:
+                    rows.append(current)
+                else:
+                    stack.extend(merges[current - n_nodes])
+            return sorted(rows)
+
+        clusters, stack = [], [n_nodes + len(merges) - 1]
+        while stack:
+            current = stack.pop()
+            fits = tokens[current] <= max_length_in_cluster and sizes[current] <= target_cluster_size
+            if current < n_nodes or fits:
+                clusters.append(members(current))
             else:
-                node_clusters.append(cluster_nodes)
+                stack.extend(reversed(merges[current - n_nodes]))
 
-        return node_clusters
+        if verbose:
+            logging.info(f"Agglomerative: {n_nodes} nodes -> {len(clusters)} clusters")
+        return [[nodes[row] for row in rows] for rows in clusters]
+
+
+# Clustering backends selectable by name (e.g. ClusterTreeConfig(clustering_algorithm="spherical_kmeans"))
+CLUSTERING_BACKENDS = {
+    "raptor": RAPTOR_Clustering,
+    "minibatch_kmeans": MiniBatchKMeansClustering,
+    "spherical_kmeans": SphericalKMeansClustering,
+    "agglomerative": AgglomerativeBudgetClustering,
+}
+
+
+def get_clustering_algorithm(algorithm) -> ClusteringAlgorithm:
+    """
+    Resolves a backend name, a ClusteringAlgorithm subclass or an instance to an instance.
+    """
+    if isinstance(algorithm, str):
+        if algorithm not in CLUSTERING_BACKENDS:
+            raise ValueError(
+                f"Unsupported clustering backend '{algorithm}'. Supported backends are: {list(CLUSTERING_BACKENDS.keys())}"
+            )
+        algorithm = CLUSTERING_BACKENDS[algorithm]
+    if isinstance(algorithm, type) and issubclass(algorithm, ClusteringAlgorithm):
+        algorithm = algorithm()
+    if not isinstance(algorithm, ClusteringAlgorithm):
+        raise ValueError(
+            "clustering_algorithm must be a backend name, a ClusteringAlgorithm subclass or an instance of one"
+        )
+    return algorithm
@@ -0,0 +1,244 @@
+import logging
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from .tree_structures import Node, Tree
+from .utils import (get_embeddings, get_text, get_token_counts,
+                    normalize_embeddings)
+
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+# Nearest parents tried (in order) for each new node before it is left unassigned
+CANDIDATE_PARENTS = 3
+
+
+class IncrementalUpdateReport:
+    """Counts of what an incremental tree update did, and the LLM calls it avoided."""
+
+    def __init__(self) -> None:
+        self.new_leaves = 0
+        self.assigned_to_existing = 0
+        self.new_parents = 0
+        self.resummarized_parents = 0
+        self.llm_calls = 0
+        self.full_rebuild_llm_calls = 0
+        # Indices given to the new leaves, in the order of the added texts
+        self.leaf_indices: List[int] = []
+
+    @property
+    def llm_calls_saved(self) -> int:
+        return max(0, self.full_rebuild_llm_calls - self.llm_calls)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "new_leaves": self.new_leaves,
+            "assigned_to_existing": self.assigned_to_existing,
+            "new_parents": self.new_parents,
+            "resummarized_parents": self.resummarized_parents,
+            "llm_calls": self.llm_calls,
+            "full_rebuild_llm_calls": self.full_rebuild_llm_calls,
+            "llm_calls_saved": self.llm_calls_saved,
+        }
+
+
+def pack_by_budget(nodes: List[Node], token_counts: np.ndarray, max_length: int) -> List[List[Node]]:
+    """Splits nodes, in order, into consecutive groups of at most max_length tokens."""
+    groups, current, used = [], [], 0
+    for node, tokens in zip(nodes, token_counts):
+        if current and used + tokens > max_length:
+            groups.append(current)
+            current, used = [], 0
+        current.append(node)
+        used += int(tokens)
+    if current:
+        groups.append(current)
+    return groups
+
+
+def update_tree(
+    builder,
+    tree: Tree,
+    texts: List[str],
+    min_similarity: float = 0.3,
+    use_multithreading: bool = True,
+) -> Tuple[Tree, IncrementalUpdateReport]:
+    """
+    Adds texts as new leaves to an existing tree without rebuilding it.
+
+    Working bottom-up, every new node joins the existing parent whose children's mean
+    (normalized) embedding is most similar, provided the similarity is at least
+    min_similarity and the parent stays within the clustering token budget. New nodes
+    that fit nowhere are clustered (or packed by token budget) into new parents. Only
+    parents that gained children, parents of re-summarized nodes and new parents are
+    summarized; every other node is kept as is.
+
+    Args:
+        builder (ClusterTreeBuilder): Supplies the models, tokenizer, clustering and pipeline.
+        tree (Tree): The existing tree; it is not modified.
+        texts (List[str]): The new leaf chunks.
+        min_similarity (float): Minimum cosine similarity for joining an existing parent.
+        use_multithreading (bool): Whether to summarize with the configured concurrency.
+
+    Returns:
+        Tuple[Tree, IncrementalUpdateReport]: The updated tree and what the update did.
+    """
+    report = IncrementalUpdateReport()
+    model = builder.cluster_embedding_model
+    max_length = builder.clustering_params.get("max_length_in_cluster", 3500)
+
+    all_nodes = tree.to_nodes()
+    layer_to_nodes = {
+        layer: [all_nodes[node.index] for node in nodes]
+        for layer, nodes in tree.layer_to_nodes.items()
+    }
+    top_layer = max(layer_to_nodes)
+    next_index = max(all_nodes) + 1 if all_nodes else 0
+
+    new_leaves = builder.create_nodes(texts, next_index)
+    next_index += len(texts)
+    all_nodes.update(new_leaves)
+    layer_to_nodes[0].extend(new_leaves.values())
+    report.new_leaves = len(new_leaves)
+    report.leaf_indices = list(new_leaves)
+
+    new_indices: List[int] = list(new_leaves)
+    changed_indices: Set[int] = set()
+
+    for layer in range(top_layer):
+        if not new_indices and not changed_indices:
+            break
+
+        parents = layer_to_nodes[layer + 1]
+        child_sets = {parent.index: set(parent.children) for parent in parents}
+        dirty = {parent.index for parent in parents if parent.children & changed_indices}
+
+        unassigned = []
+        if new_indices and not parents:
+            # No parents on the next layer to attach to: every new node forms new parents
+            unassigned = [all_nodes[index] for index in new_indices]
+        elif new_indices:
+            new_nodes = [all_nodes[index] for index in new_indices]
+            new_embeddings = normalize_embeddings(get_embeddings(new_nodes, model))
+            new_tokens = get_token_counts(new_nodes, builder.tokenizer)
+
+            parent_children = [[all_nodes[child] for child in sorted(parent.children)] for parent in parents]
+            centroids = normalize_embeddings(
+                np.stack(
+                    [
+                        normalize_embeddings(get_embeddings(children, model)).mean(axis=0)
+                        for children in parent_children
+                    ]
+                )
+            )
+            budgets = np.array(
+                [get_token_counts(children, builder.tokenizer).sum() for children in parent_children]
+            )
+            similarities = new_embeddings @ centroids.T
+
+            for row, node in enumerate(new_nodes):
+                assigned = False
+                for parent_row in np.argsort(-similarities[row], kind="stable")[:CANDIDATE_PARENTS]:
+                    if similarities[row, parent_row] < min_similarity:
+                        break
+                    if budgets[parent_row] + new_tokens[row] <= max_length:
+                        parent_index = parents[parent_row].index
+                        child_sets[parent_index].add(node.index)
+                        dirty.add(parent_index)
+                        budgets[parent_row] += new_tokens[row]
+                        assigned = True
+                        break
+                if assigned:
+                    report.assigned_to_existing += 1
+                else:
+                    unassigned.append(node)
+
+        if len(unassigned) > builder.reduction_dimension + 1:
+            groups = builder.clustering_algorithm.perform_clustering(
+                unassigned,
+                model,
+                reduction_dimension=builder.reduction_dimension,
+                **builder.clustering_params,
+            )
+        else:
+            groups = pack_by_budget(
+                unassigned, get_token_counts(unassigned, builder.tokenizer), max_length
+            )
+
+        dirty_indices = sorted(dirty)
+        # Children in index order reproduce the context order of the original build
+        contexts = [
+            get_text([all_nodes[child] for child in sorted(child_sets[index])])
+            for index in dirty_indices
+        ] + [get_text(sorted(group, key=lambda node: node.index)) for group in groups]
+
+        summaries, embeddings, _ = builder.make_pipeline(use_multithreading).run(
+            lambda context: builder.summarize(
+                context=context, max_tokens=builder.summarization_length
+            ),
+            builder.embed_texts,
+            contexts,
+        )
+        report.llm_calls += len(contexts)
+
+        updated = {}
+        for offset, index in enumerate(dirty_indices):
+            updated[index] = Node(
+                summaries[offset],
+                index,
+                child_sets[index],
+                embeddings[offset],
+                len(builder.tokenizer.encode(summaries[offset])),
+            )
+        new_parent_indices = []
+        for offset, group in enumerate(groups, start=len(dirty_indices)):
+            updated[next_index] = Node(
+                summaries[offset],
+                next_index,
+                {node.index for node in group},
+                embeddings[offset],
+                len(builder.tokenizer.encode(summaries[offset])),
+            )
+            new_parent_indices.append(next_index)
+            next_index += 1
+
+        all_nodes.update(updated)
+        layer_to_nodes[layer + 1] = [all_nodes[parent.index] for parent in parents] + [
+            all_nodes[index] for index in new_parent_indices
+        ]
+        report.resummarized_parents += len(dirty_indices)
+        report.new_parents += len(new_parent_indices)
+
+        logging.info(
+            f"Incremental layer {layer + 1}: {len(dirty_indices)} parents re-summarized, "
+            f"{len(new_parent_indices)} new parents"
+        )
+        new_indices = new_parent_indices
+        changed_indices = set(dirty_indices)
+
+    report.full_rebuild_llm_calls = sum(
+        len(nodes) for layer, nodes in layer_to_nodes.items() if layer > 0
+    )
+
+    root_indices = [node.index for node in layer_to_nodes[top_layer]]
+    leaf_indices = [node.index for node in layer_to_nodes[0]]
+    root_nodes = (
+        {index: all_nodes[index] for index in root_indices}
+        if isinstance(tree.root_nodes, dict)
+        else set(root_indices)
+    )
+    leaf_nodes = (
+        {index: all_nodes[index] for index in leaf_indices}
+        if isinstance(tree.leaf_nodes, dict)
+        else set(leaf_indices)
+    )
+    updated_tree = Tree(all_nodes, root_nodes, leaf_nodes, tree.num_layers, layer_to_nodes)
+
+    # Keep attributes callers attached to the old tree (e.g. timestamp maps), but not its
+    # vector indexes, which cover the old node set
+    for name, value in tree.__dict__.items():
+        if name not in updated_tree.__dict__ and name != "_vector_indexes":
+            setattr(updated_tree, name, value)
+
+    logging.info(f"Incremental update: {report.as_dict()}")
+    return updated_tree, report
@@ -0,0 +1,290 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from queue import Empty, Queue
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: tokens refill at rate per second up to capacity, and
+    acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if capacity is not None and capacity < 1:
+            raise ValueError("capacity must be at least 1 or None")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class ClusterSummarizationError(RuntimeError):
+    """Raised by SummarizationScheduler when the task for one item fails."""
+
+    def __init__(self, index: int, error: BaseException) -> None:
+        super().__init__(f"Summarization of cluster {index} failed: {error!r}")
+        self.index = index
+        self.error = error
+
+
+class SummarizationScheduler:
+    """
+    Runs summarization calls with at most max_concurrency in flight and, when rate_limit
+    is set, at most rate_limit call starts per second (bursts up to burst).
+
+    map() returns results in input order. The first failing item cancels the items that
+    have not started and is re-raised as ClusterSummarizationError. progress_callback,
+    if given, is called as progress_callback(completed, total) after every finished item.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        rate_limit: Optional[float] = None,
+        burst: Optional[float] = None,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ) -> None:
+        if not isinstance(max_concurrency, int) or max_concurrency < 1:
+            raise ValueError("max_concurrency must be an integer and at least 1")
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate_limit, burst) if rate_limit is not None else None
+        self.progress_callback = progress_callback
+
+    def _call(self, fn: Callable[[Any], Any], item: Any) -> Any:
+        if self.bucket is not None:
+            self.bucket.acquire()
+        return fn(item)
+
+    def map(
+        self,
+        fn: Callable[[Any], Any],
+        items: Sequence[Any],
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        on_result: Optional[Callable[[int, Any], None]] = None,
+    ) -> List[Any]:
+        """
+        Applies fn to every item. on_result(index, result), if given, is called as soon
+        as each item finishes, in completion order.
+        """
+        progress_callback = progress_callback or self.progress_callback
+        total = len(items)
+        results: List[Any] = [None] * total
+        if not total:
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, total)) as executor:
+            futures = {
+                executor.submit(self._call, fn, item): index
+                for index, item in enumerate(items)
+            }
+            pending = set(futures)
+            completed = 0
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures[future]
+                    error = future.exception()
+                    if error is not None:
+                        for other in pending:
+                            other.cancel()
+                        raise ClusterSummarizationError(index, error) from error
+                    results[index] = future.result()
+                    if on_result is not None:
+                        on_result(index, results[index])
+                    completed += 1
+                    if progress_callback is not None:
+                        progress_callback(completed, total)
+
+        return results
+
+
+# Queue sentinel telling an embedding worker to finish
+_STOP = object()
+
+
+class PipelineStats:
+    """Per-stage timings of one SummarizeEmbedPipeline run, in seconds."""
+
+    def __init__(self) -> None:
+        self.summarize_calls = 0
+        self.summarize_seconds = 0.0
+        self.embed_batches = 0
+        self.embed_items = 0
+        self.embed_seconds = 0.0
+        self.summaries_done_at = 0.0
+        self.wall_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_summary(self, seconds: float) -> None:
+        with self._lock:
+            self.summarize_calls += 1
+            self.summarize_seconds += seconds
+
+    def add_embed_batch(self, size: int, seconds: float) -> None:
+        with self._lock:
+            self.embed_batches += 1
+            self.embed_items += size
+            self.embed_seconds += seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "summarize_calls": self.summarize_calls,
+            "summarize_seconds": round(self.summarize_seconds, 3),
+            "embed_batches": self.embed_batches,
+            "mean_embed_batch": round(self.embed_items / self.embed_batches, 1) if self.embed_batches else 0.0,
+            "embed_seconds": round(self.embed_seconds, 3),
+            "summarize_stage_wall": round(self.summaries_done_at, 3),
+            # Time spent after the last summary finished, waiting for the embedding tail
+            "embed_tail_wall": round(self.wall_seconds - self.summaries_done_at, 3),
+            "wall_seconds": round(self.wall_seconds, 3),
+        }
+
+
+class SummarizeEmbedPipeline:
+    """
+    Two-stage pipeline: items are summarized through a SummarizationScheduler, and every
+    finished summary is queued straight to embed_concurrency embedding workers, which
+    micro-batch the queue (up to embed_batch_size texts, waiting at most embed_max_wait
+    seconds to fill a batch). Embedding therefore overlaps summarization, and the slowest
+    summary is the only barrier at the end of a run.
+    """
+
+    def __init__(
+        self,
+        scheduler: SummarizationScheduler,
+        embed_batch_size: int = 32,
+        embed_max_wait: float = 0.05,
+        embed_concurrency: int = 1,
+    ) -> None:
+        if not isinstance(embed_batch_size, int) or embed_batch_size < 1:
+            raise ValueError("embed_batch_size must be an integer and at least 1")
+        if embed_max_wait < 0:
+            raise ValueError("embed_max_wait must not be negative")
+        if not isinstance(embed_concurrency, int) or embed_concurrency < 1:
+            raise ValueError("embed_concurrency must be an integer and at least 1")
+        self.scheduler = scheduler
+        self.embed_batch_size = embed_batch_size
+        self.embed_max_wait = embed_max_wait
+        self.embed_concurrency = embed_concurrency
+
+    def _next_batch(self, queue: Queue):
+        """Blocks for one item, then gathers more until the batch is full or the wait expires."""
+        first = queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.embed_max_wait
+        while len(batch) < self.embed_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = queue.get(timeout=remaining)
+            except Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _embed_worker(self, queue, embed_fn, embeddings, errors, stats, on_item) -> None:
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch(queue)
+            if not batch or errors:
+                continue
+            start = time.perf_counter()
+            try:
+                vectors = embed_fn([summary for _, summary in batch])
+            except Exception as e:
+                errors.append(e)
+                continue
+            stats.add_embed_batch(len(batch), time.perf_counter() - start)
+            for (index, summary), vector in zip(batch, vectors):
+                embeddings[index] = vector
+                if on_item is not None:
+                    try:
+                        on_item(index, summary, vector)
+                    except Exception as e:
+                        errors.append(e)
+
+    def run(
+        self,
+        summarize_fn: Callable[[Any], str],
+        embed_fn: Callable[[List[str]], List[Any]],
+        items: Sequence[Any],
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        on_item: Optional[Callable[[int, str, Any], None]] = None,
+    ):
+        """
+        Summarizes every item with summarize_fn and embeds the summaries with embed_fn
+        (a list of texts in, one embedding result per text out). on_item(index, summary,
+        embedding), if given, is called from an embedding worker as each item completes.
+
+        Returns:
+            Tuple[List[str], List[Any], PipelineStats]: Summaries and embedding results in
+                item order, and the stage timings.
+        """
+        stats = PipelineStats()
+        started = time.perf_counter()
+        queue: Queue = Queue()
+        embeddings: List[Any] = [None] * len(items)
+        errors: List[BaseException] = []
+
+        def timed_summarize(item):
+            start = time.perf_counter()
+            summary = summarize_fn(item)
+            stats.add_summary(time.perf_counter() - start)
+            return summary
+
+        workers = [
+            threading.Thread(
+                target=self._embed_worker,
+                args=(queue, embed_fn, embeddings, errors, stats, on_item),
+                daemon=True,
+            )
+            for _ in range(self.embed_concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            summaries = self.scheduler.map(
+                timed_summarize,
+                items,
+                progress_callback=progress_callback,
+                on_result=lambda index, summary: queue.put((index, summary)),
+            )
+            stats.summaries_done_at = time.perf_counter() - started
+        finally:
+            for _ in workers:
+                queue.put(_STOP)
+            for worker in workers:
+                worker.join()
+
+        if errors:
+            raise errors[0]
+        stats.wall_seconds = time.perf_counter() - started
+        return summaries, embeddings, stats
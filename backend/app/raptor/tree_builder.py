@@ -10,9 +10,13 @@ import openai
 import tiktoken
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
-from .EmbeddingModels import BaseEmbeddingModel, OpenAIEmbeddingModel
+from .cache import (DEFAULT_CACHE_DIR, SQLiteCache, cache_enabled,
+                    content_key, get_shared_cache)
+from .EmbeddingModels import (BaseEmbeddingModel, CachedEmbeddingModel,
+                              OpenAIEmbeddingModel)
 from .SummarizationModels import (BaseSummarizationModel,
-                                  GPT3TurboSummarizationModel)
+                                  GPT3TurboSummarizationModel,
+                                  InvalidSummaryError)
 from .tree_structures import Node, Tree
 from .utils import (distances_from_embeddings, get_children, get_embeddings,
                     get_node_list, get_text,
@@ -20,6 +24,12 @@ from .utils import (distances_from_embeddings, get_children, get_embeddings,
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
+# Seconds a cached summary stays valid (30 days)
+SUMMARY_CACHE_TTL = 30 * 24 * 3600
+
+# Number of chunks each worker of multithreaded_create_leaf_nodes embeds per batched call
+LEAF_BATCH_SIZE = 128
+
 
 class TreeBuilderConfig:
     def __init__(
@@ -34,6 +44,8 @@ class TreeBuilderConfig:
         summarization_model=None,
         embedding_models=None,
         cluster_embedding_model=None,
+        embedding_cache=None,
+        summary_cache=None,
     ):
         if tokenizer is None:
             tokenizer = tiktoken.get_encoding("cl100k_base")
@@ -92,8 +104,35 @@ class TreeBuilderConfig:
                 raise ValueError(
                     "All embedding models must be an instance of BaseEmbeddingModel"
                 )
+        # None uses the shared on-disk cache (unless RAPTOR_EMBEDDING_CACHE=0), False disables caching
+        if embedding_cache is None and cache_enabled("RAPTOR_EMBEDDING_CACHE"):
+            embedding_cache = get_shared_cache(
+                os.path.join(DEFAULT_CACHE_DIR, "embeddings.sqlite")
+            )
+        if embedding_cache is not None and embedding_cache is not False:
+            if not isinstance(embedding_cache, SQLiteCache):
+                raise ValueError("embedding_cache must be a SQLiteCache, None or False")
+            embedding_models = {
+                model_name: model
+                if isinstance(model, CachedEmbeddingModel)
+                else CachedEmbeddingModel(model, embedding_cache)
+                for model_name, model in embedding_models.items()
+            }
+        self.embedding_cache = embedding_cache if embedding_cache is not False else None
         self.embedding_models = embedding_models
 
+        # Same convention as embedding_cache; summaries expire after SUMMARY_CACHE_TTL
+        if summary_cache is None and cache_enabled("RAPTOR_SUMMARY_CACHE"):
+            summary_cache = get_shared_cache(
+                os.path.join(DEFAULT_CACHE_DIR, "summaries.sqlite"),
+                max_entries=200_000,
+                ttl=SUMMARY_CACHE_TTL,
+            )
+        if summary_cache is not None and summary_cache is not False:
+            if not isinstance(summary_cache, SQLiteCache):
+                raise ValueError("summary_cache must be a SQLiteCache, None or False")
+        self.summary_cache = summary_cache if summary_cache is not False else None
+
         if cluster_embedding_model is None:
             cluster_embedding_model = "OpenAI"
         if cluster_embedding_model not in self.embedding_models:
@@ -115,6 +154,8 @@ class TreeBuilderConfig:
             Summarization Model: {summarization_model}
             Embedding Models: {embedding_models}
             Cluster Embedding Model: {cluster_embedding_model}
+            Embedding Cache: {embedding_cache}
+            Summary Cache: {summary_cache}
         """.format(
             tokenizer=self.tokenizer,
             max_tokens=self.max_tokens,
@@ -126,6 +167,8 @@ class TreeBuilderConfig:
             summarization_model=self.summarization_model,
             embedding_models=self.embedding_models,
             cluster_embedding_model=self.cluster_embedding_model,
+            embedding_cache=self.embedding_cache.path if self.embedding_cache is not None else None,
+            summary_cache=self.summary_cache.path if self.summary_cache is not None else None,
         )
         return config_log
 
@@ -150,6 +193,8 @@ class TreeBuilder:
         self.summarization_model = config.summarization_model
         self.embedding_models = config.embedding_models
         self.cluster_embedding_model = config.cluster_embedding_model
+        self.embedding_cache = config.embedding_cache
+        self.summary_cache = config.summary_cache
 
         logging.info(
             f"Successfully initialized TreeBuilder with Config {config.log_config()}"
@@ -176,7 +221,61 @@ class TreeBuilder:
             model_name: model.create_embedding(text)
             for model_name, model in self.embedding_models.items()
         }
-        return (index, Node(text, index, children_indices, embeddings))
+        token_count = len(self.tokenizer.encode(text))
+        return (index, Node(text, index, children_indices, embeddings, token_count))
+
+    def embed_texts(self, texts: List[str]) -> List[Dict[str, List[float]]]:
+        """Embeds texts with one batched call per embedding model.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[Dict[str, List[float]]]: For each text, its embedding under every model name.
+        """
+        vectors = {
+            model_name: model.create_embeddings(texts)
+            for model_name, model in self.embedding_models.items()
+        }
+        return [
+            {model_name: model_vectors[offset] for model_name, model_vectors in vectors.items()}
+            for offset in range(len(texts))
+        ]
+
+    def create_nodes(
+        self,
+        texts: List[str],
+        start_index: int = 0,
+        children_indices: Optional[List[Set[int]]] = None,
+        embeddings: Optional[List[Dict[str, List[float]]]] = None,
+    ) -> Dict[int, Node]:
+        """Creates one node per text, embedding all texts with one batched call per model.
+
+        Args:
+            texts (List[str]): The texts of the new nodes.
+            start_index (int): The index of the first new node; the others follow consecutively.
+            children_indices (Optional[List[Set[int]]]): The children of each new node.
+                If not provided, every node gets an empty set.
+            embeddings (Optional[List[Dict[str, List[float]]]]): Precomputed embeddings per
+                text, as returned by embed_texts. Computed here if not provided.
+
+        Returns:
+            Dict[int, Node]: A dictionary mapping node indices to the new nodes, in text order.
+        """
+        if children_indices is None:
+            children_indices = [set() for _ in texts]
+        if embeddings is None:
+            embeddings = self.embed_texts(texts)
+
+        nodes = {}
+        for offset, (text, children, node_embeddings) in enumerate(
+            zip(texts, children_indices, embeddings)
+        ):
+            index = start_index + offset
+            nodes[index] = Node(
+                text, index, children, node_embeddings, len(self.tokenizer.encode(text))
+            )
+        return nodes
 
     def create_embedding(self, text) -> List[float]:
         """
@@ -202,8 +301,34 @@ class TreeBuilder:
 
         Returns:
             str: The generated summary.
+
+        Raises:
+            InvalidSummaryError: If the model reports a failure (is_valid_summary is False)
+                instead of a summary, so that the failure never becomes a node's text. Under
+                SummarizationScheduler it aborts the layer as a ClusterSummarizationError.
         """
-        return self.summarization_model.summarize(context, max_tokens)
+        if self.summary_cache is None:
+            return self._checked_summary(self.summarization_model.summarize(context, max_tokens))
+
+        # Identical clusters (same ordered child texts) reuse the summary of an earlier build
+        key = content_key(
+            self.summarization_model.identifier,
+            self.summarization_model.prompt_template,
+            str(max_tokens),
+            context,
+        )
+        cached = self.summary_cache.get(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+
+        summary = self._checked_summary(self.summarization_model.summarize(context, max_tokens))
+        self.summary_cache.put(key, summary.encode("utf-8"))
+        return summary
+
+    def _checked_summary(self, summary) -> str:
+        if not self.summarization_model.is_valid_summary(summary):
+            raise InvalidSummaryError(f"Summarization model returned a failure: {summary!r}")
+        return summary
 
     def get_relevant_nodes(self, current_node, list_nodes) -> List[Node]:
         """
@@ -221,15 +346,16 @@ class TreeBuilder:
         distances = distances_from_embeddings(
             current_node.embeddings[self.cluster_embedding_model], embeddings
         )
-        indices = indices_of_nearest_neighbors_from_distances(distances)
-
         if self.selection_mode == "threshold":
+            indices = indices_of_nearest_neighbors_from_distances(distances)
             best_indices = [
                 index for index in indices if distances[index] > self.threshold
             ]
 
         elif self.selection_mode == "top_k":
-            best_indices = indices[: self.top_k]
+            best_indices = indices_of_nearest_neighbors_from_distances(
+                distances, self.top_k
+            )
 
         nodes_to_add = [list_nodes[idx] for idx in best_indices]
 
@@ -244,16 +370,16 @@ class TreeBuilder:
         Returns:
             Dict[int, Node]: A dictionary mapping node indices to the corresponding leaf nodes.
         """
+        # Each worker embeds a slice of chunks with batched model calls
         with ThreadPoolExecutor() as executor:
-            future_nodes = {
-                executor.submit(self.create_node, index, text): (index, text)
-                for index, text in enumerate(chunks)
-            }
+            futures = [
+                executor.submit(self.create_nodes, chunks[start:start + LEAF_BATCH_SIZE], start)
+                for start in range(0, len(chunks), LEAF_BATCH_SIZE)
+            ]
 
             leaf_nodes = {}
-            for future in as_completed(future_nodes):
-                index, node = future.result()
-                leaf_nodes[index] = node
+            for future in futures:
+                leaf_nodes.update(future.result())
 
         return leaf_nodes
 
@@ -262,8 +388,8 @@ class TreeBuilder:
 
         Args:
             text (str): The input text.
-            use_multithreading (bool, optional): Whether to use multithreading when creating leaf nodes.
-                Default: True.
+            use_multithreading (bool, optional): Whether to use multithreading when creating leaf nodes
+                and summarizing clusters. Default: True.
 
         Returns:
             Tree: The golden tree structure.
@@ -275,10 +401,7 @@ class TreeBuilder:
         if use_multithreading:
             leaf_nodes = self.multithreaded_create_leaf_nodes(chunks)
         else:
-            leaf_nodes = {}
-            for index, text in enumerate(chunks):
-                __, node = self.create_node(index, text)
-                leaf_nodes[index] = node
+            leaf_nodes = self.create_nodes(chunks)
 
         layer_to_nodes = {0: list(leaf_nodes.values())}
 
@@ -288,10 +411,17 @@ class TreeBuilder:
 
         all_nodes = copy.deepcopy(leaf_nodes)
 
-        root_nodes = self.construct_tree(all_nodes, all_nodes, layer_to_nodes)
+        root_nodes = self.construct_tree(
+            all_nodes, all_nodes, layer_to_nodes, use_multithreading=use_multithreading
+        )
 
         tree = Tree(all_nodes, root_nodes, leaf_nodes, self.num_layers, layer_to_nodes)
 
+        if self.embedding_cache is not None:
+            logging.info(f"Embedding cache: {self.embedding_cache.stats()}")
+        if self.summary_cache is not None:
+            logging.info(f"Summary cache: {self.summary_cache.stats()}")
+
         return tree
 
     @abstractclassmethod
@@ -1,17 +1,19 @@
 import logging
 import os
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set
 
+import numpy as np
 import tiktoken
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
+from .cache import QueryEmbeddingCache, cache_enabled, get_query_embedding_cache
 from .EmbeddingModels import BaseEmbeddingModel, OpenAIEmbeddingModel
 from .Retrievers import BaseRetriever
 from .tree_structures import Node, Tree
-from .utils import (distances_from_embeddings, get_children, get_embeddings,
-                    get_node_list, get_text,
+from .vector_index import VECTOR_INDEXES
+from .utils import (get_children, get_text,
                     indices_of_nearest_neighbors_from_distances,
-                    reverse_mapping)
+                    normalize_embeddings, reverse_mapping)
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
@@ -27,6 +29,8 @@ class TreeRetrieverConfig:
         embedding_model=None,
         num_layers=None,
         start_layer=None,
+        index_type=None,
+        query_embedding_cache=None,
     ):
         if tokenizer is None:
             tokenizer = tiktoken.get_encoding("cl100k_base")
@@ -79,6 +83,26 @@ class TreeRetrieverConfig:
                 raise ValueError("start_layer must be an integer and at least 0")
         self.start_layer = start_layer
 
+        if index_type is None:
+            index_type = "auto"
+        if isinstance(index_type, str) and index_type not in VECTOR_INDEXES:
+            raise ValueError(
+                f"index_type must be one of {list(VECTOR_INDEXES.keys())}, a VectorIndex subclass or an instance of one"
+            )
+        self.index_type = index_type
+
+        # None uses the process-wide cache (unless RAPTOR_QUERY_CACHE=0), False disables caching
+        if query_embedding_cache is None and cache_enabled("RAPTOR_QUERY_CACHE"):
+            query_embedding_cache = get_query_embedding_cache()
+        if query_embedding_cache is not None and query_embedding_cache is not False:
+            if not isinstance(query_embedding_cache, QueryEmbeddingCache):
+                raise ValueError(
+                    "query_embedding_cache must be a QueryEmbeddingCache, None or False"
+                )
+        self.query_embedding_cache = (
+            query_embedding_cache if query_embedding_cache is not False else None
+        )
+
     def log_config(self):
         config_log = """
         TreeRetrieverConfig:
@@ -90,6 +114,7 @@ class TreeRetrieverConfig:
             Embedding Model: {embedding_model}
             Num Layers: {num_layers}
             Start Layer: {start_layer}
+            Index Type: {index_type}
         """.format(
             tokenizer=self.tokenizer,
             threshold=self.threshold,
@@ -99,6 +124,7 @@ class TreeRetrieverConfig:
             embedding_model=self.embedding_model,
             num_layers=self.num_layers,
             start_layer=self.start_layer,
+            index_type=self.index_type,
         )
         return config_log
 
@@ -136,6 +162,8 @@ class TreeRetriever(BaseRetriever):
         self.selection_mode = config.selection_mode
         self.embedding_model = config.embedding_model
         self.context_embedding_model = config.context_embedding_model
+        self.index_type = config.index_type
+        self.query_embedding_cache = config.query_embedding_cache
 
         self.tree_node_index_to_layer = reverse_mapping(self.tree.layer_to_nodes)
 
@@ -145,7 +173,8 @@ class TreeRetriever(BaseRetriever):
 
     def create_embedding(self, text: str) -> List[float]:
         """
-        Generates embeddings for the given text using the specified embedding model.
+        Generates embeddings for the given text using the specified embedding model,
+        served from the query embedding cache when the same query was seen before.
 
         Args:
             text (str): The text for which to generate embeddings.
@@ -153,7 +182,62 @@ class TreeRetriever(BaseRetriever):
         Returns:
             List[float]: The generated embeddings.
         """
-        return self.embedding_model.create_embedding(text)
+        if self.query_embedding_cache is None:
+            return self.embedding_model.create_embedding(text)
+        return self.query_embedding_cache.get_or_compute(
+            self.embedding_model.identifier, text, self.embedding_model.create_embedding
+        )
+
+    def create_embeddings(self, texts: List[str]) -> List:
+        """
+        Embeds several queries with one batched call to the embedding model (only the
+        queries missing from the query embedding cache are sent).
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List: One embedding per text, in order.
+        """
+        if self.query_embedding_cache is None:
+            return self.embedding_model.create_embeddings(texts)
+        return self.query_embedding_cache.get_or_compute_many(
+            self.embedding_model.identifier, texts, self.embedding_model.create_embeddings
+        )
+
+    def _select_collapsed(
+        self, query_embeddings: np.ndarray, top_k: int, max_tokens: int
+    ) -> List[List[Node]]:
+        """
+        Selects the nearest nodes of the whole tree for every row of a normalized query
+        matrix, best first, stopping each query's selection at max_tokens.
+        """
+        node_list = self.tree.node_list
+
+        # Built once per tree and model, then shared by every query; one search call
+        # (a single matrix multiply for the flat index) covers all the queries
+        index = self.tree.vector_index(self.context_embedding_model, self.index_type)
+        _, rows = index.search(query_embeddings, top_k)
+
+        token_counts = self.tree.ensure_token_counts(self.tokenizer)
+
+        selections = []
+        for query_rows in rows:
+            selected_nodes = []
+            total_tokens = 0
+            for idx in query_rows[query_rows >= 0]:
+
+                node = node_list[idx]
+                node_tokens = int(token_counts[idx])
+
+                if total_tokens + node_tokens > max_tokens:
+                    break
+
+                selected_nodes.append(node)
+                total_tokens += node_tokens
+
+            selections.append(selected_nodes)
+        return selections
 
     def retrieve_information_collapse_tree(self, query: str, top_k: int, max_tokens: int) -> str:
         """
@@ -167,32 +251,58 @@ class TreeRetriever(BaseRetriever):
             str: The context created using the most relevant nodes.
         """
 
-        query_embedding = self.create_embedding(query)
+        query_embedding = normalize_embeddings(self.create_embedding(query))
 
-        selected_nodes = []
+        selected_nodes = self._select_collapsed(query_embedding, top_k, max_tokens)[0]
 
-        node_list = get_node_list(self.tree.all_nodes)
+        context = get_text(selected_nodes)
+        return selected_nodes, context
 
-        embeddings = get_embeddings(node_list, self.context_embedding_model)
+    def _traverse(
+        self,
+        query_embedding: np.ndarray,
+        rows: np.ndarray,
+        num_layers: int,
+        first_distances: Optional[np.ndarray] = None,
+    ) -> List[Node]:
+        """
+        Beam search over row numbers: every layer is a gather from the normalized
+        embedding matrix, one matrix-vector product and a top-k partition, and the next
+        beam comes from the CSR child adjacency. first_distances, if given, are the
+        already computed distances of the query to the starting rows.
+        """
+        embeddings = self.tree.get_embedding_matrix(
+            self.context_embedding_model, normalized=True
+        )
+        selected_rows = []
 
-        distances = distances_from_embeddings(query_embedding, embeddings)
+        for layer in range(num_layers):
+            if not len(rows):
+                break
 
-        indices = indices_of_nearest_neighbors_from_distances(distances)
+            if layer == 0 and first_distances is not None:
+                distances = first_distances
+            else:
+                distances = 1.0 - embeddings[rows] @ query_embedding
 
-        total_tokens = 0
-        for idx in indices[:top_k]:
+            if self.selection_mode == "threshold":
+                indices = indices_of_nearest_neighbors_from_distances(distances)
+                best_indices = indices[distances[indices] > self.threshold]
 
-            node = node_list[idx]
-            node_tokens = len(self.tokenizer.encode(node.text))
+            elif self.selection_mode == "top_k":
+                best_indices = indices_of_nearest_neighbors_from_distances(
+                    distances, self.top_k
+                )
 
-            if total_tokens + node_tokens > max_tokens:
-                break
+            best_rows = rows[best_indices]
+            selected_rows.append(best_rows)
 
-            selected_nodes.append(node)
-            total_tokens += node_tokens
+            if layer != num_layers - 1:
+                rows = self.tree.child_rows(best_rows)
 
-        context = get_text(selected_nodes)
-        return selected_nodes, context
+        return [
+            self.tree.node_list[row] for best_rows in selected_rows for row in best_rows
+        ]
 
     def retrieve_information(
         self, current_nodes: List[Node], query: str, num_layers: int
@@ -209,45 +319,49 @@ class TreeRetriever(BaseRetriever):
             str: The context created using the most relevant nodes.
         """
 
-        query_embedding = self.create_embedding(query)
-
-        selected_nodes = []
-
-        node_list = current_nodes
-
-        for layer in range(num_layers):
-
-            embeddings = get_embeddings(node_list, self.context_embedding_model)
-
-            distances = distances_from_embeddings(query_embedding, embeddings)
+        query_embedding = normalize_embeddings(self.create_embedding(query))[0]
 
-            indices = indices_of_nearest_neighbors_from_distances(distances)
+        rows = self.tree.embedding_store.rows(node.index for node in current_nodes)
+        selected_nodes = self._traverse(query_embedding, rows, num_layers)
 
-            if self.selection_mode == "threshold":
-                best_indices = [
-                    index for index in indices if distances[index] > self.threshold
-                ]
+        context = get_text(selected_nodes)
+        return selected_nodes, context
 
-            elif self.selection_mode == "top_k":
-                best_indices = indices[: self.top_k]
+    def _resolve_layers(self, start_layer, num_layers, max_tokens, collapse_tree):
+        """Validates the retrieval arguments and fills in the configured layer defaults."""
+        if not isinstance(max_tokens, int) or max_tokens < 1:
+            raise ValueError("max_tokens must be an integer and at least 1")
 
-            nodes_to_add = [node_list[idx] for idx in best_indices]
+        if not isinstance(collapse_tree, bool):
+            raise ValueError("collapse_tree must be a boolean")
 
-            selected_nodes.extend(nodes_to_add)
+        # Set defaults
+        start_layer = self.start_layer if start_layer is None else start_layer
+        num_layers = self.num_layers if num_layers is None else num_layers
 
-            if layer != num_layers - 1:
+        if not isinstance(start_layer, int) or not (
+            0 <= start_layer <= self.tree.num_layers
+        ):
+            raise ValueError(
+                "start_layer must be an integer between 0 and tree.num_layers"
+            )
 
-                child_nodes = []
+        if not isinstance(num_layers, int) or num_layers < 1:
+            raise ValueError("num_layers must be an integer and at least 1")
 
-                for index in best_indices:
-                    child_nodes.extend(node_list[index].children)
+        if num_layers > (start_layer + 1):
+            raise ValueError("num_layers must be less than or equal to start_layer + 1")
 
-                # take the unique values
-                child_nodes = list(dict.fromkeys(child_nodes))
-                node_list = [self.tree.all_nodes[i] for i in child_nodes]
+        return start_layer, num_layers
 
-        context = get_text(selected_nodes)
-        return selected_nodes, context
+    def _layer_information(self, selected_nodes: List[Node]) -> List[Dict]:
+        return [
+            {
+                "node_index": node.index,
+                "layer_number": self.tree_node_index_to_layer[node.index],
+            }
+            for node in selected_nodes
+        ]
 
     def retrieve(
         self,
@@ -276,28 +390,9 @@ class TreeRetriever(BaseRetriever):
         if not isinstance(query, str):
             raise ValueError("query must be a string")
 
-        if not isinstance(max_tokens, int) or max_tokens < 1:
-            raise ValueError("max_tokens must be an integer and at least 1")
-
-        if not isinstance(collapse_tree, bool):
-            raise ValueError("collapse_tree must be a boolean")
-
-        # Set defaults
-        start_layer = self.start_layer if start_layer is None else start_layer
-        num_layers = self.num_layers if num_layers is None else num_layers
-
-        if not isinstance(start_layer, int) or not (
-            0 <= start_layer <= self.tree.num_layers
-        ):
-            raise ValueError(
-                "start_layer must be an integer between 0 and tree.num_layers"
-            )
-
-        if not isinstance(num_layers, int) or num_layers < 1:
-            raise ValueError("num_layers must be an integer and at least 1")
-
-        if num_layers > (start_layer + 1):
-            raise ValueError("num_layers must be less than or equal to start_layer + 1")
+        start_layer, num_layers = self._resolve_layers(
+            start_layer, num_layers, max_tokens, collapse_tree
+        )
 
         if collapse_tree:
             logging.info(f"Using collapsed_tree")
@@ -311,17 +406,65 @@ class TreeRetriever(BaseRetriever):
             )
 
         if return_layer_information:
+            return context, self._layer_information(selected_nodes)
 
-            layer_information = []
+        return context
 
-            for node in selected_nodes:
-                layer_information.append(
-                    {
-                        "node_index": node.index,
-                        "layer_number": self.tree_node_index_to_layer[node.index],
-                    }
-                )
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        start_layer: int = None,
+        num_layers: int = None,
+        top_k: int = 10,
+        max_tokens: int = 3500,
+        collapse_tree: bool = True,
+        return_layer_information: bool = False,
+    ) -> List:
+        """
+        Queries the tree with many queries at once: the queries are embedded in one
+        batched call and scored against the tree with a single matrix multiply (the
+        collapsed-tree index search, or the start layer of the traversal). Token budgets
+        and the traversal below the start layer are applied per query.
 
-            return context, layer_information
+        Args:
+            queries (List[str]): The query texts.
+            Other arguments: As in retrieve, applied to every query.
 
-        return context
+        Returns:
+            List: One result per query, in order, each as retrieve would return it.
+        """
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise ValueError("queries must be a list of strings")
+
+        start_layer, num_layers = self._resolve_layers(
+            start_layer, num_layers, max_tokens, collapse_tree
+        )
+
+        if not queries:
+            return []
+
+        query_embeddings = normalize_embeddings(self.create_embeddings(queries))
+
+        if collapse_tree:
+            selections = self._select_collapsed(query_embeddings, top_k, max_tokens)
+        else:
+            rows = self.tree.embedding_store.rows(
+                node.index for node in self.tree.layer_to_nodes[start_layer]
+            )
+            embeddings = self.tree.get_embedding_matrix(
+                self.context_embedding_model, normalized=True
+            )
+            first_distances = 1.0 - query_embeddings @ embeddings[rows].T
+            selections = [
+                self._traverse(query_embedding, rows, num_layers, distances)
+                for query_embedding, distances in zip(query_embeddings, first_distances)
+            ]
+
+        results = []
+        for selected_nodes in selections:
+            context = get_text(selected_nodes)
+            if return_layer_information:
+                results.append((context, self._layer_information(selected_nodes)))
+            else:
+                results.append(context)
+        return results
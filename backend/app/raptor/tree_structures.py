@@ -1,4 +1,7 @@
-from typing import Dict, List, Set
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+import numpy as np
 
 
 class Node:
@@ -6,11 +9,228 @@ class Node:
     Represents a node in the hierarchical tree structure.
     """
 
-    def __init__(self, text: str, index: int, children: Set[int], embeddings) -> None:
+    __slots__ = ("text", "index", "children", "embeddings", "token_count")
+
+    def __init__(
+        self,
+        text: str,
+        index: int,
+        children: Set[int],
+        embeddings,
+        token_count: Optional[int] = None,
+    ) -> None:
         self.text = text
         self.index = index
         self.children = children
         self.embeddings = embeddings
+        # Number of tokenizer tokens in text, computed once when the node is created
+        self.token_count = token_count
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in Node.__slots__}
+
+    def __setstate__(self, state) -> None:
+        # Nodes pickled before __slots__ was introduced carry a plain __dict__ state
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **(state[1] or {})}
+        self.token_count = None
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+
+class NodeEmbeddings(Mapping):
+    """
+    Read-only {model_name: embedding} view onto a node's row in an EmbeddingStore.
+    Lookups return zero-copy float32 row views.
+    """
+
+    __slots__ = ("store", "row")
+
+    def __init__(self, store: "EmbeddingStore", row: int) -> None:
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, model_name: str) -> np.ndarray:
+        return self.store.matrices[model_name][self.row]
+
+    def __iter__(self):
+        return iter(self.store.matrices)
+
+    def __len__(self) -> int:
+        return len(self.store.matrices)
+
+
+class EmbeddingStore:
+    """
+    Holds one contiguous float32 matrix (and its L2-normalized copy) per embedding model.
+    Row i belongs to the i-th node in ascending node-index order.
+    """
+
+    def __init__(self, nodes: List[Node]) -> None:
+        self.node_indices = np.array([node.index for node in nodes], dtype=np.int64)
+
+        size = int(self.node_indices.max()) + 1 if len(nodes) else 0
+        self.index_to_row = np.full(size, -1, dtype=np.int64)
+        self.index_to_row[self.node_indices] = np.arange(len(nodes))
+
+        model_names = set(nodes[0].embeddings) if nodes else set()
+        for node in nodes[1:]:
+            model_names &= set(node.embeddings)
+
+        self.matrices: Dict[str, np.ndarray] = {}
+        for model_name in sorted(model_names):
+            matrix = np.ascontiguousarray(
+                np.stack(
+                    [np.asarray(node.embeddings[model_name], dtype=np.float32).reshape(-1) for node in nodes]
+                )
+            )
+            self.matrices[model_name] = matrix
+        self._normalize()
+
+    def _normalize(self) -> None:
+        self.normalized = {}
+        for model_name, matrix in self.matrices.items():
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self.normalized[model_name] = matrix / np.where(norms > 0, norms, 1.0)
+
+    def __getstate__(self):
+        # The normalized copies are derived data; recompute them on load instead of pickling them
+        state = self.__dict__.copy()
+        del state["normalized"]
+        return state
+
+    def __setstate__(self, state) -> None:
+        self.__dict__.update(state)
+        self._normalize()
+
+    def __len__(self) -> int:
+        return len(self.node_indices)
+
+    def rows(self, indices: Iterable[int]) -> np.ndarray:
+        """Maps node indices to row numbers."""
+        return self.index_to_row[np.fromiter(indices, dtype=np.int64)]
+
+    def matrix(self, model_name: str, normalized: bool = False) -> np.ndarray:
+        return (self.normalized if normalized else self.matrices)[model_name]
+
+
+class TextStore:
+    """
+    Interned text storage: every distinct text is stored once in a single string
+    buffer and each row is addressed by a (start, end) span into it.
+    """
+
+    def __init__(self, texts: Iterable[str]) -> None:
+        seen: Dict[str, tuple] = {}
+        pieces = []
+        spans = []
+        position = 0
+        for text in texts:
+            span = seen.get(text)
+            if span is None:
+                span = (position, position + len(text))
+                seen[text] = span
+                pieces.append(text)
+                position += len(text)
+            spans.append(span)
+
+        self.buffer = "".join(pieces)
+        self.spans = np.array(spans, dtype=np.int64).reshape(-1, 2)
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def __getitem__(self, row: int) -> str:
+        start, end = self.spans[row]
+        return self.buffer[start:end]
+
+
+def build_children_csr(node_list: List[Node]):
+    """
+    Builds CSR-style child adjacency for nodes in row order: the children of
+    node_list[row] are children_indices[children_indptr[row]:children_indptr[row + 1]],
+    stored as sorted node indices.
+    """
+    counts = np.fromiter((len(node.children) for node in node_list), dtype=np.int64, count=len(node_list))
+    children_indptr = np.zeros(len(node_list) + 1, dtype=np.int64)
+    np.cumsum(counts, out=children_indptr[1:])
+    children_indices = np.fromiter(
+        (child for node in node_list for child in sorted(node.children)),
+        dtype=np.int64,
+        count=int(children_indptr[-1]),
+    )
+    return children_indptr, children_indices
+
+
+class CompactNodeStore:
+    """
+    Tree-level arrays backing CompactNode: interned texts, node indices, CSR children,
+    token counts and the tree's EmbeddingStore.
+    """
+
+    def __init__(self, tree: "Tree") -> None:
+        self.texts = TextStore(node.text for node in tree.node_list)
+        self.node_indices = tree.embedding_store.node_indices
+        self.children_indptr = tree.children_indptr
+        self.children_indices = tree.children_indices
+        self.token_counts = tree.token_counts
+        self.embedding_store = tree.embedding_store
+
+    def children_of(self, row: int) -> np.ndarray:
+        return self.children_indices[self.children_indptr[row]:self.children_indptr[row + 1]]
+
+
+class CompactNode:
+    """
+    A two-slot stand-in for Node that reads its text, index, children, embeddings and
+    token count from a CompactNodeStore. Exposes the same read-only attribute API as Node.
+    """
+
+    __slots__ = ("store", "row")
+
+    def __init__(self, store: CompactNodeStore, row: int) -> None:
+        self.store = store
+        self.row = row
+
+    @property
+    def text(self) -> str:
+        return self.store.texts[self.row]
+
+    @property
+    def index(self) -> int:
+        return int(self.store.node_indices[self.row])
+
+    @property
+    def children(self) -> frozenset:
+        return frozenset(self.store.children_of(self.row).tolist())
+
+    @property
+    def embeddings(self) -> NodeEmbeddings:
+        return NodeEmbeddings(self.store.embedding_store, self.row)
+
+    @property
+    def token_count(self) -> Optional[int]:
+        count = int(self.store.token_counts[self.row])
+        return count if count >= 0 else None
+
+
+def collect_token_counts(node_list: List[Node]) -> np.ndarray:
+    """Gathers node.token_count in row order, with -1 for nodes that have none."""
+    return np.fromiter(
+        (
+            -1 if getattr(node, "token_count", None) is None else node.token_count
+            for node in node_list
+        ),
+        dtype=np.int64,
+        count=len(node_list),
+    )
+
+
+def as_row_selector(rows: np.ndarray) -> Union[slice, np.ndarray]:
+    """Returns a slice when rows form a contiguous ascending run, so indexing yields a view."""
+    if len(rows) and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+        return slice(int(rows[0]), int(rows[0]) + len(rows))
+    return rows
 
 
 class Tree:
@@ -26,3 +246,162 @@ class Tree:
         self.leaf_nodes = leaf_nodes
         self.num_layers = num_layers
         self.layer_to_nodes = layer_to_nodes
+
+        self.index_embeddings()
+
+    def __getstate__(self):
+        # Vector indexes are rebuilt on demand (faiss indexes do not pickle)
+        state = self.__dict__.copy()
+        state.pop("_vector_indexes", None)
+        return state
+
+    def __setstate__(self, state) -> None:
+        self.__dict__.update(state)
+        # Trees pickled before the embedding store and CSR arrays existed keep per-node data
+        if "children_indptr" not in state:
+            self.index_embeddings()
+        elif "token_counts" not in state:
+            self.token_counts = collect_token_counts(self.node_list)
+            if self.node_store is not None:
+                self.node_store.token_counts = self.token_counts
+
+    def index_embeddings(self) -> None:
+        """
+        Moves every node's embeddings into the tree-owned EmbeddingStore and points
+        each node at its row. Also precomputes the CSR child adjacency and the row
+        selector of every layer.
+        """
+        self.node_list = [self.all_nodes[index] for index in sorted(self.all_nodes)]
+        self.embedding_store = EmbeddingStore(self.node_list)
+        self.children_indptr, self.children_indices = build_children_csr(self.node_list)
+        self.token_counts = collect_token_counts(self.node_list)
+        self.node_store = None
+
+        for row, node in enumerate(self.node_list):
+            node.embeddings = NodeEmbeddings(self.embedding_store, row)
+
+        self.layer_rows = {
+            layer: as_row_selector(
+                self.embedding_store.rows(node.index for node in nodes)
+            )
+            for layer, nodes in self.layer_to_nodes.items()
+        }
+
+    def get_embedding_matrix(
+        self,
+        embedding_model: str,
+        layer: Optional[int] = None,
+        normalized: bool = False,
+    ) -> np.ndarray:
+        """
+        Returns the embedding matrix of the whole tree, or of one layer, for a model.
+        Rows follow self.node_list, or self.layer_to_nodes[layer] when a layer is given.
+        Contiguous layers are returned as views without copying.
+        """
+        matrix = self.embedding_store.matrix(embedding_model, normalized)
+        if layer is None:
+            return matrix
+        return matrix[self.layer_rows[layer]]
+
+    def vector_index(self, embedding_model: str, index_type="auto"):
+        """
+        Returns a nearest-neighbour index over the normalized embeddings of every node for
+        a model, built on first use and reused by later queries. Search results are rows
+        of self.node_list. index_type is a name from VECTOR_INDEXES, a VectorIndex
+        subclass or an instance of one.
+        """
+        from .vector_index import get_vector_index
+
+        indexes = self.__dict__.setdefault("_vector_indexes", {})
+        key = (embedding_model, index_type)
+        index = indexes.get(key)
+        if index is None:
+            index = get_vector_index(index_type).build(
+                self.get_embedding_matrix(embedding_model, normalized=True)
+            )
+            indexes[key] = index
+        return index
+
+    def child_rows(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Returns the rows of the children of the given node rows, gathered from the CSR
+        adjacency without a Python loop. Each child appears once, in the order of its
+        first occurrence.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.children_indptr[rows]
+        lengths = self.children_indptr[rows + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return np.empty(0, dtype=np.int64)
+        # Position i of the output reads children_indices[starts[segment] + offset within segment]
+        segment_offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - segment_offsets, lengths) + np.arange(total)
+        children = self.children_indices[positions]
+        _, first = np.unique(children, return_index=True)
+        return self.embedding_store.index_to_row[children[np.sort(first)]]
+
+    def ensure_token_counts(self, tokenizer) -> np.ndarray:
+        """
+        Returns the token count of every node in node_list order, computing (once) the
+        counts missing from trees built before token counts were stored.
+        """
+        missing = np.flatnonzero(self.token_counts < 0)
+        for row in missing:
+            self.token_counts[row] = len(tokenizer.encode(self.node_list[row].text))
+        if len(missing) and not self.is_compact:
+            for row in missing:
+                self.node_list[row].token_count = int(self.token_counts[row])
+        return self.token_counts
+
+    def to_nodes(self) -> Dict[int, Node]:
+        """
+        Returns independent, mutable Node copies of every node (embeddings as float32
+        row copies), e.g. to edit a compact or already-indexed tree and build a new Tree.
+        """
+        models = list(self.embedding_store.matrices)
+        return {
+            node.index: Node(
+                node.text,
+                node.index,
+                set(node.children),
+                {model: self.embedding_store.matrices[model][row].copy() for model in models},
+                int(self.token_counts[row]) if self.token_counts[row] >= 0 else None,
+            )
+            for row, node in enumerate(self.node_list)
+        }
+
+    @property
+    def is_compact(self) -> bool:
+        return getattr(self, "node_store", None) is not None
+
+    def compact(self) -> "Tree":
+        """
+        Replaces every Node with a CompactNode backed by tree-level arrays (interned
+        text buffer, CSR children, embedding matrices). node.text, node.index,
+        node.children and node.embeddings keep working; nodes become read-only.
+
+        Returns:
+            Tree: self, for chaining.
+        """
+        if self.is_compact:
+            return self
+
+        self.node_store = CompactNodeStore(self)
+        compact_nodes = {
+            node.index: CompactNode(self.node_store, row)
+            for row, node in enumerate(self.node_list)
+        }
+
+        self.all_nodes = compact_nodes
+        self.node_list = [compact_nodes[index] for index in sorted(compact_nodes)]
+        self.layer_to_nodes = {
+            layer: [compact_nodes[node.index] for node in nodes]
+            for layer, nodes in self.layer_to_nodes.items()
+        }
+        if isinstance(self.root_nodes, dict):
+            self.root_nodes = {index: compact_nodes[index] for index in self.root_nodes}
+        if isinstance(self.leaf_nodes, dict):
+            self.leaf_nodes = {index: compact_nodes[index] for index in self.leaf_nodes}
+
+        return self
@@ -1,12 +1,12 @@
+import bisect
 import logging
 import re
-from typing import Dict, List, Set
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 import numpy as np
 import tiktoken
-from scipy import spatial
 
-from .tree_structures import Node
+from .tree_structures import Node, NodeEmbeddings, as_row_selector
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
@@ -19,121 +19,315 @@ def reverse_mapping(layer_to_nodes: Dict[int, List[Node]]) -> Dict[Node, int]:
     return node_to_layer
 
 
+# Sentence-ending punctuation (ASCII and CJK); chunks are preferably cut right after these
+SENTENCE_DELIMITERS = ".!?\n。！？"
+# Clause punctuation used to break up sentences that alone exceed max_tokens
+CLAUSE_DELIMITERS = ",;:，；：、"
+
+_SENTENCE_END = re.compile(f"[{re.escape(SENTENCE_DELIMITERS)}]+")
+_CLAUSE_END = re.compile(f"[{re.escape(CLAUSE_DELIMITERS)}]+")
+
+
+def _boundary_tokens(
+    text: str, pattern: re.Pattern, offsets: List[int], start: int, end: int
+) -> List[int]:
+    """Token positions in (start, end) at which a match of pattern ends."""
+    char_start = offsets[start] if start < len(offsets) else len(text)
+    char_end = offsets[end] if end < len(offsets) else len(text)
+    positions = []
+    for match in pattern.finditer(text, char_start, char_end):
+        position = bisect.bisect_left(offsets, match.end(), start, end)
+        if start < position < end and (not positions or positions[-1] != position):
+            positions.append(position)
+    return positions
+
+
+def _split_segment(
+    text: str,
+    offsets: List[int],
+    start: int,
+    end: int,
+    max_tokens: int,
+    is_char_boundary: Callable[[int], bool],
+) -> List[Tuple[int, int]]:
+    """
+    Splits the token range [start, end) into ranges of at most max_tokens, cutting at
+    clause punctuation where possible and at token boundaries otherwise (never inside
+    a multi-byte character).
+    """
+    if end - start <= max_tokens:
+        return [(start, end)]
+
+    pieces = []
+    cuts = _boundary_tokens(text, _CLAUSE_END, offsets, start, end) + [end]
+    piece_start = start
+    last_cut = start
+    for cut in cuts:
+        if cut - piece_start > max_tokens and last_cut > piece_start:
+            pieces.append((piece_start, last_cut))
+            piece_start = last_cut
+        while cut - piece_start > max_tokens:
+            hard_cut = piece_start + max_tokens
+            while hard_cut > piece_start + 1 and not is_char_boundary(hard_cut):
+                hard_cut -= 1
+            pieces.append((piece_start, hard_cut))
+            piece_start = hard_cut
+        last_cut = cut
+    if piece_start < end:
+        pieces.append((piece_start, end))
+    return pieces
+
+
+def _chunk_window(
+    text: str, tokenizer: tiktoken.Encoding, max_tokens: int, overlap: int, final: bool
+) -> Tuple[List[str], int]:
+    """
+    Chunks one window of text with a single tokenizer pass.
+
+    Returns:
+        Tuple[List[str], int]: The finished chunks and the character offset at which the
+            next window must resume. Unless final, the last (possibly incomplete) chunk is
+            held back and its text is left for the next window.
+    """
+    tokens = tokenizer.encode(text, disallowed_special=())
+    _, offsets = tokenizer.decode_with_offsets(tokens)
+
+    def char_at(token_position: int) -> int:
+        return offsets[token_position] if token_position < len(offsets) else len(text)
+
+    def is_char_boundary(token_position: int) -> bool:
+        # Tokens that start with a UTF-8 continuation byte continue the previous character
+        if token_position <= 0 or token_position >= len(tokens):
+            return True
+        return not 0x80 <= tokenizer.decode_single_token_bytes(tokens[token_position])[0] < 0xC0
+
+    # Sentence segments as token ranges; oversized sentences are cut further
+    segments = []
+    segment_start = 0
+    for cut in _boundary_tokens(text, _SENTENCE_END, offsets, 0, len(tokens)) + [len(tokens)]:
+        if cut > segment_start:
+            segments.extend(
+                _split_segment(text, offsets, segment_start, cut, max_tokens, is_char_boundary)
+            )
+        segment_start = cut
+
+    # Greedily pack consecutive segments into chunks of at most max_tokens
+    chunk_ranges = []
+    current = []
+    current_length = 0
+    for segment in segments:
+        length = segment[1] - segment[0]
+        if current and current_length + length > max_tokens:
+            chunk_ranges.append(current)
+            current = current[-overlap:] if overlap > 0 else []
+            while current and sum(e - s for s, e in current) + length > max_tokens:
+                current = current[1:]
+            current_length = sum(e - s for s, e in current)
+        current.append(segment)
+        current_length += length
+    if current:
+        chunk_ranges.append(current)
+
+    resume_at = len(text)
+    if not final and len(chunk_ranges) > 1:
+        resume_at = char_at(chunk_ranges.pop()[0][0])
+    elif not final:
+        return [], 0
+
+    chunks = []
+    for chunk in chunk_ranges:
+        chunk_text = text[char_at(chunk[0][0]):char_at(chunk[-1][1])].strip()
+        if chunk_text:
+            chunks.append(chunk_text)
+    return chunks, resume_at
+
+
+def iter_split_text(
+    text: Union[str, Iterable[str]],
+    tokenizer: tiktoken.Encoding,
+    max_tokens: int,
+    overlap: int = 0,
+    window_chars: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Streams chunks of at most max_tokens tokens, preferring cuts after sentence-ending
+    punctuation (ASCII and CJK), then clause punctuation, then plain token boundaries.
+
+    The input is processed in windows of window_chars characters. Every window is encoded
+    once and chunk boundaries are derived from tiktoken's token offsets, so total work is
+    linear in the input and memory is bounded by the window size.
+
+    Args:
+        text (Union[str, Iterable[str]]): The text, or an iterable of text pieces (e.g. transcript lines).
+        tokenizer (tiktoken.Encoding): The tokenizer to be used for splitting the text.
+        max_tokens (int): The maximum allowed tokens per chunk.
+        overlap (int, optional): The number of trailing segments repeated at the start of the next chunk. Defaults to 0.
+        window_chars (Optional[int]): Characters buffered before chunks are emitted. Defaults to 64 * max_tokens (at least 8192).
+
+    Yields:
+        str: The text chunks, in order.
+    """
+    if window_chars is None:
+        window_chars = max(64 * max_tokens, 8192)
+
+    if isinstance(text, str):
+        pieces = (text[i:i + window_chars] for i in range(0, len(text), window_chars))
+    else:
+        pieces = text
+
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) >= window_chars:
+            chunks, resume_at = _chunk_window(buffer, tokenizer, max_tokens, overlap, final=False)
+            yield from chunks
+            buffer = buffer[resume_at:]
+
+    if buffer.strip():
+        chunks, _ = _chunk_window(buffer, tokenizer, max_tokens, overlap, final=True)
+        yield from chunks
+
+
 def split_text(
-    text: str, tokenizer: tiktoken.get_encoding("cl100k_base"), max_tokens: int, overlap: int = 0
-):
+    text: str, tokenizer: tiktoken.Encoding, max_tokens: int, overlap: int = 0
+) -> List[str]:
     """
     Splits the input text into smaller chunks based on the tokenizer and maximum allowed tokens.
-    
+    See iter_split_text for the boundary rules.
+
     Args:
         text (str): The text to be split.
-        tokenizer (CustomTokenizer): The tokenizer to be used for splitting the text.
+        tokenizer (tiktoken.Encoding): The tokenizer to be used for splitting the text.
         max_tokens (int): The maximum allowed tokens.
-        overlap (int, optional): The number of overlapping tokens between chunks. Defaults to 0.
-    
+        overlap (int, optional): The number of trailing segments repeated at the start of the next chunk. Defaults to 0.
+
     Returns:
         List[str]: A list of text chunks.
     """
-    # Split the text into sentences using multiple delimiters
-    delimiters = [".", "!", "?", "\n"]
-    regex_pattern = "|".join(map(re.escape, delimiters))
-    sentences = re.split(regex_pattern, text)
-    
-    # Calculate the number of tokens for each sentence
-    n_tokens = [len(tokenizer.encode(" " + sentence)) for sentence in sentences]
-    
-    chunks = []
-    current_chunk = []
-    current_length = 0
-    
-    for sentence, token_count in zip(sentences, n_tokens):
-        # If the sentence is empty or consists only of whitespace, skip it
-        if not sentence.strip():
-            continue
-        
-        # If the sentence is too long, split it into smaller parts
-        if token_count > max_tokens:
-            sub_sentences = re.split(r"[,;:]", sentence)
-            
-            # there is no need to keep empty os only-spaced strings
-            # since spaces will be inserted in the beginning of the full string
-            # and in between the string in the sub_chuk list
-            filtered_sub_sentences = [sub.strip() for sub in sub_sentences if sub.strip() != ""]
-            sub_token_counts = [len(tokenizer.encode(" " + sub_sentence)) for sub_sentence in filtered_sub_sentences]
-            
-            sub_chunk = []
-            sub_length = 0
-            
-            for sub_sentence, sub_token_count in zip(filtered_sub_sentences, sub_token_counts):
-                if sub_length + sub_token_count > max_tokens:
-                    
-                    # if the phrase does not have sub_sentences, it would create an empty chunk
-                    # this big phrase would be added anyways in the next chunk append
-                    if sub_chunk:
-                        chunks.append(" ".join(sub_chunk))
-                        sub_chunk = sub_chunk[-overlap:] if overlap > 0 else []
-                        sub_length = sum(sub_token_counts[max(0, len(sub_chunk) - overlap):len(sub_chunk)])
-                
-                sub_chunk.append(sub_sentence)
-                sub_length += sub_token_count
-            
-            if sub_chunk:
-                chunks.append(" ".join(sub_chunk))
-        
-        # If adding the sentence to the current chunk exceeds the max tokens, start a new chunk
-        elif current_length + token_count > max_tokens:
-            chunks.append(" ".join(current_chunk))
-            current_chunk = current_chunk[-overlap:] if overlap > 0 else []
-            current_length = sum(n_tokens[max(0, len(current_chunk) - overlap):len(current_chunk)])
-            current_chunk.append(sentence)
-            current_length += token_count
-        
-        # Otherwise, add the sentence to the current chunk
-        else:
-            current_chunk.append(sentence)
-            current_length += token_count
-    
-    # Add the last chunk if it's not empty
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-    
-    return chunks
+    return list(iter_split_text(text, tokenizer, max_tokens, overlap))
+
+
+def embeddings_to_matrix(embeddings) -> np.ndarray:
+    """
+    Stacks a sequence of embeddings into a contiguous float32 matrix.
+
+    Args:
+        embeddings: A list of embeddings (lists or 1-D arrays) or an existing 2-D array.
+
+    Returns:
+        np.ndarray: A C-contiguous float32 matrix of shape (n, d). Arrays that already
+            have this layout are returned without copying.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1) if matrix.size else matrix.reshape(0, 0)
+    return np.ascontiguousarray(matrix)
+
+
+def normalize_embeddings(matrix: np.ndarray) -> np.ndarray:
+    """
+    Returns a copy of the matrix with every row scaled to unit L2 norm (zero rows are left as is).
+    """
+    matrix = embeddings_to_matrix(matrix)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def _cosine_distances(queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    query_norms = np.linalg.norm(queries, axis=1)
+    matrix_norms = np.linalg.norm(matrix, axis=1)
+    denominator = np.outer(query_norms, matrix_norms)
+    similarities = np.divide(
+        queries @ matrix.T,
+        denominator,
+        out=np.zeros(denominator.shape, dtype=np.float32),
+        where=denominator > 0,
+    )
+    return 1.0 - similarities
+
+
+def _euclidean_distances(queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    # ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2, evaluated with one matrix multiply
+    squared = (
+        np.einsum("ij,ij->i", queries, queries)[:, None]
+        - 2.0 * (queries @ matrix.T)
+        + np.einsum("ij,ij->i", matrix, matrix)[None, :]
+    )
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def _cityblock_distances(queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    return np.stack([np.abs(matrix - query).sum(axis=1) for query in queries])
+
+
+def _chebyshev_distances(queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    return np.stack([np.abs(matrix - query).max(axis=1) for query in queries])
+
+
+DISTANCE_METRICS = {
+    "cosine": _cosine_distances,
+    "L1": _cityblock_distances,
+    "L2": _euclidean_distances,
+    "Linf": _chebyshev_distances,
+}
+
+
+def batch_distances(
+    query_embeddings,
+    embeddings,
+    distance_metric: str = "cosine",
+    assume_normalized: bool = False,
+) -> np.ndarray:
+    """
+    Calculates the distances between every query embedding and every embedding in one pass.
+
+    Args:
+        query_embeddings: A (m, d) matrix or list of query embeddings.
+        embeddings: A (n, d) matrix or list of embeddings to compare against.
+        distance_metric (str, optional): One of 'cosine', 'L1', 'L2' or 'Linf'. Defaults to 'cosine'.
+        assume_normalized (bool, optional): For 'cosine', skip the row norms because both sides
+            are already L2-normalized (e.g. Tree.get_embedding_matrix(..., normalized=True)).
+
+    Returns:
+        np.ndarray: A float32 matrix of shape (m, n) holding the distances.
+    """
+    if distance_metric not in DISTANCE_METRICS:
+        raise ValueError(
+            f"Unsupported distance metric '{distance_metric}'. Supported metrics are: {list(DISTANCE_METRICS.keys())}"
+        )
+
+    queries = embeddings_to_matrix(query_embeddings)
+    matrix = embeddings_to_matrix(embeddings)
+
+    if matrix.shape[0] == 0:
+        return np.zeros((queries.shape[0], 0), dtype=np.float32)
+
+    if distance_metric == "cosine" and assume_normalized:
+        return (1.0 - queries @ matrix.T).astype(np.float32, copy=False)
+
+    return DISTANCE_METRICS[distance_metric](queries, matrix).astype(np.float32, copy=False)
 
 
 def distances_from_embeddings(
     query_embedding: List[float],
     embeddings: List[List[float]],
     distance_metric: str = "cosine",
-) -> List[float]:
+    assume_normalized: bool = False,
+) -> np.ndarray:
     """
     Calculates the distances between a query embedding and a list of embeddings.
 
     Args:
         query_embedding (List[float]): The query embedding.
-        embeddings (List[List[float]]): A list of embeddings to compare against the query embedding.
+        embeddings (List[List[float]]): A list or (n, d) matrix of embeddings to compare against the query embedding.
         distance_metric (str, optional): The distance metric to use for calculation. Defaults to 'cosine'.
+        assume_normalized (bool, optional): See batch_distances.
 
     Returns:
-        List[float]: The calculated distances between the query embedding and the list of embeddings.
+        np.ndarray: The calculated distances between the query embedding and the list of embeddings.
     """
-    distance_metrics = {
-        "cosine": spatial.distance.cosine,
-        "L1": spatial.distance.cityblock,
-        "L2": spatial.distance.euclidean,
-        "Linf": spatial.distance.chebyshev,
-    }
-
-    if distance_metric not in distance_metrics:
-        raise ValueError(
-            f"Unsupported distance metric '{distance_metric}'. Supported metrics are: {list(distance_metrics.keys())}"
-        )
-
-    distances = [
-        distance_metrics[distance_metric](query_embedding, embedding)
-        for embedding in embeddings
-    ]
-
-    return distances
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+    return batch_distances(query, embeddings, distance_metric, assume_normalized)[0]
 
 
 def get_node_list(node_dict: Dict[int, Node]) -> List[Node]:
@@ -151,18 +345,63 @@ def get_node_list(node_dict: Dict[int, Node]) -> List[Node]:
     return node_list
 
 
-def get_embeddings(node_list: List[Node], embedding_model: str) -> List:
+def get_embeddings(
+    node_list: List[Node], embedding_model: str, normalized: bool = False
+) -> np.ndarray:
     """
     Extracts the embeddings of nodes from a list of nodes.
 
+    Nodes that belong to the same Tree are gathered straight from its EmbeddingStore,
+    which is a zero-copy view when the nodes occupy a contiguous run of rows.
+
     Args:
         node_list (List[Node]): List of nodes.
         embedding_model (str): The name of the embedding model to be used.
+        normalized (bool): Whether to return L2-normalized embeddings.
 
     Returns:
-        List: List of node embeddings.
+        np.ndarray: A (len(node_list), d) float32 matrix of node embeddings.
+    """
+    store = None
+    if node_list and isinstance(node_list[0].embeddings, NodeEmbeddings):
+        store = node_list[0].embeddings.store
+        if not all(
+            isinstance(node.embeddings, NodeEmbeddings) and node.embeddings.store is store
+            for node in node_list
+        ):
+            store = None
+
+    if store is not None:
+        rows = np.fromiter((node.embeddings.row for node in node_list), dtype=np.int64)
+        return store.matrix(embedding_model, normalized)[as_row_selector(rows)]
+
+    matrix = embeddings_to_matrix([node.embeddings[embedding_model] for node in node_list])
+    if normalized:
+        matrix = normalize_embeddings(matrix)
+    return matrix
+
+
+def get_token_counts(node_list: List[Node], tokenizer) -> np.ndarray:
     """
-    return [node.embeddings[embedding_model] for node in node_list]
+    Returns the token count of each node, using the count stored on the node when it has
+    one and encoding (and memoizing on plain Nodes) only the nodes that do not.
+
+    Args:
+        node_list (List[Node]): List of nodes.
+        tokenizer: Tokenizer used for nodes without a stored count.
+
+    Returns:
+        np.ndarray: Token count per node, in node_list order.
+    """
+    counts = np.empty(len(node_list), dtype=np.int64)
+    for i, node in enumerate(node_list):
+        count = node.token_count
+        if count is None:
+            count = len(tokenizer.encode(node.text))
+            if isinstance(node, Node):
+                node.token_count = count
+        counts[i] = count
+    return counts
 
 
 def get_children(node_list: List[Node]) -> List[Set[int]]:
@@ -195,14 +434,27 @@ def get_text(node_list: List[Node]) -> str:
     return text
 
 
-def indices_of_nearest_neighbors_from_distances(distances: List[float]) -> np.ndarray:
+def indices_of_nearest_neighbors_from_distances(
+    distances: List[float], top_k: Optional[int] = None
+) -> np.ndarray:
     """
     Returns the indices of nearest neighbors sorted in ascending order of distance.
 
     Args:
         distances (List[float]): A list of distances between embeddings.
+        top_k (Optional[int]): If given, only the indices of the top_k nearest neighbors are
+            returned. They are selected with np.argpartition, so only those k entries are sorted.
 
     Returns:
         np.ndarray: An array of indices sorted by ascending distance.
     """
-    return np.argsort(distances)
+    distances = np.asarray(distances)
+
+    if top_k is None or top_k >= len(distances):
+        return np.argsort(distances, kind="stable")
+
+    if top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    candidates = np.argpartition(distances, top_k - 1)[:top_k]
+    return candidates[np.argsort(distances[candidates], kind="stable")]
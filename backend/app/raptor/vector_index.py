@@ -0,0 +1,304 @@
+import logging
+import math
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .utils import embeddings_to_matrix, indices_of_nearest_neighbors_from_distances
+
+try:
+    import faiss
+except ImportError:  # faiss is only needed for the approximate indexes
+    faiss = None
+
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+
+class VectorIndex(ABC):
+    """
+    Inner-product nearest-neighbour index over the rows of one L2-normalized embedding
+    matrix, i.e. cosine similarity search. build() is called once; search() returns, for
+    every query row, the similarities and matrix rows of the k best matches, best first,
+    padded with -1 rows when fewer than k are found.
+    """
+
+    @abstractmethod
+    def build(self, matrix: np.ndarray) -> "VectorIndex":
+        pass
+
+    @abstractmethod
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        pass
+
+
+def _require_faiss(index_name: str) -> None:
+    if faiss is None:
+        raise ImportError(f"The '{index_name}' vector index requires faiss (pip install faiss-cpu)")
+
+
+class FlatIndex(VectorIndex):
+    """Exact search: one matrix product against every row, then a top-k partition."""
+
+    def build(self, matrix: np.ndarray) -> "FlatIndex":
+        self.matrix = embeddings_to_matrix(matrix)
+        return self
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = embeddings_to_matrix(queries)
+        similarities = queries @ self.matrix.T
+        k = min(k, self.matrix.shape[0])
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, row_similarities in enumerate(similarities):
+            # Same ordering (and tie-breaking) as the brute-force scan over cosine distances
+            best = indices_of_nearest_neighbors_from_distances(1.0 - row_similarities, k)
+            scores[i, : len(best)] = row_similarities[best]
+            rows[i, : len(best)] = best
+        return scores, rows
+
+
+class FaissIndex(VectorIndex):
+    """
+    Base of the faiss-backed indexes: subclasses create the faiss index in _create, and
+    build() trains it on the matrix when the index type needs training. The index can be
+    written to disk with save() and opened memory-mapped with FaissIndex.load(), so
+    processes serving the same index share its pages through the OS page cache.
+    """
+
+    def __init__(self, index=None) -> None:
+        self.index = index
+
+    @abstractmethod
+    def _create(self, matrix: np.ndarray):
+        """Returns the empty (possibly untrained) faiss index for matrix."""
+
+    def build(self, matrix: np.ndarray) -> "FaissIndex":
+        _require_faiss(type(self).__name__)
+        matrix = embeddings_to_matrix(matrix)
+        self.index = self._create(matrix)
+        if not self.index.is_trained:
+            self.index.train(matrix)
+        self.index.add(matrix)
+        return self
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.index.search(embeddings_to_matrix(queries), k)
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+    def save(self, path: str) -> None:
+        """Writes the index to path atomically (a temporary file renamed over path)."""
+        descriptor, temporary_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+        )
+        os.close(descriptor)
+        try:
+            faiss.write_index(self.index, temporary_path)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    @staticmethod
+    def load(path: str, mmap: bool = True) -> "FaissIndex":
+        """
+        Opens an index written by save(). With mmap, the vectors (flat codes, HNSW storage
+        and IVF lists) stay in the file and are paged in on demand instead of being copied
+        into process memory; the loaded index is read-only.
+        """
+        _require_faiss("FaissIndex.load")
+        flags = 0
+        if mmap:
+            # IO_FLAG_MMAP_IFC (newer faiss) also maps flat codes; IO_FLAG_MMAP only IVF lists
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        return LoadedFaissIndex(faiss.read_index(path, flags))
+
+
+class LoadedFaissIndex(FaissIndex):
+    """An index opened by FaissIndex.load(): it can be searched and saved, but build() raises TypeError."""
+
+    def _create(self, matrix: np.ndarray):
+        raise TypeError(
+            "An index loaded from disk cannot be rebuilt; build a new one with get_faiss_index()"
+        )
+
+
+def _ivf_nlist(n_rows: int, nlist: Optional[int]) -> int:
+    # 4 * sqrt(n) lists by default; faiss wants about 39 training points per list
+    nlist = nlist or int(4 * math.sqrt(n_rows))
+    return max(1, min(nlist, n_rows // 39))
+
+
+class FaissFlatIndex(FaissIndex):
+    """Exact inner-product search in faiss (IndexFlatIP); needs no training."""
+
+    def _create(self, matrix: np.ndarray):
+        return faiss.IndexFlatIP(matrix.shape[1])
+
+
+class HNSWIndex(FaissIndex):
+    """
+    faiss HNSW graph. Needs no training; m is the graph degree, and ef_search trades
+    query latency for recall.
+    """
+
+    def __init__(self, m: int = 32, ef_construction: int = 80, ef_search: int = 256) -> None:
+        super().__init__()
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+
+    def _create(self, matrix: np.ndarray):
+        index = faiss.IndexHNSWFlat(matrix.shape[1], self.m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = self.ef_construction
+        # Stored with the index, so a loaded copy searches with the same setting
+        index.hnsw.efSearch = self.ef_search
+        return index
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        self.index.hnsw.efSearch = max(self.ef_search, k)
+        return super().search(queries, k)
+
+
+class IVFIndex(FaissIndex):
+    """
+    faiss inverted-file index: k-means partitions the rows into nlist lists (4 * sqrt(n)
+    by default) and a query scans the nprobe closest lists.
+    """
+
+    def __init__(self, nlist: Optional[int] = None, nprobe: int = 32) -> None:
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+
+    def _create(self, matrix: np.ndarray):
+        nlist = _ivf_nlist(len(matrix), self.nlist)
+        quantizer = faiss.IndexFlatIP(matrix.shape[1])
+        index = faiss.IndexIVFFlat(quantizer, matrix.shape[1], nlist, faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = min(self.nprobe, nlist)
+        return index
+
+
+class IVFPQIndex(FaissIndex):
+    """
+    IVF with product-quantized vectors: m sub-vectors of nbits each per row, about
+    m * nbits / 8 bytes instead of 4 * d. The defaults follow the corpus: the largest m
+    up to 64 that divides d, and 8 bits (fewer when there are too few rows to train 256
+    centroids per sub-quantizer).
+    """
+
+    def __init__(
+        self,
+        nlist: Optional[int] = None,
+        nprobe: int = 32,
+        m: Optional[int] = None,
+        nbits: Optional[int] = None,
+    ) -> None:
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.m = m
+        self.nbits = nbits
+
+    def _create(self, matrix: np.ndarray):
+        n_rows, dim = matrix.shape
+        nlist = _ivf_nlist(n_rows, self.nlist)
+        m = self.m or next(m for m in (64, 32, 16, 8, 4, 2, 1) if dim % m == 0)
+        nbits = self.nbits or max(1, min(8, int(math.log2(max(2, n_rows // 39)))))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits, faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = min(self.nprobe, nlist)
+        return index
+
+
+class AutoIndex(VectorIndex):
+    """
+    Exact flat search up to flat_max_nodes rows, where it is fast and needs no build,
+    and IVF beyond that (on benchmarks/bench_vector_index.py it answers faster and with
+    higher recall than HNSW, at a longer build). Falls back to flat search when faiss is
+    not installed.
+    """
+
+    def __init__(self, flat_max_nodes: int = 20000) -> None:
+        self.flat_max_nodes = flat_max_nodes
+
+    def build(self, matrix: np.ndarray) -> VectorIndex:
+        if len(matrix) > self.flat_max_nodes:
+            if faiss is not None:
+                return IVFIndex().build(matrix)
+            logging.warning(
+                f"faiss is not installed; using exact flat search over {len(matrix)} nodes"
+            )
+        return FlatIndex().build(matrix)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        raise RuntimeError("AutoIndex.build() returns the concrete index to search")
+
+
+class AutoFaissIndex(FaissIndex):
+    """
+    Picks a faiss index by corpus size: exact IndexFlatIP up to flat_max_rows, IVF up to
+    ivf_max_rows and IVFPQ beyond, where full float32 vectors stop fitting comfortably
+    in memory.
+    """
+
+    def __init__(self, flat_max_rows: int = 50_000, ivf_max_rows: int = 1_000_000) -> None:
+        super().__init__()
+        self.flat_max_rows = flat_max_rows
+        self.ivf_max_rows = ivf_max_rows
+
+    def _create(self, matrix: np.ndarray):
+        if len(matrix) <= self.flat_max_rows:
+            return FaissFlatIndex()._create(matrix)
+        if len(matrix) <= self.ivf_max_rows:
+            return IVFIndex()._create(matrix)
+        return IVFPQIndex()._create(matrix)
+
+
+# Vector indexes selectable by name (e.g. TreeRetrieverConfig(index_type="hnsw"))
+VECTOR_INDEXES = {
+    "auto": AutoIndex,
+    "flat": FlatIndex,
+    "hnsw": HNSWIndex,
+    "ivf": IVFIndex,
+    "ivfpq": IVFPQIndex,
+}
+
+# faiss indexes that can be saved and memory-mapped (e.g. FaissRetrieverConfig(index_type="ivfpq"))
+FAISS_INDEXES = {
+    "auto": AutoFaissIndex,
+    "flat": FaissFlatIndex,
+    "hnsw": HNSWIndex,
+    "ivf": IVFIndex,
+    "ivfpq": IVFPQIndex,
+}
+
+
+def _resolve_index(index_type, registry: dict, base: type, kind: str):
+    if isinstance(index_type, str):
+        if index_type not in registry:
+            raise ValueError(
+                f"Unsupported {kind} '{index_type}'. Supported indexes are: {list(registry.keys())}"
+            )
+        index_type = registry[index_type]
+    if isinstance(index_type, type) and issubclass(index_type, base):
+        index_type = index_type()
+    if not isinstance(index_type, base):
+        raise ValueError(
+            f"index_type must be an index name, a {base.__name__} subclass or an instance of one"
+        )
+    return index_type
+
+
+def get_vector_index(index_type) -> VectorIndex:
+    """Resolves an index name, a VectorIndex subclass or an instance to an instance."""
+    return _resolve_index(index_type, VECTOR_INDEXES, VectorIndex, "vector index")
+
+
+def get_faiss_index(index_type) -> FaissIndex:
+    """Resolves a FAISS_INDEXES name, a FaissIndex subclass or an instance to an instance."""
+    return _resolve_index(index_type, FAISS_INDEXES, FaissIndex, "faiss index")
@@ -0,0 +1,310 @@
+# /app/services/build_orchestrator.py
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.raptor.build_planner import BuildPlanner
+from app.raptor.EmbeddingModels import BaseEmbeddingModel
+from app.raptor.SummarizationModels import BaseSummarizationModel
+from app.raptor.scheduling import TokenBucket
+
+from ..models.custom_raptor_models import SparkEmbeddingModel, SparkSummarizationModel
+from ..models.schemas import DocumentTreeNode
+from .tree_builder_service import TreeBuilderService
+
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _env_float(name: str) -> Optional[float]:
+    return float(os.environ[name]) if os.getenv(name) else None
+
+
+# ----------------- 公平共享的请求工作池 -----------------
+
+class FairWorkerPool:
+    """
+    所有文档共享的一组API请求工作线程。
+    - 工作线程数即全局在途请求上限；rate_limit (每秒请求数) 由令牌桶控制。
+    - 每个文档一个等待队列，工作线程在有等待请求的文档之间轮转取任务，
+      因此一个大文档排满的队列不会饿死同时提交的小文档。
+    """
+    def __init__(self, name: str, workers: int, rate_limit: Optional[float] = None):
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("workers 必须是不小于1的整数")
+        self.name = name
+        self.workers = workers
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+
+        self._queues: Dict[str, Deque[Tuple[Future, Callable, tuple]]] = {}
+        self._order: Deque[str] = deque()  # 有等待请求的文档，按轮转顺序
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._completed = 0
+        self._completed_by_doc: Dict[str, int] = {}
+        self._started_at = time.monotonic()
+
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{name}-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, doc_id: str, fn: Callable, *args) -> Future:
+        future: Future = Future()
+        with self._condition:
+            queue = self._queues.setdefault(doc_id, deque())
+            if not queue:
+                self._order.append(doc_id)
+            queue.append((future, fn, args))
+            self._condition.notify()
+        return future
+
+    def call(self, doc_id: str, fn: Callable, *args) -> Any:
+        """提交一个请求并阻塞等待结果。"""
+        return self.submit(doc_id, fn, *args).result()
+
+    def _next_task(self) -> Tuple[str, Future, Callable, tuple]:
+        with self._condition:
+            while not self._order:
+                self._condition.wait()
+            # 轮转: 取队首文档的一个请求，若它还有请求则排到队尾
+            doc_id = self._order.popleft()
+            queue = self._queues[doc_id]
+            future, fn, args = queue.popleft()
+            if queue:
+                self._order.append(doc_id)
+            else:
+                del self._queues[doc_id]
+            self._in_flight += 1
+            return doc_id, future, fn, args
+
+    def _worker(self) -> None:
+        while True:
+            doc_id, future, fn, args = self._next_task()
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if self.bucket is not None:
+                    self.bucket.acquire()
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._in_flight -= 1
+                    self._completed += 1
+                    self._completed_by_doc[doc_id] = self._completed_by_doc.get(doc_id, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            elapsed = time.monotonic() - self._started_at
+            return {
+                "workers": self.workers,
+                "in_flight": self._in_flight,
+                "queued": {doc_id: len(queue) for doc_id, queue in self._queues.items()},
+                "completed": self._completed,
+                "requests_per_second": round(self._completed / elapsed, 2) if elapsed > 0 else 0.0,
+            }
+
+
+# ----------------- 经由共享工作池的模型包装 -----------------
+
+class PooledEmbeddingModel(BaseEmbeddingModel):
+    """
+    某个文档视角下的共享嵌入模型: 每段文本作为一个请求进入共享工作池 (星火Embedding每次只接受一段文本)。
+    identifier 与被包装的模型一致，嵌入缓存在编排与非编排构建之间通用。
+    """
+    def __init__(self, model: BaseEmbeddingModel, pool: FairWorkerPool, doc_id: str):
+        self.model = model
+        self.pool = pool
+        self.doc_id = doc_id
+
+    @property
+    def identifier(self) -> str:
+        return self.model.identifier
+
+    def create_embedding(self, text):
+        return self.pool.call(self.doc_id, self.model.create_embedding, text)
+
+    def create_embeddings(self, texts):
+        futures = [self.pool.submit(self.doc_id, self.model.create_embedding, text) for text in texts]
+        return [future.result() for future in futures]
+
+
+class PooledSummarizationModel(BaseSummarizationModel):
+    """某个文档视角下的共享摘要模型: 每次摘要作为一个请求进入共享工作池；缓存键与被包装的模型一致。"""
+    def __init__(self, model: BaseSummarizationModel, pool: FairWorkerPool, doc_id: str):
+        self.model = model
+        self.pool = pool
+        self.doc_id = doc_id
+
+    @property
+    def prompt_template(self) -> str:
+        return self.model.prompt_template
+
+    @property
+    def identifier(self) -> str:
+        return self.model.identifier
+
+    def is_valid_summary(self, summary) -> bool:
+        return self.model.is_valid_summary(summary)
+
+    def summarize(self, context, max_tokens=150):
+        return self.pool.call(self.doc_id, self.model.summarize, context, max_tokens)
+
+
+# ----------------- 构建编排器 -----------------
+
+class BuildOrchestrator:
+    """
+    多文档并发建树的编排器。
+    - 最多 max_concurrent_builds 个文档同时构建，其余排队等待。
+    - 所有构建共用一份星火模型客户端，以及摘要/嵌入两个公平共享的工作池；
+      工作线程数是全局在途请求上限，qps 是全局每秒请求上限，文档之间轮转分配。
+    - 各文档的摘要并发数设为工作池大小，单个文档独占时也能用满配额。
+    各参数默认从环境变量读取: RAPTOR_MAX_CONCURRENT_BUILDS, RAPTOR_SUMMARY_WORKERS,
+    RAPTOR_EMBEDDING_WORKERS, RAPTOR_SUMMARY_QPS, RAPTOR_EMBEDDING_QPS。
+    """
+    def __init__(
+        self,
+        max_concurrent_builds: Optional[int] = None,
+        summary_workers: Optional[int] = None,
+        embedding_workers: Optional[int] = None,
+        summary_qps: Optional[float] = None,
+        embedding_qps: Optional[float] = None,
+    ):
+        self.max_concurrent_builds = max_concurrent_builds or _env_int("RAPTOR_MAX_CONCURRENT_BUILDS", 4)
+        self.summary_workers = summary_workers or _env_int("RAPTOR_SUMMARY_WORKERS", 8)
+        self.embedding_workers = embedding_workers or _env_int("RAPTOR_EMBEDDING_WORKERS", 16)
+        self.summary_qps = summary_qps if summary_qps is not None else _env_float("RAPTOR_SUMMARY_QPS")
+        self.embedding_qps = embedding_qps if embedding_qps is not None else _env_float("RAPTOR_EMBEDDING_QPS")
+        if self.max_concurrent_builds < 1:
+            raise ValueError("max_concurrent_builds 必须不小于1")
+
+        # 模型客户端与工作池在第一次构建时创建 (导入本模块时不需要星火凭证)
+        self._lock = threading.Lock()
+        self._embedding_model: Optional[BaseEmbeddingModel] = None
+        self._summarization_model: Optional[BaseSummarizationModel] = None
+        self._summary_pool: Optional[FairWorkerPool] = None
+        self._embedding_pool: Optional[FairWorkerPool] = None
+        self._build_slots: Optional[asyncio.Semaphore] = None
+        self._running: Dict[str, float] = {}
+        self._waiting = 0
+        # 同一文档的构建依次进行: doc_id -> (锁, 持有或等待该锁的构建数)
+        self._doc_locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    def _ensure_shared(self) -> None:
+        with self._lock:
+            if self._summary_pool is not None:
+                return
+            self._embedding_model = SparkEmbeddingModel(domain="para")
+            self._summarization_model = SparkSummarizationModel(model_name="x1")
+            self._summary_pool = FairWorkerPool("summary", self.summary_workers, self.summary_qps)
+            self._embedding_pool = FairWorkerPool("embedding", self.embedding_workers, self.embedding_qps)
+
+    def create_service(self, doc_id: str, **kwargs) -> TreeBuilderService:
+        """创建一个使用共享模型客户端与工作池的TreeBuilderService。"""
+        self._ensure_shared()
+        return TreeBuilderService(
+            doc_id,
+            embedding_model=PooledEmbeddingModel(self._embedding_model, self._embedding_pool, doc_id),
+            summarization_model=PooledSummarizationModel(self._summarization_model, self._summary_pool, doc_id),
+            summarization_concurrency=self.summary_workers,
+            # 同时构建的文档平分CPU，局部聚类的进程总数不超过CPU数
+            cluster_workers=max(1, (os.cpu_count() or 1) // self.max_concurrent_builds),
+            **kwargs,
+        )
+
+    async def build(
+        self,
+        doc_id: str,
+        raw_text: str,
+        is_timestamped: bool = False,
+        append: bool = False,
+        on_layers_ready: Optional[Callable[[List[int]], None]] = None,
+        on_started: Optional[Callable[[], None]] = None,
+        on_plan: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> Tuple[List[DocumentTreeNode], TreeBuilderService]:
+        """
+        排队获得构建名额后，在线程中构建 (或增量更新) 文档树。
+        同一doc_id的构建 (如对同一文档的两次增量上传) 依次排队，不会并发读写同一棵树、检查点和索引文件。
+        新建树的构建计划与耗时预估在排队前生成并通过 on_plan 报告 (预估按共享工作池的并发计算)。
+        返回前端树结构和完成构建的服务实例 (可读取 last_update_report / layers_ready)。
+        """
+        plan = None
+        if not append:
+            planner = BuildPlanner(
+                embedding_concurrency=self.embedding_workers,
+                summary_concurrency=self.summary_workers,
+            )
+            plan = (await asyncio.to_thread(planner.plan, raw_text)).as_dict()
+            if on_plan is not None:
+                on_plan(plan)
+
+        if self._build_slots is None:
+            self._build_slots = asyncio.Semaphore(self.max_concurrent_builds)
+
+        # 先取得文档锁再占用构建名额，排在同一文档之后的构建不占名额
+        doc_lock, holders = self._doc_locks.get(doc_id, (asyncio.Lock(), 0))
+        self._doc_locks[doc_id] = (doc_lock, holders + 1)
+        self._waiting += 1
+        try:
+            try:
+                await doc_lock.acquire()
+                try:
+                    await self._build_slots.acquire()
+                except BaseException:
+                    doc_lock.release()
+                    raise
+            finally:
+                self._waiting -= 1
+            try:
+                if on_started is not None:
+                    on_started()
+                started = time.monotonic()
+                self._running[doc_id] = started
+                service = await asyncio.to_thread(self.create_service, doc_id)
+                frontend_tree = await asyncio.to_thread(
+                    service.build_tree_from_text, raw_text, is_timestamped=is_timestamped,
+                    append=append, on_layers_ready=on_layers_ready, plan=plan,
+                )
+                tree = service.raptor_instance.tree
+                elapsed = time.monotonic() - started
+                if tree is not None and elapsed > 0:
+                    print(f"[{doc_id}] 构建完成: {len(tree.leaf_nodes)} 个文本块，用时 {elapsed:.1f}s ({len(tree.leaf_nodes) / elapsed:.1f} 块/秒)")
+                return frontend_tree, service
+            finally:
+                self._running.pop(doc_id, None)
+                self._build_slots.release()
+                doc_lock.release()
+        finally:
+            _, holders = self._doc_locks[doc_id]
+            if holders == 1:
+                del self._doc_locks[doc_id]
+            else:
+                self._doc_locks[doc_id] = (doc_lock, holders - 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent_builds": self.max_concurrent_builds,
+            "running": sorted(self._running),
+            "waiting": self._waiting,
+            "summary_pool": self._summary_pool.stats() if self._summary_pool else None,
+            "embedding_pool": self._embedding_pool.stats() if self._embedding_pool else None,
+        }
+
+
+# 创建一个全局的单例，供所有后台构建任务共享
+build_orchestrator = BuildOrchestrator()
@@ -5,13 +5,20 @@ import os
 import pickle
 import re
 import asyncio
-from typing import List, Dict, Set, Tuple
+import threading
+from typing import Any, Callable, List, Dict, Optional, Set, Tuple
 
 # 使用绝对路径导入RAPTOR库 (假设raptor源代码在 app/raptor/ 目录下)
 from app.raptor import RetrievalAugmentation, RetrievalAugmentationConfig
 from app.raptor.tree_structures import Tree as RaptorTree, Node as RaptorNode
 from app.raptor.FaissRetriever import FaissRetriever, FaissRetrieverConfig
+from app.raptor.EmbeddingModels import BaseEmbeddingModel, SBertEmbeddingModel
+from app.raptor.SummarizationModels import BaseSummarizationModel
 from app.raptor.tree_builder import TreeBuilder # 需要从tree_builder导入create_node
+from app.raptor.utils import split_text
+from app.raptor.cluster_utils import CLUSTERING_BACKENDS
+from app.raptor.build_planner import BuildPlanner
+from app.raptor.checkpoint import TreeBuildCheckpoint, build_fingerprint
 
 # 导入我们自己的模块
 from ..models.custom_raptor_models import (
@@ -25,6 +32,12 @@ from ..models.schemas import DocumentTreeNode
 TREE_CACHE_DIR = "./tree_cache"
 os.makedirs(TREE_CACHE_DIR, exist_ok=True)
 
+# 构建中文档的最新可查询状态: doc_id -> {"tree", "faiss_retriever", "layers_ready", "fingerprint"}。
+# 叶子嵌入完成后即发布仅含叶子层的树，之后每完成一层摘要就整体替换一次 (替换是原子的，查询不会看到半层)；
+# 完整的树写入 TREE_CACHE_DIR 后或构建失败时移除。
+_published_builds: Dict[str, Dict[str, Any]] = {}
+_published_builds_lock = threading.Lock()
+
 # ----------------- 主服务类 -----------------
 
 class TreeBuilderService:
@@ -37,17 +50,53 @@ class TreeBuilderService:
     - 数据格式适配 (RAPTOR Tree -> 前端JSON)
     - 对带时间戳文本的完整处理
     """
-    def __init__(self, doc_id: str, use_sbert_for_dev: bool = False):
+    def __init__(
+        self,
+        doc_id: str,
+        use_sbert_for_dev: bool = False,
+        clustering_backend: Optional[str] = None,
+        clustering_params: Optional[Dict[str, Any]] = None,
+        embedding_model: Optional[BaseEmbeddingModel] = None,
+        summarization_model: Optional[BaseSummarizationModel] = None,
+        summarization_concurrency: Optional[int] = None,
+        cluster_workers: Optional[int] = None,
+    ):
         if not doc_id:
             raise ValueError("doc_id不能为空")
+        if clustering_backend is not None and clustering_backend not in CLUSTERING_BACKENDS:
+            raise ValueError(f"不支持的聚类后端: {clustering_backend}，可选: {list(CLUSTERING_BACKENDS.keys())}")
             
         self.doc_id = doc_id
         self.use_sbert_for_dev = use_sbert_for_dev
+        # 聚类后端按每次构建选择：大文档可用 minibatch_kmeans / spherical_kmeans / agglomerative；
+        # 未指定时由构建计划按文档规模选择 (无计划时为 raptor)
+        self.requested_clustering_backend = clustering_backend
+        self.clustering_backend = clustering_backend or "raptor"
+        self.clustering_params = dict(clustering_params or {})
+        # 本次构建的计划 (块大小、层数、聚类后端、摘要长度及调用数/耗时预估)，见 BuildPlanner
+        self.build_plan: Optional[Dict[str, Any]] = None
+        # 由构建编排器注入的共享模型 (全局并发与限速由编排器的工作池负责)；未注入时各自创建星火模型
+        self.embedding_model = embedding_model
+        self.summarization_model = summarization_model
+        self.summarization_concurrency = summarization_concurrency
+        # 局部聚类进程数的上限 (编排器按同时构建的文档数分配CPU)；None 表示不限制
+        self.cluster_workers = cluster_workers
         self.tree_path = os.path.join(TREE_CACHE_DIR, f"{self.doc_id}.pkl")
+        # 构建过程中的检查点 (叶子节点、已完成的层、进行中层的已完成摘要)，构建完成后删除
+        self.checkpoint_path = os.path.join(TREE_CACHE_DIR, f"{self.doc_id}.ckpt")
+        # 叶子层的faiss索引与树一同持久化，查询时以内存映射加载，不在请求中重建
+        self.faiss_index_path = os.path.join(TREE_CACHE_DIR, f"{self.doc_id}.faiss")
+        # 最近一次增量更新的统计 (新叶子数、重新摘要数、节省的LLM调用数等)
+        self.last_update_report: Optional[Dict[str, Any]] = None
         
         self.raptor_config = self._create_raptor_config()
         self.raptor_instance = self._init_raptor_instance()
-        self.faiss_retriever = self._init_faiss_retriever() if self.raptor_instance.tree else None
+        published = self._get_published_build() if not os.path.exists(self.tree_path) else None
+        if published is not None:
+            # 构建中的文档: 复用已发布的叶子层向量索引，不重新建立
+            self.faiss_retriever = published["faiss_retriever"]
+        else:
+            self.faiss_retriever = self._init_faiss_retriever() if self.raptor_instance.tree else None
 
     # --- --------------------------------- ---
     # ---       初始化与配置方法           ---
@@ -59,7 +108,9 @@ class TreeBuilderService:
         创建我们定制化的RAPTOR配置对象，注入所有自定义的星火模型。
         """
         # 可以通过环境变量或构造函数参数来决定是否使用开发模式
-        if self.use_sbert_for_dev:
+        if self.embedding_model is not None:
+            embedding_model_instance = self.embedding_model
+        elif self.use_sbert_for_dev:
             print(f"[{self.doc_id}] [DEV MODE] 使用SBERT嵌入模型。")
             embedding_model_instance = SBertEmbeddingModel()
         else:
@@ -68,126 +119,376 @@ class TreeBuilderService:
 
         # 【核心装配】: 实例化我们所有定制化的模型
         qa_model_instance = SparkQAModel(model_name="generalv3.5")
-        summarization_model_instance = SparkSummarizationModel(model_name="x1")
+        summarization_model_instance = self.summarization_model or SparkSummarizationModel(model_name="x1")
         
-        print(f"[{self.doc_id}] RAPTOR配置完成: QA->SparkV3.5, Summary->SparkX1, Embedding->{type(embedding_model_instance).__name__}")
+        print(f"[{self.doc_id}] RAPTOR配置完成: QA->SparkV3.5, Summary->SparkX1, Embedding->{type(embedding_model_instance).__name__}, Clustering->{self.clustering_backend}")
+
+        # 摘要并发数与每秒请求数上限，避免超出星火QPS限制而触发重试；
+        # 共享模型的请求已经过编排器的全局工作池限流，这里不再单独限速
+        summarization_concurrency = self.summarization_concurrency or int(os.getenv("RAPTOR_SUMMARY_CONCURRENCY", "4"))
+        summarization_rate_limit = None
+        if self.summarization_model is None and os.getenv("RAPTOR_SUMMARY_QPS"):
+            summarization_rate_limit = float(os.environ["RAPTOR_SUMMARY_QPS"])
+
+        clustering_params = dict(self.clustering_params)
+        # RAPTOR聚类的局部聚类可在多进程上并行，进程数由环境变量 RAPTOR_CLUSTER_WORKERS 配置 (-1 表示所有CPU)，
+        # 且不超过 cluster_workers，避免多个文档同时构建时进程数超过CPU数
+        if self.clustering_backend == "raptor" and os.getenv("RAPTOR_CLUSTER_WORKERS"):
+            clustering_params.setdefault("local_workers", int(os.environ["RAPTOR_CLUSTER_WORKERS"]))
+        local_workers = clustering_params.get("local_workers")
+        if local_workers is not None:
+            if local_workers == -1:
+                local_workers = os.cpu_count() or 1
+            if self.cluster_workers is not None:
+                local_workers = min(local_workers, self.cluster_workers)
+            clustering_params["local_workers"] = local_workers
+
+        # 构建计划按文档规模决定块大小、层数、降维维度和摘要长度；没有计划时使用RAPTOR的默认值
+        plan_kwargs = {}
+        if self.build_plan is not None:
+            plan_kwargs = dict(
+                tb_max_tokens=self.build_plan["max_tokens"],
+                tb_num_layers=self.build_plan["num_layers"],
+                tb_summarization_length=self.build_plan["summarization_length"],
+                tb_reduction_dimension=self.build_plan["reduction_dimension"],
+            )
 
         # 将这些实例注入到RAPTOR的配置中
         return RetrievalAugmentationConfig(
             qa_model=qa_model_instance,
             summarization_model=summarization_model_instance,
-            embedding_model=embedding_model_instance
+            embedding_model=embedding_model_instance,
+            tb_clustering_algorithm=self.clustering_backend,
+            tb_clustering_params=clustering_params,
+            tb_summarization_concurrency=summarization_concurrency,
+            tb_summarization_rate_limit=summarization_rate_limit,
+            **plan_kwargs,
         )
 
+    def plan_build(self, raw_text: str) -> Dict[str, Any]:
+        """按文档的token总数生成构建计划，并预估嵌入/摘要调用次数和耗时。"""
+        builder_config = self.raptor_config.tree_builder_config
+        planner = BuildPlanner(
+            tokenizer=builder_config.tokenizer,
+            summary_concurrency=builder_config.summarization_concurrency,
+        )
+        return planner.plan(raw_text).as_dict()
+
+    def _apply_build_plan(self, plan: Dict[str, Any]) -> None:
+        """按构建计划重建RAPTOR配置 (保留已加载的树)；显式指定的聚类后端优先于计划。"""
+        self.build_plan = plan
+        if self.requested_clustering_backend is None:
+            self.clustering_backend = plan["clustering_backend"]
+        self.raptor_config = self._create_raptor_config()
+        self.raptor_instance = RetrievalAugmentation(config=self.raptor_config, tree=self.raptor_instance.tree)
+
     def _init_raptor_instance(self) -> RetrievalAugmentation:
         """初始化RAPTOR主实例。如果存在缓存则加载，否则创建新的。"""
         if os.path.exists(self.tree_path):
             print(f"[{self.doc_id}] 发现缓存的树，正在加载...")
             try:
-                return RetrievalAugmentation(config=self.raptor_config, tree=self.tree_path)
+                instance = RetrievalAugmentation(config=self.raptor_config, tree=self.tree_path)
+                instance.tree.compact()
+                return instance
             except Exception as e:
                 print(f"[{self.doc_id}] 加载缓存树失败: {e}。将创建新树。")
+
+        published = self._get_published_build()
+        if published is not None:
+            print(f"[{self.doc_id}] 树仍在构建中，使用已发布的层 {published['layers_ready']} 提供查询。")
+            return RetrievalAugmentation(config=self.raptor_config, tree=published["tree"])
         
         return RetrievalAugmentation(config=self.raptor_config)
 
-    def _init_faiss_retriever(self) -> FaissRetriever:
-        """基于已构建的树的叶子节点，初始化FaissRetriever。"""
-        if not self.raptor_instance.tree:
+    def _get_published_build(self) -> Optional[Dict[str, Any]]:
+        with _published_builds_lock:
+            return _published_builds.get(self.doc_id)
+
+    @property
+    def layers_ready(self) -> List[int]:
+        """当前可查询的层 (0为叶子层)。完整的树返回所有层。"""
+        published = self._get_published_build()
+        if published is not None and not os.path.exists(self.tree_path):
+            return list(published["layers_ready"])
+        tree = self.raptor_instance.tree if self.raptor_instance else None
+        return sorted(tree.layer_to_nodes) if tree else []
+
+    def _init_faiss_retriever(self, tree: Optional[RaptorTree] = None) -> FaissRetriever:
+        """
+        基于已构建的树 (默认为当前实例的树) 的叶子节点，初始化FaissRetriever。
+        对已持久化的树，索引保存在 faiss_index_path: 文件不旧于树时直接以内存映射加载，
+        否则 (首次构建、增量更新后) 重建并写入。构建中发布的部分树只在内存中建立索引。
+        索引类型由环境变量 RAPTOR_FAISS_INDEX 选择 (auto/flat/ivf/hnsw/ivfpq，默认auto按叶子数选择)。
+        """
+        persisted = tree is None and os.path.exists(self.tree_path)
+        tree = tree if tree is not None else self.raptor_instance.tree
+        if not tree:
             return None
             
         print(f"[{self.doc_id}] 正在初始化FaissRetriever以支持全面检索...")
         
-        embedding_model = SBERTEmbeddingModel() if self.use_sbert_for_dev else SparkEmbeddingModel(domain="para")
-        question_embedding_model = SBERTEmbeddingModel() if self.use_sbert_for_dev else SparkEmbeddingModel(domain="query")
+        if self.embedding_model is not None:
+            embedding_model = self.embedding_model
+        else:
+            embedding_model = SBertEmbeddingModel() if self.use_sbert_for_dev else SparkEmbeddingModel(domain="para")
+        question_embedding_model = SBertEmbeddingModel() if self.use_sbert_for_dev else SparkEmbeddingModel(domain="query")
 
         faiss_config = FaissRetrieverConfig(
             embedding_model=embedding_model,
             question_embedding_model=question_embedding_model,
-            top_k=10
+            # 叶子节点的嵌入保存在树构建时使用的模型键下
+            embedding_model_string=self.raptor_config.tree_retriever_config.context_embedding_model,
+            top_k=10,
+            index_type=os.getenv("RAPTOR_FAISS_INDEX", "auto"),
         )
         retriever = FaissRetriever(config=faiss_config)
         
-        leaf_nodes = [self.raptor_instance.tree.all_nodes[i] for i in self.raptor_instance.tree.leaf_nodes]
+        # 按节点索引排序，保证持久化的索引行与重新加载时的叶子顺序一致
+        leaf_nodes = [tree.all_nodes[i] for i in sorted(tree.leaf_nodes)]
+        if persisted and self._faiss_index_is_fresh():
+            try:
+                retriever.load_index(self.faiss_index_path, leaf_nodes)
+                print(f"[{self.doc_id}] 已以内存映射加载FaissRetriever索引，共 {len(leaf_nodes)} 个叶子节点。")
+                return retriever
+            except (ValueError, RuntimeError) as e:
+                print(f"[{self.doc_id}] 持久化的faiss索引不可用，重新构建: {e}")
+
         retriever.build_from_leaf_nodes(leaf_nodes)
+        if persisted:
+            retriever.save_index(self.faiss_index_path)
+            print(f"[{self.doc_id}] faiss索引已保存到: {self.faiss_index_path}")
         
         print(f"[{self.doc_id}] FaissRetriever初始化完成，共索引 {len(leaf_nodes)} 个叶子节点。")
         return retriever
 
+    def _faiss_index_is_fresh(self) -> bool:
+        """持久化的faiss索引存在且不早于树文件 (树被增量更新重写后，索引需要重建)。"""
+        return (
+            os.path.exists(self.faiss_index_path)
+            and os.path.getmtime(self.faiss_index_path) >= os.path.getmtime(self.tree_path)
+        )
+
     # --- --------------------------------- ---
     # ---      【全新的核心建树流水线】     ---
     # --- --------------------------------- ---
 
-    def build_tree_from_text(self, raw_text: str, is_timestamped: bool = False) -> List[DocumentTreeNode]:
+    def build_tree_from_text(
+        self,
+        raw_text: str,
+        is_timestamped: bool = False,
+        append: bool = False,
+        on_layers_ready: Optional[Callable[[List[int]], None]] = None,
+        plan: Optional[Dict[str, Any]] = None,
+        on_plan: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> List[DocumentTreeNode]:
         """
         【全新核心方法】从文本构建树，并返回前端所需的结构。
         根据 is_timestamped 参数决定是否进行时间戳处理。
+        append=True 且已有缓存树时，将新文本增量加入已有的树 (只嵌入新块、只重新摘要受影响的祖先节点)，
+        本次增量更新的统计保存在 self.last_update_report 中。
+        新建树时，叶子层和每个完成的摘要层都会立即发布供查询，并以可查询的层列表调用 on_layers_ready。
+        新建树前先按文档规模生成构建计划 (可由调用方传入 plan)，并以计划调用 on_plan；增量更新沿用原树的计划。
+        这是阻塞调用，异步任务中应通过 asyncio.to_thread 运行。
         """
-        if os.path.exists(self.tree_path):
+        self.last_update_report = None
+        if os.path.exists(self.tree_path) and not append:
             print(f"[{self.doc_id}] 发现缓存树，直接加载并返回。")
             self._ensure_raptor_instance_is_ready()
             return self._format_raptor_tree_to_schema()
 
-        print(f"[{self.doc_id}] 开始新的树构建流程...")
+        appending = append and self.raptor_instance.tree is not None
+        if appending:
+            tree_plan = getattr(self.raptor_instance.tree, 'build_plan', None)
+            if tree_plan is not None:
+                self._apply_build_plan(tree_plan)
+        else:
+            plan = plan or self.plan_build(raw_text)
+            print(f"[{self.doc_id}] 构建计划: {plan}")
+            self._apply_build_plan(plan)
+            if on_plan is not None:
+                on_plan(plan)
 
         chunks_with_metadata = []
         if is_timestamped:
             clean_text, chunks_with_metadata = self._preprocess_timestamped_text(raw_text)
         else:
             # 对于普通文本，也将其转换为带元数据的块结构
-            chunks_with_metadata = [{"text": chunk, "timestamp": None} for chunk in split_text(raw_text, self.raptor_config.tree_builder_config.tokenizer)]
-            
-        raptor_tree = self._construct_tree_from_chunks(chunks_with_metadata)
-        
-        with open(self.tree_path, "wb") as f:
-            pickle.dump(raptor_tree, f)
-        print(f"[{self.doc_id}] 新树已构建并保存到: {self.tree_path}")
-
-        # 将新构建的树加载到实例中
+            builder_config = self.raptor_config.tree_builder_config
+            chunks_with_metadata = [{"text": chunk, "timestamp": None} for chunk in split_text(raw_text, builder_config.tokenizer, builder_config.max_tokens)]
+
+        try:
+            if appending:
+                print(f"[{self.doc_id}] 发现已有的树，增量加入 {len(chunks_with_metadata)} 个新文本块...")
+                raptor_tree = self._add_chunks_to_tree(chunks_with_metadata)
+            else:
+                print(f"[{self.doc_id}] 开始新的树构建流程...")
+                raptor_tree = self._construct_tree_from_chunks(chunks_with_metadata, on_layers_ready)
+            # 常驻内存的树使用紧凑布局 (__slots__节点 + CSR子节点数组 + 驻留文本)
+            raptor_tree.compact()
+
+            with open(self.tree_path, "wb") as f:
+                pickle.dump(raptor_tree, f)
+            print(f"[{self.doc_id}] 新树已构建并保存到: {self.tree_path}")
+            # 树已持久化，检查点不再需要
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+        finally:
+            # 构建中发布的部分树在成功后不再需要；构建失败时也必须移除，否则之后的请求会把它当作仍在构建中的树
+            with _published_builds_lock:
+                _published_builds.pop(self.doc_id, None)
+
+        # 将新构建的树加载到实例中；叶子层的faiss索引在此 (后台构建任务中) 建立并写入磁盘
         self.raptor_instance = RetrievalAugmentation(config=self.raptor_config, tree=raptor_tree)
         self.faiss_retriever = self._init_faiss_retriever()
 
         return self._format_raptor_tree_to_schema()
 
+    def _add_chunks_to_tree(self, chunks_with_metadata: List[Dict]) -> RaptorTree:
+        """增量更新: 新块挂到最相近的已有父节点下或组成新父节点，只重新摘要子节点集合变化的祖先。"""
+        tree_builder = self.raptor_instance.tree_builder
+        updated_tree, report = tree_builder.add_chunks_to_existing(
+            self.raptor_instance.tree, [chunk_data['text'] for chunk_data in chunks_with_metadata]
+        )
+
+        # 旧树的时间戳映射已随树复制 (新的dict，避免修改旧树)，这里补上新叶子节点的时间戳
+        node_id_to_timestamp = dict(getattr(updated_tree, 'node_id_to_timestamp', {}))
+        for node_id, chunk_data in zip(report.leaf_indices, chunks_with_metadata):
+            if chunk_data.get('timestamp') is not None:
+                node_id_to_timestamp[node_id] = chunk_data['timestamp']
+        setattr(updated_tree, 'node_id_to_timestamp', node_id_to_timestamp)
+
+        self.last_update_report = report.as_dict()
+        print(f"[{self.doc_id}] 增量更新完成: {self.last_update_report}")
+        return updated_tree
+
     def _preprocess_timestamped_text(self, text: str) -> Tuple[str, List[Dict]]:
         """从 "[HH:MM:SS] text" 格式的文本中，分离出纯文本和带时间戳的块。"""
         # ... (此函数与上一版完全一致) ...
         pass
         
-    def _construct_tree_from_chunks(self, initial_chunks_with_metadata: List[Dict]) -> RaptorTree:
+    def _construct_tree_from_chunks(
+        self,
+        initial_chunks_with_metadata: List[Dict],
+        on_layers_ready: Optional[Callable[[List[int]], None]] = None,
+    ) -> RaptorTree:
         """独立的树构建器，模仿了`TreeBuilder`的逻辑，但更透明、可控。"""
         builder_config = self.raptor_config.tree_builder_config
         # 获取RAPTOR配置的TreeBuilder实例，我们需要用它的create_node方法
         tree_builder: TreeBuilder = self.raptor_instance.tree_builder 
 
-        # 步骤1: 创建叶子节点 (Level 0)
-        leaf_nodes: Dict[int, RaptorNode] = {}
-        node_id_to_timestamp: Dict[int, int] = {}
-        
-        for i, chunk_data in enumerate(initial_chunks_with_metadata):
-            _, node = tree_builder.create_node(i, chunk_data['text'])
-            leaf_nodes[i] = node
-            if chunk_data.get('timestamp') is not None:
-                node_id_to_timestamp[i] = chunk_data['timestamp']
-        
-        # 步骤2: 逐层向上构建
+        # 同一doc_id、同样的文本块和模型配置重新构建时，从上次持久化的进度继续
+        fingerprint = self._build_fingerprint(initial_chunks_with_metadata)
+        checkpoint = TreeBuildCheckpoint.load_or_create(self.checkpoint_path, fingerprint)
+
+        # 步骤1: 创建叶子节点 (Level 0)，嵌入按批请求
+        if checkpoint.has_leaves:
+            leaf_nodes: Dict[int, RaptorNode] = checkpoint.leaf_nodes
+            node_id_to_timestamp: Dict[int, int] = checkpoint.metadata.get('node_id_to_timestamp', {})
+            print(f"[{self.doc_id}] 从检查点恢复 {len(leaf_nodes)} 个叶子节点和 {len(checkpoint.layers)} 个已完成的层。")
+        else:
+            leaf_nodes = tree_builder.create_nodes(
+                [chunk_data['text'] for chunk_data in initial_chunks_with_metadata]
+            )
+            node_id_to_timestamp = {
+                i: chunk_data['timestamp']
+                for i, chunk_data in enumerate(initial_chunks_with_metadata)
+                if chunk_data.get('timestamp') is not None
+            }
+            checkpoint.save_leaves(leaf_nodes, node_id_to_timestamp=node_id_to_timestamp)
+
+        # 步骤2: 逐层向上构建 (已完成的层直接恢复，进行中的层只补齐缺少的摘要)
         all_nodes = leaf_nodes.copy()
         layer_to_nodes = {0: list(leaf_nodes.values())}
-        root_nodes_map = tree_builder.construct_tree(leaf_nodes, all_nodes, layer_to_nodes)
+        for layer in sorted(checkpoint.layers):
+            layer_to_nodes[layer] = checkpoint.layers[layer]
+            all_nodes.update({node.index: node for node in checkpoint.layers[layer]})
+        current_level_nodes = {node.index: node for node in layer_to_nodes[max(layer_to_nodes)]}
+
+        # 叶子层 (及从检查点恢复的层) 立即可查询，之后每完成一层就发布一次
+        def publish(layer: int, layer_to_nodes: Dict[int, List[RaptorNode]]) -> None:
+            self._publish_partial_tree(layer_to_nodes, node_id_to_timestamp, fingerprint, on_layers_ready)
+
+        publish(max(layer_to_nodes), layer_to_nodes)
+        root_nodes_map = tree_builder.construct_tree(
+            current_level_nodes, all_nodes, layer_to_nodes, use_multithreading=True,
+            checkpoint=checkpoint, layer_callback=publish
+        )
 
         # 步骤3: 组装成一个完整的RaptorTree对象
         final_tree = RaptorTree(
             all_nodes=all_nodes,
             root_nodes=set(root_nodes_map.keys()),
             leaf_nodes=set(leaf_nodes.keys()),
-            num_layers=builder_config.num_layers,
+            # 层数以实际构建出的层为准 (节点过少时会提前停止)
+            num_layers=max(layer_to_nodes),
             layer_to_nodes=layer_to_nodes
         )
         
-        # 将时间戳映射附加到树对象上
+        # 将时间戳映射和构建计划附加到树对象上 (增量更新沿用同样的块大小与摘要长度)
         setattr(final_tree, 'node_id_to_timestamp', node_id_to_timestamp)
+        setattr(final_tree, 'build_plan', self.build_plan)
         
         return final_tree
         
+    def _publish_partial_tree(
+        self,
+        layer_to_nodes: Dict[int, List[RaptorNode]],
+        node_id_to_timestamp: Dict[int, int],
+        fingerprint: str,
+        on_layers_ready: Optional[Callable[[List[int]], None]] = None,
+    ) -> None:
+        """
+        将已完成的层组装为一棵可查询的部分树并整体发布 (最高层作为根节点)。
+        fingerprint 标识本次构建 (文本块与模型配置)，叶子层的向量索引只在同一次构建的各次发布间复用。
+        """
+        top_layer = max(layer_to_nodes)
+        # 复制节点: Tree会把节点的嵌入指向自己的矩阵，不能影响仍在构建中的节点
+        snapshot_layers = {
+            layer: [RaptorNode(node.text, node.index, node.children, dict(node.embeddings), node.token_count) for node in nodes]
+            for layer, nodes in layer_to_nodes.items()
+        }
+        snapshot_nodes = {node.index: node for nodes in snapshot_layers.values() for node in nodes}
+        partial_tree = RaptorTree(
+            all_nodes=snapshot_nodes,
+            root_nodes={node.index for node in snapshot_layers[top_layer]},
+            leaf_nodes={node.index for node in snapshot_layers[0]},
+            num_layers=top_layer,
+            layer_to_nodes=snapshot_layers
+        )
+        setattr(partial_tree, 'node_id_to_timestamp', dict(node_id_to_timestamp))
+        partial_tree.compact()
+
+        # 叶子层在同一次构建中不会再变化，其向量索引在各次发布间复用
+        published = self._get_published_build()
+        if published is not None and published["fingerprint"] == fingerprint:
+            faiss_retriever = published["faiss_retriever"]
+        else:
+            faiss_retriever = self._init_faiss_retriever(partial_tree)
+
+        layers_ready = sorted(snapshot_layers)
+        with _published_builds_lock:
+            _published_builds[self.doc_id] = {
+                "tree": partial_tree,
+                "faiss_retriever": faiss_retriever,
+                "layers_ready": layers_ready,
+                "fingerprint": fingerprint,
+            }
+        print(f"[{self.doc_id}] 已发布可查询的层: {layers_ready}")
+        if on_layers_ready is not None:
+            on_layers_ready(layers_ready)
+
+    def _build_fingerprint(self, chunks_with_metadata: List[Dict]) -> str:
+        """检查点只对同样的文本块、模型和聚类配置有效。"""
+        builder_config = self.raptor_config.tree_builder_config
+        return build_fingerprint(
+            [chunk_data['text'] for chunk_data in chunks_with_metadata],
+            *sorted(model.identifier for model in builder_config.embedding_models.values()),
+            builder_config.summarization_model.identifier,
+            type(builder_config.clustering_algorithm).__name__,
+            repr(sorted(builder_config.clustering_params.items())),
+            str(builder_config.summarization_length),
+        )
+
     def _format_raptor_tree_to_schema(self) -> List[DocumentTreeNode]:
         """【适配器核心】将RAPTOR的Tree对象，递归地转换为我们前端需要的JSON树结构。"""
         if not self.raptor_instance or not self.raptor_instance.tree:
@@ -245,6 +546,34 @@ class TreeBuilderService:
             return_layer_information=True
         )
         
+        return {"answer": answer, "source_ids": self._leaf_source_ids(layer_information)}
+
+    def answer_precise_questions(self, questions: List[str]) -> List[Dict]:
+        """
+        【业务方法1 (批量): 精确问答】
+        树只加载一次；所有问题一次批量嵌入，并用一次矩阵乘法完成起始层的打分，
+        之后按问题分别遍历子层、应用token预算，问答模型调用并发进行。结果顺序与问题一致。
+        """
+        self._ensure_raptor_instance_is_ready()
+        print(f"[{self.doc_id}] 使用TreeRetriever批量检索 {len(questions)} 个问题...")
+
+        results = self.raptor_instance.answer_questions(
+            questions,
+            collapse_tree=False,
+            start_layer=self.raptor_instance.tree.num_layers,
+            num_layers=self.raptor_instance.tree.num_layers + 1,
+            top_k=3,
+            return_layer_information=True,
+            qa_concurrency=int(os.getenv("RAPTOR_QA_CONCURRENCY", "4")),
+        )
+
+        return [
+            {"answer": answer, "source_ids": self._leaf_source_ids(layer_information)}
+            for answer, layer_information in results
+        ]
+
+    def _leaf_source_ids(self, layer_information: List[Dict]) -> List[str]:
+        """检索结果中属于叶子节点的ID (去重、排序)，用于前端溯源高亮。"""
         source_ids = []
         if layer_information:
             leaf_ids_in_tree = self.raptor_instance.tree.leaf_nodes
@@ -252,7 +581,7 @@ class TreeBuilderService:
                 if info['node_index'] in leaf_ids_in_tree:
                     source_ids.append(str(info['node_index']))
         
-        return {"answer": answer, "source_ids": sorted(list(set(source_ids)))}
+        return sorted(list(set(source_ids)))
 
     def generate_learning_materials(self, topic: str, material_type: str = "exam") -> Dict:
         """【业务方法2: 出题/泛复习】"""
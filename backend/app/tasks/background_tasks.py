@@ -3,13 +3,13 @@ import os
 from .task_manager import task_manager 
 from ..services.url_processing_service import UrlProcessingPipeline
 from ..services.file_parser_service import FileParserService
-from ..services.tree_builder_service import TreeBuilderService
+from ..services.build_orchestrator import build_orchestrator
 from ..models.pipeline_context import ProcessingContext
 
 # ==============================================================================
 # 视频URL处理任务 (全自动流水线)
 # ==============================================================================
-async def run_url_processing_task(task_id: str, doc_id: str, url: str):
+async def run_url_processing_task(task_id: str, doc_id: str, url: str, append: bool = False):
     try:
         task_manager.update_task_progress(task_id, 10, "启动视频解析流水线...")
         
@@ -28,9 +28,14 @@ async def run_url_processing_task(task_id: str, doc_id: str, url: str):
         os.remove(raw_text_path) # 清理中间文本文件
 
         # 3. 将带时间戳的文本喂给RAPTOR
-        tree_builder = TreeBuilderService(doc_id=doc_id)
-        # 传入 is_timestamped=True，让Service知道要处理时间戳
-        frontend_tree = tree_builder.build_tree_from_text(raw_text, is_timestamped=True)
+        # 传入 is_timestamped=True，让Service知道要处理时间戳；append=True 时增量加入已有的树
+        # 由编排器排队并共享模型配额，建树在线程中运行，不阻塞事件循环；叶子层就绪后即可查询，摘要层陆续加入
+        frontend_tree, tree_builder = await build_orchestrator.build(
+            doc_id, raw_text, is_timestamped=True, append=append,
+            on_layers_ready=lambda layers: task_manager.set_layers_ready(task_id, layers),
+            on_started=lambda: task_manager.update_task_progress(task_id, 65, "开始构建语义树..."),
+            on_plan=lambda plan: task_manager.set_build_plan(task_id, plan),
+        )
 
         # 4. 任务完成，准备最终结果
         result = {
@@ -38,8 +43,10 @@ async def run_url_processing_task(task_id: str, doc_id: str, url: str):
             "doc_name": final_context.video_title,
             "doc_type": "video", # 告诉前端这是个视频
             "source_url": final_context.direct_video_url, # 返回可播放的视频链接
-            "document_tree": [node.model_dump() for node in frontend_tree]
+            "document_tree": [node.model_dump() for node in frontend_tree],
+            "update_report": tree_builder.last_update_report, # 增量更新统计，全量构建时为None
         }
+        task_manager.set_layers_ready(task_id, tree_builder.layers_ready)
         task_manager.set_task_completed(task_id, result)
         
     except Exception as e:
@@ -49,7 +56,7 @@ async def run_url_processing_task(task_id: str, doc_id: str, url: str):
 # ==============================================================================
 # PPT/PDF文件处理任务
 # ==============================================================================
-async def run_file_processing_task(task_id: str, doc_id: str, filepath: str, filename: str):
+async def run_file_processing_task(task_id: str, doc_id: str, filepath: str, filename: str, append: bool = False):
     try:
         task_manager.update_task_progress(task_id, 20, "开始解析文件内容...")
         
@@ -61,8 +68,12 @@ async def run_file_processing_task(task_id: str, doc_id: str, filepath: str, fil
         task_manager.update_task_progress(task_id, 60, "文件解析完成，开始构建语义树...")
         
         # 2. 将纯文本喂给RAPTOR
-        tree_builder = TreeBuilderService(doc_id=doc_id)
-        frontend_tree = tree_builder.build_tree_from_text(raw_text, is_timestamped=False)
+        frontend_tree, tree_builder = await build_orchestrator.build(
+            doc_id, raw_text, is_timestamped=False, append=append,
+            on_layers_ready=lambda layers: task_manager.set_layers_ready(task_id, layers),
+            on_started=lambda: task_manager.update_task_progress(task_id, 65, "开始构建语义树..."),
+            on_plan=lambda plan: task_manager.set_build_plan(task_id, plan),
+        )
         
         # 3. 任务完成
         result = {
@@ -70,8 +81,10 @@ async def run_file_processing_task(task_id: str, doc_id: str, filepath: str, fil
             "doc_name": filename,
             "doc_type": "document",
             "source_url": None, # 文件类型没有直接的播放URL
-            "document_tree": [node.model_dump() for node in frontend_tree]
+            "document_tree": [node.model_dump() for node in frontend_tree],
+            "update_report": tree_builder.last_update_report,
         }
+        task_manager.set_layers_ready(task_id, tree_builder.layers_ready)
         task_manager.set_task_completed(task_id, result)
         
     except Exception as e:
@@ -1,6 +1,6 @@
 # /app/tasks/task_manager.py
 
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 class TaskManager:
     """
@@ -19,7 +19,9 @@ class TaskManager:
             "step": "任务已创建，等待执行...",
             "doc_id": doc_id,
             "result": None,
-            "error": None
+            "error": None,
+            "layers_ready": [],
+            "build_plan": None
         }
 
     def get_task_status(self, task_id: str) -> Dict[str, Any]:
@@ -32,6 +34,18 @@ class TaskManager:
             self._tasks[task_id]['step'] = step
             print(f"任务管理器: 更新任务 {task_id} -> {step} ({progress}%)")
 
+    def set_layers_ready(self, task_id: str, layers_ready: List[int]):
+        """记录文档树中已可查询的层 (0为叶子层)，叶子层就绪后即可提问。"""
+        if task_id in self._tasks:
+            self._tasks[task_id]['layers_ready'] = list(layers_ready)
+            print(f"任务管理器: 任务 {task_id} 可查询的层 -> {layers_ready}")
+
+    def set_build_plan(self, task_id: str, build_plan: Dict[str, Any]):
+        """记录构建开始前生成的构建计划及调用数/耗时预估。"""
+        if task_id in self._tasks:
+            self._tasks[task_id]['build_plan'] = build_plan
+            print(f"任务管理器: 任务 {task_id} 构建计划 -> {build_plan}")
+
     def set_task_completed(self, task_id: str, result: Dict):
         if task_id in self._tasks:
             self._tasks[task_id]['status'] = 'COMPLETED'
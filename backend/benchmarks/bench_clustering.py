@@ -0,0 +1,116 @@
+"""
+Benchmark: clustering time and peak memory of cluster_utils.perform_clustering for
+growing leaf counts, plus the cluster-membership mapping step on its own, comparing
+the old embedding-equality search with index tracking. It first asserts that
+select_gmm chooses the same cluster count and labels for every n_jobs setting.
+
+Usage:
+    python benchmarks/bench_clustering.py --sizes 1000 5000 20000 --dim 1024
+    python benchmarks/bench_clustering.py --mapping-only
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.raptor.cluster_utils import (labels_to_clusters,  # noqa: E402
+                                      perform_clustering, select_gmm)
+
+
+def synthetic_embeddings(n, dim, n_topics, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_topics, dim)) * 3
+    topics = rng.integers(0, n_topics, size=n)
+    return (centers[topics] + rng.standard_normal((n, dim))).astype(np.float32)
+
+
+def legacy_mapping(embeddings, global_members, local_labels, n_local):
+    # The pre-index-tracking lookup: an n x m x d equality tensor per local cluster
+    subset = embeddings[global_members]
+    mapped = []
+    for j in range(n_local):
+        local_embeddings = subset[np.array([j in label for label in local_labels])]
+        mapped.append(np.where((embeddings == local_embeddings[:, None]).all(-1))[1])
+    return mapped
+
+
+def indexed_mapping(embeddings, global_members, local_labels, n_local):
+    return [global_members[members] for members in labels_to_clusters(local_labels, n_local)]
+
+
+def check_n_jobs_determinism(n_blobs=12, per_blob=40, dim=5):
+    # Gaussian blobs: a clear BIC optimum that serial and parallel searches must agree on
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(-10, 10, size=(n_blobs, dim))
+    embeddings = np.repeat(centers, per_blob, axis=0) + rng.standard_normal((n_blobs * per_blob, dim))
+
+    selections = {}
+    for n_jobs in (None, 4, -1):
+        n_clusters, gm = select_gmm(embeddings, random_state=0, n_jobs=n_jobs)
+        selections[n_jobs] = (n_clusters, gm.predict(embeddings))
+    reference_k, reference_labels = selections[None]
+    for n_jobs, (n_clusters, labels) in selections.items():
+        assert n_clusters == reference_k, f"n_jobs={n_jobs} chose k={n_clusters}, serial chose k={reference_k}"
+        assert np.array_equal(labels, reference_labels), f"n_jobs={n_jobs} labels differ from serial"
+    print(f"select_gmm on {n_blobs} blobs: k={reference_k} for n_jobs None/4/-1, identical labels\n")
+
+
+def profile(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--reduction-dimension", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--mapping-only", action="store_true", help="skip the full UMAP+GMM pipeline")
+    parser.add_argument("--legacy-limit", type=int, default=5000, help="largest size to run the legacy mapping on")
+    args = parser.parse_args()
+
+    check_n_jobs_determinism()
+
+    print("membership mapping (one global cluster holding half the rows, 20 local clusters)")
+    print(f"{'nodes':>8}{'legacy (s)':>12}{'legacy peak (MB)':>18}{'indexed (s)':>13}{'indexed peak (MB)':>19}")
+    rng = np.random.default_rng(1)
+    for n in args.sizes:
+        embeddings = synthetic_embeddings(n, args.dim, n_topics=max(2, n // 200))
+        global_members = np.sort(rng.choice(n, size=n // 2, replace=False))
+        local_labels = [np.array([label]) for label in rng.integers(0, 20, size=len(global_members))]
+
+        indexed, indexed_time, indexed_peak = profile(indexed_mapping, embeddings, global_members, local_labels, 20)
+        if n <= args.legacy_limit:
+            _, legacy_time, legacy_peak = profile(legacy_mapping, embeddings, global_members, local_labels, 20)
+            legacy = f"{legacy_time:>12.3f}{legacy_peak / 2**20:>18.1f}"
+        else:
+            legacy = f"{'skipped':>12}{'':>18}"
+        print(f"{n:>8}{legacy}{indexed_time:>13.4f}{indexed_peak / 2**20:>19.2f}")
+
+    if args.mapping_only:
+        return
+
+    print("\nperform_clustering (UMAP + GMM, global and local passes)")
+    print(f"{'nodes':>8}{'time (s)':>12}{'peak (MB)':>12}{'clusters':>10}")
+    for n in args.sizes:
+        embeddings = synthetic_embeddings(n, args.dim, n_topics=max(2, n // 200))
+        clusters, elapsed, peak = profile(
+            perform_clustering, embeddings, args.reduction_dimension, args.threshold
+        )
+        print(f"{n:>8}{elapsed:>12.2f}{peak / 2**20:>12.1f}{len(clusters):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark: per-row scipy distances vs. the vectorized distance engine in raptor.utils.
+
+Reproduces the query path of TreeRetriever.retrieve_information_collapse_tree
+(distances to every node followed by nearest-neighbour selection) for growing
+node counts.
+
+Usage:
+    python benchmarks/bench_distances.py --dim 1024 --sizes 1000 5000 10000 20000
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy import spatial
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.raptor.utils import (distances_from_embeddings,  # noqa: E402
+                              indices_of_nearest_neighbors_from_distances)
+
+SCIPY_METRICS = {
+    "cosine": spatial.distance.cosine,
+    "L1": spatial.distance.cityblock,
+    "L2": spatial.distance.euclidean,
+    "Linf": spatial.distance.chebyshev,
+}
+
+
+def scipy_baseline(query, embeddings, metric, top_k):
+    distances = [SCIPY_METRICS[metric](query, embedding) for embedding in embeddings]
+    return np.argsort(distances)[:top_k]
+
+
+def vectorized(query, matrix, metric, top_k):
+    distances = distances_from_embeddings(query, matrix, metric)
+    return indices_of_nearest_neighbors_from_distances(distances, top_k)
+
+
+def best_of(fn, repeats, *args):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 10000, 20000])
+    parser.add_argument("--metrics", nargs="+", default=list(SCIPY_METRICS))
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'metric':<8}{'nodes':>8}{'scipy (ms)':>14}{'vectorized (ms)':>18}{'speedup':>10}")
+
+    for metric in args.metrics:
+        for n in args.sizes:
+            matrix = rng.standard_normal((n, args.dim)).astype(np.float32)
+            embeddings = [row.tolist() for row in matrix]
+            query = rng.standard_normal(args.dim).astype(np.float32).tolist()
+
+            expected = scipy_baseline(query, embeddings, metric, args.top_k)
+            actual = vectorized(query, matrix, metric, args.top_k)
+            overlap = len(set(expected.tolist()) & set(actual.tolist()))
+
+            baseline = best_of(scipy_baseline, args.repeats, query, embeddings, metric, args.top_k)
+            fast = best_of(vectorized, args.repeats, query, matrix, metric, args.top_k)
+            print(
+                f"{metric:<8}{n:>8}{baseline * 1e3:>14.2f}{fast * 1e3:>18.2f}"
+                f"{baseline / fast:>9.1f}x  (top-{args.top_k} overlap {overlap}/{args.top_k})"
+            )
+
+
+if __name__ == "__main__":
+    main()
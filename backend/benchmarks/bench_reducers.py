@@ -0,0 +1,74 @@
+"""
+Benchmark: clustering time and cluster quality of cluster_utils.perform_clustering
+with each dimensionality reducer (UMAP, PCA, Gaussian random projection, auto).
+
+Quality is the cosine silhouette score of the clusters on the original embeddings
+(each row labelled with the first cluster it belongs to) and the adjusted Rand index
+against the synthetic topics the embeddings were generated from.
+
+Usage:
+    python benchmarks/bench_reducers.py --sizes 1000 5000 20000 --dim 1024
+    python benchmarks/bench_reducers.py --reducers pca random_projection --sizes 50000
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score, silhouette_score
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.raptor.cluster_utils import REDUCERS, perform_clustering  # noqa: E402
+
+
+def synthetic_embeddings(n, dim, n_topics, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_topics, dim)) * 3
+    topics = rng.integers(0, n_topics, size=n)
+    return (centers[topics] + rng.standard_normal((n, dim))).astype(np.float32), topics
+
+
+def hard_labels(clusters, n):
+    labels = np.full(n, -1)
+    for label, rows in reversed(list(enumerate(clusters))):
+        labels[rows] = label
+    return labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--reducers", nargs="+", default=list(REDUCERS))
+    parser.add_argument("--reduction-dimension", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--silhouette-sample", type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"{'reducer':<20}{'nodes':>8}{'time (s)':>10}{'clusters':>10}{'silhouette':>12}{'ARI':>8}")
+    for n in args.sizes:
+        embeddings, topics = synthetic_embeddings(n, args.dim, n_topics=max(2, n // 200))
+        for reducer in args.reducers:
+            start = time.perf_counter()
+            clusters = perform_clustering(
+                embeddings, args.reduction_dimension, args.threshold, reducer=reducer
+            )
+            elapsed = time.perf_counter() - start
+
+            labels = hard_labels(clusters, n)
+            if len(set(labels.tolist())) > 1:
+                silhouette = silhouette_score(
+                    embeddings, labels, metric="cosine",
+                    sample_size=min(n, args.silhouette_sample), random_state=0,
+                )
+            else:
+                silhouette = float("nan")
+            ari = adjusted_rand_score(topics, labels)
+            print(f"{reducer:<20}{n:>8}{elapsed:>10.2f}{len(clusters):>10}{silhouette:>12.3f}{ari:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark: resident memory of a RAPTOR tree in the original per-object layout vs.
+the matrix-backed Tree and the compact (Tree.compact()) layout.
+
+The original layout is reproduced with a plain Node-like class that keeps a
+__dict__, a Python set of children and a dict of list-of-float embeddings.
+
+Usage:
+    python benchmarks/bench_tree_memory.py --nodes 20000 --dim 256
+"""
+
+import argparse
+import gc
+import pickle
+import sys
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.raptor.tree_structures import Node, Tree  # noqa: E402
+
+
+class LegacyNode:
+    def __init__(self, text, index, children, embeddings):
+        self.text = text
+        self.index = index
+        self.children = children
+        self.embeddings = embeddings
+
+
+def synthetic_layout(n_nodes, dim, branching, seed=0):
+    """Yields (index, text, children, embedding) for a tree with ~n_nodes nodes."""
+    rng = np.random.default_rng(seed)
+    n_leaves = int(n_nodes * (branching - 1) / branching)
+    layer = list(range(n_leaves))
+    next_index = n_leaves
+    layout = []
+    for index in layer:
+        layout.append((index, f"leaf chunk {index} " * 12, set(), rng.standard_normal(dim)))
+    while len(layer) > 1 and next_index < n_nodes:
+        parents = []
+        for start in range(0, len(layer), branching):
+            children = set(layer[start:start + branching])
+            layout.append((next_index, f"summary {next_index} " * 20, children, rng.standard_normal(dim)))
+            parents.append(next_index)
+            next_index += 1
+        layer = parents
+    return layout, n_leaves
+
+
+def build_legacy(layout):
+    return {
+        index: LegacyNode(text, index, set(children), {"EMB": embedding.tolist()})
+        for index, text, children, embedding in layout
+    }
+
+
+def build_tree(layout, n_leaves, compact):
+    all_nodes = {
+        index: Node(text, index, set(children), {"EMB": embedding.tolist()})
+        for index, text, children, embedding in layout
+    }
+    layer_to_nodes = {0: [all_nodes[i] for i in range(n_leaves)], 1: [all_nodes[i] for i in range(n_leaves, len(all_nodes))]}
+    tree = Tree(all_nodes, set(), set(range(n_leaves)), 1, layer_to_nodes)
+    return tree.compact() if compact else tree
+
+
+def measure(factory):
+    gc.collect()
+    tracemalloc.start()
+    obj = factory()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--nodes", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--branching", type=int, default=6)
+    args = parser.parse_args()
+
+    layout, n_leaves = synthetic_layout(args.nodes, args.dim, args.branching)
+    print(f"{len(layout)} nodes ({n_leaves} leaves), dim={args.dim}")
+    print(f"{'layout':<22}{'resident (MB)':>16}{'peak (MB)':>12}{'pickle (MB)':>14}")
+
+    cases = [
+        ("original objects", lambda: build_legacy(layout)),
+        ("Tree (matrix store)", lambda: build_tree(layout, n_leaves, compact=False)),
+        ("Tree.compact()", lambda: build_tree(layout, n_leaves, compact=True)),
+    ]
+    for name, factory in cases:
+        obj, current, peak = measure(factory)
+        pickled = len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+        print(f"{name:<22}{current / 2**20:>16.1f}{peak / 2**20:>12.1f}{pickled / 2**20:>14.1f}")
+        del obj
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark: per-node Python traversal vs. the CSR beam traversal in TreeRetriever.
+
+The baseline reproduces the former TreeRetriever.retrieve_information loop: an
+embeddings list rebuilt per layer, children gathered through node.children, deduplicated
+with dict.fromkeys and looked up in all_nodes. Both paths start from the top layer of a
+synthetic tree, build the context text and exclude the query embedding, which is the
+same for both. --compact runs on a compacted tree (Tree.compact()), as served by
+TreeBuilderService.
+
+Usage:
+    python benchmarks/bench_tree_traversal.py --dim 1024 --leaves 1000 10000 50000 --compact
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import tiktoken
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.raptor.EmbeddingModels import BaseEmbeddingModel  # noqa: E402
+from app.raptor.tree_retriever import (TreeRetriever,  # noqa: E402
+                                       TreeRetrieverConfig)
+from app.raptor.tree_structures import Node, Tree  # noqa: E402
+from app.raptor.utils import (distances_from_embeddings,  # noqa: E402
+                              get_embeddings, get_text,
+                              indices_of_nearest_neighbors_from_distances,
+                              normalize_embeddings)
+
+
+class FixedQueryEmbedding(BaseEmbeddingModel):
+    """Returns a precomputed query vector, so timings exclude the embedding call."""
+
+    def __init__(self, vector):
+        self.vector = vector
+
+    def create_embedding(self, text):
+        return self.vector
+
+
+def synthetic_tree(rng, n_leaves, dim, fanout):
+    nodes = {}
+    layer = []
+    for index in range(n_leaves):
+        nodes[index] = Node(f"leaf {index}", index, set(), {"EMB": rng.standard_normal(dim)}, 10)
+        layer.append(nodes[index])
+    layer_to_nodes = {0: layer}
+    while len(layer) > fanout:
+        parents = []
+        for start in range(0, len(layer), fanout):
+            children = layer[start:start + fanout]
+            index = len(nodes)
+            embedding = np.mean([child.embeddings["EMB"] for child in children], axis=0)
+            nodes[index] = Node(f"summary {index}", index, {child.index for child in children}, {"EMB": embedding}, 10)
+            parents.append(nodes[index])
+        layer_to_nodes[len(layer_to_nodes)] = parents
+        layer = parents
+    num_layers = len(layer_to_nodes) - 1
+    roots = {node.index: node for node in layer}
+    leaves = {node.index: node for node in layer_to_nodes[0]}
+    return Tree(nodes, roots, leaves, num_layers, layer_to_nodes)
+
+
+def python_traversal(tree, current_nodes, query_embedding, num_layers, top_k):
+    """The former per-node implementation of TreeRetriever.retrieve_information."""
+    selected_nodes = []
+    node_list = current_nodes
+    for layer in range(num_layers):
+        embeddings = get_embeddings(node_list, "EMB", normalized=True)
+        distances = distances_from_embeddings(query_embedding, embeddings, assume_normalized=True)
+        best_indices = indices_of_nearest_neighbors_from_distances(distances, top_k)
+        selected_nodes.extend(node_list[idx] for idx in best_indices)
+        if layer != num_layers - 1:
+            child_nodes = []
+            for index in best_indices:
+                child_nodes.extend(node_list[index].children)
+            child_nodes = list(dict.fromkeys(child_nodes))
+            node_list = [tree.all_nodes[i] for i in child_nodes]
+    return selected_nodes, get_text(selected_nodes)
+
+
+def percentiles(timings):
+    timings = np.asarray(timings) * 1e3
+    return np.percentile(timings, 50), np.percentile(timings, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--leaves", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--compact", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    tokenizer = tiktoken.get_encoding("cl100k_base")
+    print(f"{'leaves':>8}{'layers':>8}{'python p50/p99 (ms)':>22}{'csr p50/p99 (ms)':>20}{'speedup p50':>13}")
+
+    for n_leaves in args.leaves:
+        tree = synthetic_tree(rng, n_leaves, args.dim, args.fanout)
+        if args.compact:
+            tree.compact()
+        num_layers = tree.num_layers + 1
+        top_layer = tree.layer_to_nodes[tree.num_layers]
+
+        baseline_timings, csr_timings = [], []
+        for _ in range(args.queries):
+            query = normalize_embeddings(rng.standard_normal(args.dim))
+            retriever = TreeRetriever(
+                TreeRetrieverConfig(
+                    tokenizer=tokenizer,
+                    top_k=args.top_k,
+                    embedding_model=FixedQueryEmbedding(query[0]),
+                    context_embedding_model="EMB",
+                ),
+                tree,
+            )
+
+            start = time.perf_counter()
+            expected, _ = python_traversal(tree, top_layer, query, num_layers, args.top_k)
+            baseline_timings.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            actual, _ = retriever.retrieve_information(top_layer, "", num_layers)
+            csr_timings.append(time.perf_counter() - start)
+
+            assert [node.index for node in actual] == [node.index for node in expected]
+
+        baseline_p50, baseline_p99 = percentiles(baseline_timings)
+        csr_p50, csr_p99 = percentiles(csr_timings)
+        print(
+            f"{n_leaves:>8}{num_layers:>8}{baseline_p50:>12.3f} / {baseline_p99:<7.3f}"
+            f"{csr_p50:>10.3f} / {csr_p99:<7.3f}{baseline_p50 / csr_p50:>10.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark: full-scan collapsed-tree retrieval vs. the vector indexes in raptor.vector_index.
+
+The full scan reproduces the former query path of
+TreeRetriever.retrieve_information_collapse_tree: cosine distances to every node
+followed by top-k selection. Each index is built once and then queried one query at a
+time, as TreeRetriever does; the table reports build time, p50/p99 query latency and
+recall@k against the exact result. Embeddings are drawn around random topic centres,
+which gives the approximate indexes the neighbourhood structure of real text.
+
+Usage:
+    python benchmarks/bench_vector_index.py --dim 1024 --sizes 5000 20000 100000
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.raptor.utils import (distances_from_embeddings,  # noqa: E402
+                              indices_of_nearest_neighbors_from_distances,
+                              normalize_embeddings)
+from app.raptor.vector_index import faiss, get_vector_index  # noqa: E402
+
+
+def clustered_embeddings(rng, n, dim, n_topics):
+    centres = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    topics = rng.integers(0, n_topics, size=n)
+    noise = rng.standard_normal((n, dim)).astype(np.float32)
+    return normalize_embeddings(centres[topics] + 0.8 * noise)
+
+
+def full_scan(matrix, query, top_k):
+    distances = distances_from_embeddings(query, matrix, assume_normalized=True)
+    return indices_of_nearest_neighbors_from_distances(distances, top_k)
+
+
+def percentiles(timings):
+    timings = np.asarray(timings) * 1e3
+    return np.percentile(timings, 50), np.percentile(timings, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5000, 20000, 100000])
+    parser.add_argument("--indexes", nargs="+", default=["flat", "hnsw", "ivf"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    indexes = [name for name in args.indexes if name == "flat" or faiss is not None]
+    if len(indexes) < len(args.indexes):
+        print("faiss is not installed; skipping the faiss indexes")
+
+    rng = np.random.default_rng(0)
+    print(
+        f"{'nodes':>8}{'method':>12}{'build (s)':>11}{'p50 (ms)':>10}{'p99 (ms)':>10}"
+        f"{'speedup p50':>13}{'recall@' + str(args.top_k):>11}"
+    )
+
+    for n in args.sizes:
+        matrix = clustered_embeddings(rng, n, args.dim, n_topics=max(8, n // 200))
+        queries = clustered_embeddings(rng, args.queries, args.dim, n_topics=max(8, n // 200))
+        exact = [full_scan(matrix, query, args.top_k) for query in queries]
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            full_scan(matrix, query, args.top_k)
+            timings.append(time.perf_counter() - start)
+        scan_p50, scan_p99 = percentiles(timings)
+        print(f"{n:>8}{'full scan':>12}{'-':>11}{scan_p50:>10.3f}{scan_p99:>10.3f}{'1.0x':>13}{'1.000':>11}")
+
+        for name in indexes:
+            start = time.perf_counter()
+            index = get_vector_index(name).build(matrix)
+            build_seconds = time.perf_counter() - start
+
+            timings = []
+            hits = 0
+            for query, expected in zip(queries, exact):
+                start = time.perf_counter()
+                _, rows = index.search(query.reshape(1, -1), args.top_k)
+                timings.append(time.perf_counter() - start)
+                hits += len(set(rows[0].tolist()) & set(expected.tolist()))
+            p50, p99 = percentiles(timings)
+            recall = hits / (len(queries) * args.top_k)
+            print(
+                f"{n:>8}{name:>12}{build_seconds:>11.2f}{p50:>10.3f}{p99:>10.3f}"
+                f"{scan_p50 / p50:>12.1f}x{recall:>11.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()